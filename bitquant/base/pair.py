@@ -6,8 +6,8 @@ from bitquant.data.exchange import BinanceExchange
 Values = Union[int, float]
 
 def get_available_pairs(exchange=BinanceExchange, base="USDT"):
-    client = DataClient(exchange)
-    symbol_info = client.get_symbol_info()
+    with DataClient(exchange) as client:
+        symbol_info = client.get_symbol_info()
     usdt_pairs = symbol_info.loc[symbol_info["symbol"].apply(lambda x: x.endswith(base)), "symbol"].tolist()
     return usdt_pairs
 
@@ -0,0 +1,163 @@
+from typing import List, Dict, Any, Union, Tuple
+import numpy as np
+
+from bitquant.data.kline_parser import calc_return_1
+from bitquant.data.market_panel import MarketPanel, ffill
+from bitquant.utils.timeutils import TimeUtils
+
+# how every field of a panel is aggregated into a coarser bar, fields not listed take the last valid value
+_FIRST_FIELDS = ["open"]
+_MAX_FIELDS = ["high"]
+_MIN_FIELDS = ["low"]
+_SUM_FIELDS = ["volume", "usd_v", "n_trades", "taker_buy_v", "taker_buy_usd"]
+# recomputed from the aggregated fields
+_DERIVED_FIELDS = ["vwap", "return_1"]
+
+
+def aggregate_bars(values: np.ndarray, ts_in_ms: np.ndarray, fields: List[str],
+                   interval_in_ms: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Aggregate bars into bars of interval_in_ms in one vectorized pass over all symbols.
+
+    A row of a panel is the close time + 1ms of its bars, so the coarse bar of a row ends at the next multiple of
+    interval_in_ms (bars are aligned to the epoch like the exchange's). A coarse bar exists when any symbol has a
+    bar in it, the last one is still forming when its fine bars are not all in yet.
+    vwap and return_1 are left nan, see BarAggregator.
+
+    Return:
+        ts_in_ms: int64 array (n_bars,) of the coarse bars
+        values: array (n_bars, n_symbols, n_fields) of the dtype of values
+    """
+    bucket_ts = TimeUtils.ceil_ms(np.asarray(ts_in_ms), interval_in_ms)
+    if len(bucket_ts) == 0:
+        return bucket_ts, values[:0].copy()
+    starts = np.flatnonzero(np.r_[True, bucket_ts[1:] != bucket_ts[:-1]])
+    ret = np.full((len(starts),) + values.shape[1:], np.nan, dtype=values.dtype)
+
+    def indices(names):
+        return [k for k, field in enumerate(fields) if field in names]
+
+    first_idx, max_idx, min_idx, sum_idx = (indices(_FIRST_FIELDS), indices(_MAX_FIELDS), indices(_MIN_FIELDS),
+                                            indices(_SUM_FIELDS))
+    aggregated = set(first_idx + max_idx + min_idx + sum_idx + indices(_DERIVED_FIELDS))
+    last_idx = [k for k in range(len(fields)) if k not in aggregated]
+    rows = np.arange(len(values)).reshape(-1, 1, 1)
+
+    if first_idx:
+        x = values[:, :, first_idx]
+        first = np.minimum.reduceat(np.where(np.isnan(x), len(values), rows), starts, axis=0)
+        ret[:, :, first_idx] = np.where(first < len(values),
+                                        np.take_along_axis(x, first.clip(max=len(values) - 1), axis=0), np.nan)
+    if last_idx:
+        x = values[:, :, last_idx]
+        last = np.maximum.reduceat(np.where(np.isnan(x), -1, rows), starts, axis=0)
+        ret[:, :, last_idx] = np.where(last >= 0, np.take_along_axis(x, last.clip(min=0), axis=0), np.nan)
+    if max_idx:
+        # fmax and fmin skip nan, a bucket without any bar stays nan
+        ret[:, :, max_idx] = np.fmax.reduceat(values[:, :, max_idx], starts, axis=0)
+    if min_idx:
+        ret[:, :, min_idx] = np.fmin.reduceat(values[:, :, min_idx], starts, axis=0)
+    if sum_idx:
+        x = values[:, :, sum_idx]
+        valid = ~np.isnan(x)
+        ret[:, :, sum_idx] = np.where(np.logical_or.reduceat(valid, starts, axis=0),
+                                      np.add.reduceat(np.where(valid, x, 0), starts, axis=0), np.nan)
+    return bucket_ts[starts], ret
+
+
+class BarAggregator:
+    """
+    Panels of coarser intervals derived from one panel of fine bars (e.g. 1m), so one download feeds every interval.
+
+    The coarse panels are kept up to date in place by update_klines: only the coarse bars from the one containing
+    the first changed fine row on are aggregated again, history is never re-aggregated.
+    Fields not sent by an exchange (nan) stay nan in the coarse bars, vwap is usd_v / volume of the coarse bar.
+
+    usage:
+        aggregator = BarAggregator(panel_1m, ["5m", "1h"])
+        data_client.update(aggregator)
+        aggregator["1h"]
+    """
+
+    def __init__(self, source: MarketPanel, intervals: List[str]):
+        if source.interval is None:
+            raise ValueError("the interval of the source panel is unknown, set panel.interval")
+        self.source = source
+        source_interval_in_ms = TimeUtils.interval_str_to_ms(source.interval)
+        for interval in intervals:
+            if TimeUtils.interval_str_to_ms(interval) % source_interval_in_ms:
+                raise ValueError(f"{interval=} is not a multiple of the source interval {source.interval}")
+        self.panels: Dict[str, MarketPanel] = {}
+        for interval in intervals:
+            ts_in_ms, values = aggregate_bars(source.values, source.ts_in_ms, source.fields,
+                                              TimeUtils.interval_str_to_ms(interval))
+            panel = MarketPanel(values, ts_in_ms, source.symbols, source.fields, interval)
+            self._derive(panel, 0)
+            self.panels[interval] = panel
+
+    @property
+    def interval(self) -> str:
+        return self.source.interval
+
+    @property
+    def intervals(self) -> List[str]:
+        return list(self.panels)
+
+    def __getitem__(self, interval: str) -> MarketPanel:
+        if interval == self.source.interval:
+            return self.source
+        return self.panels[interval]
+
+    def __repr__(self):
+        return f"BarAggregator(source={self.source!r}, intervals={self.intervals})"
+
+    def _derive(self, panel: MarketPanel, first_row: int):
+        """vwap and return_1 of the rows from first_row on"""
+        fields = panel.fields
+        if "vwap" in fields and "usd_v" in fields and "volume" in fields:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # volume can be 0 and give nan, it is filled with the last vwap of the symbol like parse_klines does
+                vwap = panel.field("usd_v")[first_row:] / panel.field("volume")[first_row:]
+            if first_row > 0:
+                previous = panel.field("vwap")[first_row - 1].copy()
+                missing = np.isnan(previous)
+                if missing.any():
+                    previous[missing] = ffill(panel.field("vwap")[:first_row, missing])[-1]
+                filled = ffill(np.concatenate([previous[None], vwap]))[1:]
+            else:
+                filled = ffill(vwap)
+            # leading nan take the first valid value
+            filled = ffill(filled[::-1])[::-1] if first_row == 0 else filled
+            has_bar = ~np.isnan(panel.field("close")[first_row:]) if "close" in fields else True
+            panel.field("vwap")[first_row:] = np.where(has_bar, filled, np.nan)
+        if "return_1" in fields and "close" in fields:
+            # return_1 of the row before the first change depends on its close
+            st_idx = max(first_row - 1, 0)
+            panel.field("return_1")[st_idx:] = calc_return_1(panel.field("close")[st_idx:])
+
+    def refresh(self, first_changed_row: int):
+        """aggregate the coarse bars again from the one that contains the fine row first_changed_row"""
+        source = self.source
+        if first_changed_row >= len(source):
+            return
+        for interval, panel in self.panels.items():
+            interval_in_ms = TimeUtils.interval_str_to_ms(interval)
+            # open time of the coarse bar that contains the first changed row
+            bucket_st = TimeUtils.ceil_ms(source.ts_in_ms[first_changed_row], interval_in_ms) - interval_in_ms
+            source_row = int(np.searchsorted(source.ts_in_ms, bucket_st, side="right"))
+            ts_in_ms, values = aggregate_bars(source.values[source_row:], source.ts_in_ms[source_row:],
+                                              source.fields, interval_in_ms)
+            first_row = int(np.searchsorted(panel.ts_in_ms, ts_in_ms[0]))
+            panel.replace_rows(first_row, ts_in_ms, values)
+            self._derive(panel, first_row)
+
+    def update_klines(self, klines: Dict[str, Union[List[List[Any]], np.ndarray]]) -> int:
+        """
+        Write klines of the source interval into the source panel and bring every coarse panel up to date.
+
+        Return:
+            position of the first row of the source panel that changed, len(self.source) if nothing changed
+        """
+        first_changed_row = self.source.update_klines(klines)
+        self.refresh(first_changed_row)
+        return first_changed_row
@@ -0,0 +1,125 @@
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Union
+import pandas as pd
+
+from bitquant.data.bar_aggregator import BarAggregator
+from bitquant.data.data_client import DataClient
+from bitquant.data.market_panel import MarketPanel
+from bitquant.utils.timeutils import TimeUtils
+
+
+@dataclass
+class BarLatency:
+    """seconds from the bar close to the end of every stage, warm_up is negative when it ended before the close"""
+    close_ms: int
+    warm_up: float = None
+    fetch: float = None
+    compute: float = None
+    submit: float = None
+
+
+class BarScheduler:
+    """
+    Run a strategy right at every bar close.
+
+    warm_up_before seconds before a bar closes the connections to the exchanges are opened and the symbol metadata
+    is requested, so nothing but the tail bars is left to do at the close. When the bar closes its bars are
+    requested with DataClient.update (hedged on the first secondary), the updated panel is passed to `handler`,
+    e.g. StrategyEngine.run, and what the handler returns is passed to `submit`.
+    The latency of every stage from the bar close is kept in `latencies`.
+
+    A bar whose stages overrun the next close is not caught up, the scheduler waits for the close after.
+
+    args:
+        panel: MarketPanel, or BarAggregator to run at the closes of one of its coarse intervals
+        interval: bar grid the scheduler runs on, defaults to the interval of the panel
+        now_in_ms / sleep: clock of the scheduler, replaced to run it against a ReplayServer
+
+    usage:
+        scheduler = BarScheduler(data_client, panel, strategy_engine.run, submit=submit_portfolio)
+        scheduler.run()
+    """
+
+    def __init__(self, data_client: DataClient, panel: Union[MarketPanel, BarAggregator],
+                 handler: Callable[[Union[MarketPanel, BarAggregator]], Any], submit: Callable[[Any], Any] = None,
+                 interval: str = None, warm_up_before: float = 5.0, max_latencies: int = 10000,
+                 now_in_ms: Callable[[], int] = TimeUtils.now_in_ms, sleep: Callable[[float], None] = time.sleep):
+        self.data_client = data_client
+        self.panel = panel
+        self.handler = handler
+        self.submit = submit
+        self.interval = interval or panel.interval
+        if self.interval is None:
+            raise ValueError("the interval of the panel is unknown, pass interval")
+        self.interval_in_ms = TimeUtils.interval_str_to_ms(self.interval)
+        self.warm_up_before = warm_up_before
+        self.now_in_ms = now_in_ms
+        self.sleep = sleep
+        self.latencies: deque = deque(maxlen=max_latencies)
+        self.should_exit = False
+
+    def next_close_ms(self) -> int:
+        """close time of the bar that is forming now"""
+        return TimeUtils.floor_ms(self.now_in_ms(), self.interval_in_ms) + self.interval_in_ms
+
+    def _sleep_until(self, ms: int):
+        # short steps so stop() is noticed, the last step ends right at ms
+        while not self.should_exit and (remaining := ms - self.now_in_ms()) > 0:
+            self.sleep(min(remaining / 1000, 1.0))
+
+    def _since(self, close_ms: int) -> float:
+        return (self.now_in_ms() - close_ms) / 1000
+
+    def run_once(self) -> Any:
+        """wait for the next bar close, run every stage and return what the handler returned"""
+        close_ms = self.next_close_ms()
+        latency = BarLatency(close_ms)
+
+        self._sleep_until(close_ms - int(self.warm_up_before * 1000))
+        if self.should_exit:
+            return None
+        self.data_client.warm_up()
+        latency.warm_up = self._since(close_ms)
+
+        self._sleep_until(close_ms)
+        if self.should_exit:
+            return None
+        # bars with open time up to the one that just closed, the forming bar is not requested
+        self.data_client.update(self.panel, until=close_ms - 1)
+        latency.fetch = self._since(close_ms)
+
+        result = self.handler(self.panel)
+        latency.compute = self._since(close_ms)
+
+        if self.submit is not None:
+            self.submit(result)
+        latency.submit = self._since(close_ms)
+
+        self.latencies.append(latency)
+        print(f"bar closed at {TimeUtils.ms_to_timestamp(close_ms)}: fetch {latency.fetch:.3f}s "
+              f"compute {latency.compute:.3f}s submit {latency.submit:.3f}s")
+        return result
+
+    def run(self, n_bars: int = None):
+        """run at every bar close until stop() or n_bars bars, a failing bar is reported and the next one is run"""
+        self.should_exit = False
+        n = 0
+        while not self.should_exit and (n_bars is None or n < n_bars):
+            try:
+                self.run_once()
+            except Exception:
+                traceback.print_exc()
+            n += 1
+
+    def stop(self):
+        self.should_exit = True
+
+    def latency_frame(self) -> pd.DataFrame:
+        """latencies in seconds per stage indexed by the bar close"""
+        frame = pd.DataFrame([asdict(latency) for latency in self.latencies],
+                             columns=["close_ms", "warm_up", "fetch", "compute", "submit"])
+        frame.index = pd.to_datetime(frame.pop("close_ms"), unit="ms", utc=True)
+        return frame
@@ -1,36 +1,255 @@
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Tuple, Type, Union
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import pandas as pd
 import numpy as np
-from bitquant.data.exchange import BinanceExchange, ResponseType
+from bitquant.data.bar_aggregator import BarAggregator
+from bitquant.data.exchange import BaseAPIHandler, BinanceExchange, ResponseType
+from bitquant.data.kline_parser import FEATURE_DTYPE, klines_to_array
+from bitquant.data.kline_store import KlineStore
+from bitquant.data.market_panel import MarketPanel
+from bitquant.data.symbol_metadata import SymbolMetadata
 from bitquant.utils.timeutils import TimeUtils
 
 
-# TODO: maybe support multiple exchanges
-# TODO: maybe support priority get in case an exchange goes offline
+KlineRanges = Dict[str, List[Tuple[int, int]]]
+
+
+def merge_klines(klines: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """klines completed by the bars of other it does not have, ascending by open time"""
+    if len(other) == 0:
+        return klines
+    merged = np.concatenate([klines, other])
+    # np.unique keeps the first occurrence of every open time, i.e. the bar of klines
+    _, first = np.unique(merged[:, 0], return_index=True)
+    return merged[first]
+
+
 class DataClient:
-    def __init__(self, exchange: BinanceExchange):
+    """
+    args:
+        exchange: primary exchange, symbol info and the store only ever hold its data
+        secondaries: exchanges in order of priority, pages the primary fails to deliver are requested from them
+        hedge_after: seconds, when the latest bars of update() are not back from the primary by then the same
+                     request is sent to the first secondary and whichever answers first is kept
+        dtype: dtype of the panels, pass np.float64 where the prices themselves are evaluated
+    """
+    def __init__(self, exchange: BinanceExchange, store: KlineStore = None,
+                 secondaries: List[Type[BaseAPIHandler]] = None, hedge_after: float = 2.0, dtype=FEATURE_DTYPE):
         self.exchange = exchange
+        self.store = store
+        self.dtype = dtype
+        self.secondaries = secondaries or []
+        self.hedge_after = hedge_after
+        self._executor = ThreadPoolExecutor(max_workers=2 + len(self.secondaries), thread_name_prefix="bitquant-data-client")
+        # exchange info is cached per exchange and refreshed in the background
+        self.symbol_metadata = SymbolMetadata.for_exchange(exchange)
+
+    def close(self):
+        """stop the threads of the hedged and warm up requests, the client is not used afterwards"""
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-    def get_symbol_info(self) -> List[Dict[str, ResponseType]]:
-        symbol_info = self.exchange.get_symbol_info()
-        return symbol_info
+    def get_symbol_info(self) -> pd.DataFrame:
+        return self.symbol_metadata.get_symbol_info()
 
 
-    def get_symbol_info_by_symbols(self, symbols: List[str]):
-        symbol_info = self.exchange.get_symbol_info()
-        symbol_info = symbol_info.loc[symbol_info["symbol"].isin(symbols)]
-        # sort by symbols
-        sorting_key = {name: order for order, name in enumerate(symbols)}
-        symbol_info['SortKey'] = symbol_info['symbol'].map(sorting_key)
-        symbol_info = symbol_info.sort_values('SortKey').drop(columns='SortKey')
-        return symbol_info
+    def get_symbol_info_by_symbols(self, symbols: List[str]) -> pd.DataFrame:
+        # sorted by symbols
+        return self.symbol_metadata.get_symbol_info_by_symbols(symbols)
+
+    def warm_up(self):
+        """
+        Open the connections to every exchange and make sure the symbol metadata is cached, so the requests
+        right after a bar close neither wait for a handshake nor for the exchange info.
+        """
+        warming = [self._executor.submit(exchange.warm_up) for exchange in [self.exchange] + self.secondaries]
+        self.symbol_metadata.get()
+        wait(warming)
 
     def get_aggregated_symbols_kline(self, symbols: List[str], interval, st, et):
-        aggregated_klines = self.exchange.get_aggregated_symbols_kline(symbols, interval, st, et)
-        return aggregated_klines
+        return self.get_market_panel(symbols, interval, st, et).to_frame()
+
+    def get_market_panel(self, symbols: List[str], interval, st, et, dtype=None) -> MarketPanel:
+        dtype = self.dtype if dtype is None else dtype
+        st_in_ms = TimeUtils.dt_str_to_ms(st, format="%Y-%m-%d %H:%M:%S")
+        et_in_ms = TimeUtils.dt_str_to_ms(et, format="%Y-%m-%d %H:%M:%S")
+        return self._get_market_panel(symbols, interval, st_in_ms, et_in_ms, dtype)
+
+    def get_recent_market_panel(self, symbols: List[str], interval, n_bars: int, until: Union[str, int] = None,
+                                dtype=None) -> MarketPanel:
+        """
+        Panel of the last n_bars bars, e.g. the StrategyEngine.lookback() + 1 bars a score needs, instead of a
+        fixed range of days.
+
+        args:
+            until: "%Y-%m-%d %H:%M:%S" or epoch ms, defaults to now, the bar that is forming at `until` is the last one
+        """
+        dtype = self.dtype if dtype is None else dtype
+        interval_in_ms = TimeUtils.interval_str_to_ms(interval)
+        et_in_ms = TimeUtils.floor_ms(self._until_in_ms(until), interval_in_ms)
+        return self._get_market_panel(symbols, interval, et_in_ms - (n_bars - 1) * interval_in_ms, et_in_ms, dtype)
+
+    def _get_market_panel(self, symbols: List[str], interval, st_in_ms: int, et_in_ms: int, dtype) -> MarketPanel:
+        if self.store is None:
+            klines = self.get_klines(interval, {symbol: [(st_in_ms, et_in_ms)] for symbol in symbols})
+        else:
+            klines = self.get_klines_from_store(symbols, interval, st_in_ms, et_in_ms)
+        return MarketPanel.from_klines(klines, symbols, dtype=dtype, interval=interval)
+
+    @staticmethod
+    def _until_in_ms(until: Union[str, int, None]) -> int:
+        if until is None:
+            return TimeUtils.now_in_ms()
+        if isinstance(until, str):
+            return TimeUtils.dt_str_to_ms(until, format="%Y-%m-%d %H:%M:%S")
+        return int(until)
+
+    def get_bar_aggregator(self, symbols: List[str], intervals: List[str], st, et, base_interval: str = "1m",
+                           dtype=None) -> BarAggregator:
+        """
+        Panels of every interval from one download of base_interval bars, keep them up to date with update().
+        st is moved back to the open time of the coarsest bar it falls in, so the first coarse bars are complete.
+        """
+        coarsest_in_ms = max(TimeUtils.interval_str_to_ms(interval) for interval in intervals)
+        st_in_ms = TimeUtils.floor_ms(TimeUtils.dt_str_to_ms(st, format="%Y-%m-%d %H:%M:%S"), coarsest_in_ms)
+        st = TimeUtils.timestamp_to_dt_str(TimeUtils.ms_to_timestamp(st_in_ms), format="%Y-%m-%d %H:%M:%S")
+        panel = self.get_market_panel(symbols, base_interval, st, et, dtype=dtype)
+        return BarAggregator(panel, intervals)
+
+    def fetch_klines(self, interval: str, ranges: KlineRanges,
+                     hedge=False) -> Tuple[Dict[str, np.ndarray], KlineRanges, Dict[str, np.ndarray]]:
+        """
+        Request the ranges from the primary exchange, the pages it fails to deliver are requested from the
+        secondaries in order. With hedge the whole request is also sent to the first secondary once the primary
+        has not answered within hedge_after seconds, the first complete answer is kept.
+
+        Return:
+            klines of the primary, ranges the primary did not deliver, klines of the secondaries for those ranges
+        """
+        primary = self._executor.submit(self.exchange.get_klines_by_ranges, interval, ranges, return_failed=True)
+        if hedge and self.secondaries and not wait([primary], timeout=self.hedge_after).done:
+            hedged = self._executor.submit(self.secondaries[0].get_klines_by_ranges, interval, ranges, return_failed=True)
+            done, _ = wait([primary, hedged], return_when=FIRST_COMPLETED)
+            first, second = (primary, hedged) if primary in done else (hedged, primary)
+            if not any(first.result()[1].values()):
+                winner = first
+            else:
+                # the first answer is incomplete, the other one may still be complete
+                winner = second if not any(second.result()[1].values()) else primary
+            if winner is hedged:
+                print(f"{self.exchange.__name__} did not answer within {self.hedge_after}s, "
+                      f"kept the klines of {self.secondaries[0].__name__}")
+                return {}, ranges, hedged.result()[0]
+        klines, failed = primary.result()
+
+        fallback = {}
+        remaining = failed
+        for secondary in self.secondaries:
+            remaining = {symbol: symbol_ranges for symbol, symbol_ranges in remaining.items() if symbol_ranges}
+            if not remaining:
+                break
+            print(f"{sum(map(len, remaining.values()))} pages of {self.exchange.__name__} failed, "
+                  f"requesting them from {secondary.__name__}")
+            fetched, remaining = secondary.get_klines_by_ranges(interval, remaining, return_failed=True)
+            for symbol, symbol_klines in fetched.items():
+                fallback[symbol] = merge_klines(fallback.get(symbol, klines_to_array([])), symbol_klines)
+        return klines, failed, fallback
+
+    def get_klines(self, interval: str, ranges: KlineRanges, hedge=False) -> Dict[str, np.ndarray]:
+        """klines of the ranges from the primary exchange, completed by the secondaries"""
+        klines, _, fallback = self.fetch_klines(interval, ranges, hedge=hedge)
+        return {symbol: merge_klines(klines.get(symbol, klines_to_array([])), fallback.get(symbol, klines_to_array([])))
+                for symbol in ranges}
+
+    def update(self, panel: Union[MarketPanel, BarAggregator], until: Union[str, int] = None,
+               interval: str = None) -> Union[MarketPanel, BarAggregator]:
+        """
+        Append the bars that closed since the panel was built, in place.
+        For a BarAggregator the bars of its source interval are requested and every coarse panel is updated.
+
+        Every symbol is requested from the open time of its last bar in the panel, so a bar that was still
+        forming is replaced, and symbols without any bar are requested from the start of the panel.
+
+        args:
+            until: "%Y-%m-%d %H:%M:%S" or epoch ms, defaults to now, the bar that is forming at `until` is included
+            interval: defaults to panel.interval
+
+        The latest bars are requested with a hedge on the first secondary, so a slow primary near the bar close
+        delays the update by at most hedge_after seconds plus the latency of the secondary.
+        """
+        target = panel
+        if isinstance(panel, BarAggregator):
+            panel = panel.source
+        interval = interval or panel.interval
+        if interval is None:
+            raise ValueError("the interval of the panel is unknown, pass interval")
+        if len(panel) == 0:
+            raise ValueError("cannot update an empty panel, build it with get_market_panel")
+        interval_in_ms = TimeUtils.interval_str_to_ms(interval)
+        et_in_ms = TimeUtils.floor_ms(self._until_in_ms(until), interval_in_ms)
+
+        # ts of a row is the close time of its bar, the open time is one interval earlier
+        has_close = ~np.isnan(panel.field("close"))
+        last_row = len(panel) - 1 - np.argmax(has_close[::-1], axis=0)
+        st_in_ms = np.where(has_close.any(axis=0), panel.ts_in_ms[last_row], panel.ts_in_ms[0]) - interval_in_ms
+
+        if self.store is None:
+            ranges = {symbol: [(int(st_), et_in_ms)] if st_ <= et_in_ms else []
+                      for symbol, st_ in zip(panel.symbols, st_in_ms)}
+            klines = self.get_klines(interval, ranges, hedge=True)
+        else:
+            # the store only requests what it has not covered, reading the few extra rows from disk is cheap
+            klines = self.get_klines_from_store(panel.symbols, interval, int(st_in_ms.min()), et_in_ms, hedge=True)
+        target.update_klines(klines)
+        return target
+
+    def get_klines_from_store(self, symbols: List[str], interval, st_in_ms: int, et_in_ms: int,
+                              hedge=False) -> Dict[str, np.ndarray]:
+        """
+        Read klines from the store and only request the ranges it has not covered yet.
+        Closed bars of the response are appended to the store, the forming bar is only returned.
+        Bars of the secondaries are only returned, their ranges stay missing and are requested again next time.
+        """
+        interval_in_ms = TimeUtils.interval_str_to_ms(interval)
+        ranges = {symbol: self.store.missing_ranges(symbol, interval, st_in_ms, et_in_ms, interval_in_ms)
+                  for symbol in symbols}
+        fetched, failed, fallback = self.fetch_klines(interval, ranges, hedge=hedge)
+
+        # open time of the last bar that is already closed
+        last_closed_ms = TimeUtils.floor_ms(TimeUtils.now_in_ms(), interval_in_ms) - interval_in_ms
+        klines = {}
+        for symbol in symbols:
+            new_klines = klines_to_array(fetched.get(symbol, []))
+            self.store.write(symbol, interval, new_klines[new_klines[:, 0] <= last_closed_ms])
+            for range_st, range_et in ranges[symbol]:
+                # a range with a failed page is requested again next time
+                if any(failed_st <= range_et and failed_et >= range_st for failed_st, failed_et in failed.get(symbol, [])):
+                    continue
+                if range_st <= min(range_et, last_closed_ms):
+                    self.store.mark_covered(symbol, interval, range_st, min(range_et, last_closed_ms), interval_in_ms)
+
+            forming_klines = new_klines[(new_klines[:, 0] > last_closed_ms) & (new_klines[:, 0] <= et_in_ms)]
+            klines[symbol] = np.concatenate([self.store.read(symbol, interval, st_in_ms, et_in_ms), forming_klines])
+            if symbol in fallback:
+                fallback_klines = fallback[symbol]
+                fallback_klines = fallback_klines[(fallback_klines[:, 0] >= st_in_ms) & (fallback_klines[:, 0] <= et_in_ms)]
+                klines[symbol] = merge_klines(klines[symbol], fallback_klines)
+        return klines
 
-    def run(self, symbols: List[str], interval, st, et):
-        aggregated_klines = self.get_aggregated_symbols_kline(symbols, interval, st, et)
+    def run(self, symbols: List[str], interval, st, et, as_panel=False):
+        """
+        Return:
+            symbol_info, klines as (ts, symbol) MultiIndex DataFrame, or as MarketPanel with as_panel
+        """
+        if as_panel:
+            aggregated_klines = self.get_market_panel(symbols, interval, st, et)
+        else:
+            aggregated_klines = self.get_aggregated_symbols_kline(symbols, interval, st, et)
         symbol_info = self.get_symbol_info_by_symbols(symbols)
         return symbol_info, aggregated_klines
 
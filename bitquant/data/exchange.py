@@ -1,12 +1,16 @@
 from abc import abstractmethod, ABC
-from typing import List, Callable, Dict, Any, Union
+from typing import List, Callable, Dict, Any, Union, Tuple, Optional
 
 import pandas as pd
 import numpy as np
 import requests
 import asyncio
 import aiohttp
-import traceback
+import threading
+from concurrent.futures import Future, wait
+from bitquant.data.fetch_engine import FetchEngine, FetchResult, Transport
+from bitquant.data.kline_parser import KLINE_COLUMNS, klines_to_array, ohlcv_to_klines
+from bitquant.data.market_panel import MarketPanel
 from bitquant.utils.timeutils import TimeUtils
 
 
@@ -23,6 +27,14 @@ ResponseType = Union[str, float, int]
 class BaseAPIHandler(ABC):
     base_url: str
     limit_per_second: int
+    # set when the exchange reports the used request weight in a response header
+    weight_header: str = None
+    weight_limit: int = None
+    request_weight: int = 1
+    max_concurrency: int = 16
+
+    _fetch_engine_lock = threading.Lock()
+    _in_flight_lock = threading.Lock()
 
     @classmethod
     def get_json(cls, endpoint: str, params: Dict[str, ResponseType] = {}):
@@ -52,15 +64,75 @@ class BaseAPIHandler(ABC):
             return data
 
     @classmethod
-    async def batch_get_json(cls, endpoint: str, params: List[Dict[str, ResponseType]] = []):
+    def _transport(cls) -> Optional[Transport]:
+        """transport of the fetch engine, None for the aiohttp requests to base_url"""
+        return None
+
+    @classmethod
+    def fetch_engine(cls) -> FetchEngine:
+        # one engine per exchange class, so its limit holds for every caller in the process
+        with cls._fetch_engine_lock:
+            if "_fetch_engine" not in cls.__dict__:
+                cls._fetch_engine = FetchEngine(limit_per_second=cls.limit_per_second,
+                                                max_concurrency=cls.max_concurrency,
+                                                request_weight=cls.request_weight,
+                                                weight_header=cls.weight_header,
+                                                weight_limit=cls.weight_limit,
+                                                transport=cls._transport())
+            return cls._fetch_engine
+
+    @classmethod
+    def in_flight_pages(cls) -> Dict[Tuple[str, str], List[Tuple[int, int, Future]]]:
+        """
+        kline pages of the exchange that are being fetched, {(symbol, interval): [(st, et, future), ...]},
+        the future resolves to the parsed page or None when the page failed
+        """
+        with cls._in_flight_lock:
+            if "_in_flight" not in cls.__dict__:
+                cls._in_flight = {}
+            return cls._in_flight
+
+    @staticmethod
+    def _plan_pages(in_flight, plan, key, st_in_ms, et_in_ms, interval_in_ms, limit) -> List[Tuple[str, int, int, Future]]:
+        """pages of [st_in_ms, et_in_ms] added to the plan and registered as in flight"""
+        pages = []
+        # a gap between two pages of other calls holds no bar when it is shorter than an interval
+        for st_ in range(TimeUtils.ceil_ms(st_in_ms, interval_in_ms), et_in_ms + 1, interval_in_ms * limit):
+            et_ = min(st_ + interval_in_ms * (limit - 1), et_in_ms)
+            future = Future()
+            in_flight.setdefault(key, []).append((st_, et_, future))
+            plan.append((key, st_, et_, future))
+            pages.append((key[0], st_, et_, future))
+        return pages
+
+    # cheapest endpoint of the exchange, requested to open a pooled connection before it is needed
+    ping_endpoint: str = None
+
+    @classmethod
+    def warm_up(cls) -> bool:
+        """open a connection of the shared session to the exchange ahead of a latency critical request"""
+        if cls.ping_endpoint is None:
+            return False
+        result = cls.fetch_engine().run(cls.base_url + cls.ping_endpoint, [{}])
+        if not result.complete:
+            print(f"warm up of {cls.__name__} failed: {list(result.errors.values())}")
+        return result.complete
+
+    @classmethod
+    async def batch_fetch(cls, endpoint: str, params: List[Dict[str, ResponseType]] = []) -> FetchResult:
         url = cls.base_url + endpoint
-        # timeout = aiohttp.ClientTimeout(total=15) # use limit_per_second??
-        async with aiohttp.ClientSession() as session:
-            # tasks = [asyncio.ensure_future(cls.async_get_json(session=session, url=url, param=param) for param in params)]
-            tasks = [cls.async_get_json(session=session, url=url, param=param) for param in params]
-            all_responses = await asyncio.gather(*tasks)
-            # concatenate responses
-            all_responses = [element for innerList in all_responses for element in innerList]
+        result = await cls.fetch_engine().fetch_all(url, params)
+        if not result.complete:
+            print(f"{len(result.errors)}/{len(params)} requests failed for {url=} for {cls.__name__}: "
+                  f"{[(params[i], repr(e)) for i, e in result.errors.items()][:5]}")
+        return result
+
+    @classmethod
+    async def batch_get_json(cls, endpoint: str, params: List[Dict[str, ResponseType]] = []):
+        """Return the concatenated responses of every page that succeeded, failed pages are reported and skipped"""
+        result = await cls.batch_fetch(endpoint, params)
+        # concatenate responses
+        all_responses = [element for innerList in result.ordered_responses() for element in innerList]
         return all_responses
 
     @classmethod
@@ -68,15 +140,178 @@ class BaseAPIHandler(ABC):
     def get_exchange_info(cls, filters: list = None):
         pass
 
+    @classmethod
+    def get_klines(cls, params: List[Dict[str, ResponseType]]=None, asynchonous_batch=True):
+        '''
+        Raw responses of the kline endpoint for every request params, see get_klines_by_ranges for parsed klines
+        Return:
+            List[all_symbols_list[kline_data_list]]
+        '''
+        if asynchonous_batch:
+            return asyncio.run(cls.batch_get_json(endpoint=cls.kline_endpoint, params=params))
+        else:
+            return [cls.get_json(cls.kline_endpoint, param) for param in params]
+
+
+    @staticmethod
+    def parse_volume_precision(stepSize: str) -> int:
+        if '.' in stepSize and stepSize.split('.')[0] == '0':
+            volume_precision = len(stepSize.split('.')[1])
+        elif '.' in stepSize and stepSize.split('.')[0] != '0':
+            volume_precision = 0
+        else:
+            volume_precision = 0
+        return volume_precision
+
+    # ===== klines, normalized to KLINE_COLUMNS by every exchange =====
+
+    # endpoint of the kline history and the most bars one request returns
+    kline_endpoint: str
+    kline_limit: int = 1000
+
     @classmethod
     @abstractmethod
-    async def get_klines(cls, symbol, interval, st, et):
+    def kline_params(cls, symbol: str, interval: str, st_in_ms: int, et_in_ms: int, limit: int) -> Dict[str, ResponseType]:
+        """request params of the bars with open time in [st_in_ms, et_in_ms], at most `limit` of them"""
         pass
 
+    @classmethod
+    @abstractmethod
+    def parse_kline_page(cls, payload: Any, interval_in_ms: int) -> np.ndarray:
+        """float64 array laid out as KLINE_COLUMNS ascending by open time, fields the exchange lacks are nan"""
+        pass
+
+    @classmethod
+    def get_klines_by_symbol(cls, symbols: List[str], interval: str, st: str, et: str):
+        st_in_ms = TimeUtils.dt_str_to_ms(st, format="%Y-%m-%d %H:%M:%S")
+        et_in_ms = TimeUtils.dt_str_to_ms(et, format="%Y-%m-%d %H:%M:%S")
+        return cls.get_klines_by_ranges(interval, {symbol: [(st_in_ms, et_in_ms)] for symbol in symbols})
+
+    @classmethod
+    def get_klines_by_ranges(cls, interval: str, ranges: Dict[str, List[Tuple[int, int]]], return_failed=False,
+                             on_page: Callable[[str, np.ndarray], None] = None):
+        """
+        Fetch every (symbol, page) of the universe as one plan on the shared fetch engine,
+        so symbols are not serialized and the whole plan runs under the exchange's rate limit.
+        Pages that another call of the process already has in flight are shared instead of requested again.
+
+        args:
+            ranges: {symbol: [(st_in_ms, et_in_ms), ...]}, both ends are open times and included
+            on_page: called with (symbol, page as float64 array) as soon as a page arrives
+        Return:
+            {symbol: float64 kline array laid out as KLINE_COLUMNS}, ascending by open time
+            with return_failed also {symbol: [(st_in_ms, et_in_ms), ...]} of the pages that could not be fetched
+        """
+        limit = cls.kline_limit
+        interval_in_ms = TimeUtils.interval_str_to_ms(interval)
+        endpoint = cls.kline_endpoint
+
+        # single flight: the parts of a range that are already in flight (requested by any caller of the process)
+        # are not requested again, the caller waits for those pages and takes their rows. Only the gaps are paged,
+        # one page per symbol and request interval, both ends of a page are included
+        in_flight = cls.in_flight_pages()
+        needed, plan = [], []
+        with cls._in_flight_lock:
+            for symbol, symbol_ranges in ranges.items():
+                key = (symbol, interval)
+                for st_in_ms, et_in_ms in symbol_ranges:
+                    cursor = st_in_ms
+                    for page_st, page_et, future in sorted(in_flight.get(key, []), key=lambda entry: entry[0]):
+                        if page_et < cursor or page_st > et_in_ms:
+                            continue
+                        if page_st > cursor:
+                            needed += cls._plan_pages(in_flight, plan, key, cursor, page_st - 1, interval_in_ms, limit)
+                        needed.append((symbol, max(page_st, cursor), min(page_et, et_in_ms), future))
+                        cursor = page_et + 1
+                    if cursor <= et_in_ms:
+                        needed += cls._plan_pages(in_flight, plan, key, cursor, et_in_ms, interval_in_ms, limit)
+        futures = [future for _, _, _, future in needed]
+        params = [cls.kline_params(key[0], interval, st_, et_, limit) for key, st_, et_, _ in plan]
+
+        def rows_of(page, st_, et_):
+            # a view of the shared page, every caller gets the same parsed buffer
+            return page[np.searchsorted(page[:, 0], st_):np.searchsorted(page[:, 0], et_, side="right")]
+
+        def page_callback(symbol, st_, et_):
+            def callback(future):
+                if future.result() is not None:
+                    on_page(symbol, rows_of(future.result(), st_, et_))
+            return callback
+
+        if on_page is not None:
+            for (symbol, st_, et_, _), future in zip(needed, futures):
+                future.add_done_callback(page_callback(symbol, st_, et_))
+
+        # pages are parsed while the rest of the plan is still in flight
+        def collect(i, payload):
+            try:
+                page = cls.parse_kline_page(payload, interval_in_ms)
+            except Exception as e:
+                # an error body with status 200, the page is reported as failed
+                print(f"error {e=} parsing {params[i]=} for {cls.__name__}")
+                return
+            plan[i][3].set_result(page)
+
+        try:
+            if plan:
+                result = cls.fetch_engine().run(cls.base_url + endpoint, params, on_result=collect)
+                if not result.complete:
+                    print(f"{len(result.errors)}/{len(params)} requests failed for {endpoint=} for {cls.__name__}: "
+                          f"{[(params[i], repr(e)) for i, e in result.errors.items()][:5]}")
+        finally:
+            with cls._in_flight_lock:
+                for key, st_, et_, future in plan:
+                    if not future.done():
+                        future.set_result(None)
+                    in_flight[key] = [entry for entry in in_flight[key] if entry[2] is not future]
+                    if not in_flight[key]:
+                        del in_flight[key]
+        wait(futures)
+
+        ret = {symbol: [] for symbol in ranges}
+        failed = {symbol: [] for symbol in ranges}
+        for (symbol, st_, et_, _), future in zip(needed, futures):
+            page = future.result()
+            if page is not None:
+                ret[symbol].append(rows_of(page, st_, et_))
+            else:
+                failed[symbol].append((st_, et_))
+        ret = {symbol: np.concatenate(symbol_pages) if symbol_pages else klines_to_array([])
+               for symbol, symbol_pages in ret.items()}
+        if return_failed:
+            return ret, failed
+        return ret
+
+    @classmethod
+    def get_aggregated_symbols_kline(cls, symbols: List[str], interval: str, st: str, et: str) -> pd.DataFrame:
+        klines = cls.get_klines_by_symbol(symbols, interval, st, et)
+        return cls.aggregate_klines(klines, symbols)
+
+    @classmethod
+    def get_market_panel(cls, symbols: List[str], interval: str, st: str, et: str, dtype=np.float64) -> MarketPanel:
+        klines = cls.get_klines_by_symbol(symbols, interval, st, et)
+        return MarketPanel.from_klines(klines, symbols, dtype=dtype, interval=interval)
+
+    @classmethod
+    def aggregate_klines(cls, klines: Dict[str, Union[List[List[Any]], np.ndarray]], symbols: List[str],
+                         dtype=np.float64) -> pd.DataFrame:
+        """
+        Return:
+            DataFrame indexed by (ts, symbol) with PANEL_FIELDS and return_1 as columns,
+            ts is the union of the bar close times of all symbols, missing bars are nan
+        """
+        return MarketPanel.from_klines(klines, symbols, dtype=dtype).to_frame()
+
 
 class BinanceExchange(BaseAPIHandler):
     base_url="https://fapi.binance.com"
     limit_per_second=int(20000 / 60 / 5)
+    weight_header="X-MBX-USED-WEIGHT-1M"
+    weight_limit=2400
+    # continuousKlines with limit=1000
+    request_weight=5
+    kline_endpoint="/fapi/v1/continuousKlines"
+    ping_endpoint="/fapi/v1/ping"
 
     @classmethod
     def get_exchange_info(cls) -> Dict:
@@ -84,21 +319,12 @@ class BinanceExchange(BaseAPIHandler):
 
     @classmethod
     def get_symbol_info(cls):
-        def parse_volume_precision(stepSize):
-            if '.' in stepSize and stepSize.split('.')[0] == '0':
-                volume_precision = len(stepSize.split('.')[1])
-            elif '.' in stepSize and stepSize.split('.')[0] != '0':
-                volume_precision = 0
-            else:
-                volume_precision = 0
-            return volume_precision
-
         data = [
             {
                 "symbol": each["symbol"],
                 "contractType": each["contractType"],
                 "status": each["status"],
-                "volume_precision": parse_volume_precision(each["filters"][1]["stepSize"]),
+                "volume_precision": cls.parse_volume_precision(each["filters"][1]["stepSize"]),
                 "notional": float(each["filters"][5]["notional"])
             } for each in cls.get_exchange_info()["symbols"]
         ]
@@ -108,94 +334,123 @@ class BinanceExchange(BaseAPIHandler):
         return symbol_info
 
     @classmethod
-    def get_klines(cls, params: List[Dict[str, ResponseType]]=None, asynchonous_batch=True):
-        '''
-        Return:
-            List[all_symbols_list[kline_data_list]]
-            kline_data_list is ascending
-        '''
-        endpoint = "/fapi/v1/continuousKlines"
-        if asynchonous_batch:
-            return asyncio.run(cls.batch_get_json(endpoint=endpoint, params=params))
-        else:
-            return [cls.get_json(endpoint, param) for param in params]
+    def kline_params(cls, symbol: str, interval: str, st_in_ms: int, et_in_ms: int, limit: int) -> Dict[str, ResponseType]:
+        return {
+            "pair": symbol,
+            "contractType": "PERPETUAL",
+            "interval": interval,
+            "startTime": st_in_ms,
+            "endTime": et_in_ms,
+            "limit": limit
+        }
 
     @classmethod
-    def get_klines_by_symbol(cls, symbols: List[str], interval: str, st: str, et: str):
-        # build params
-        limit = 1000
-        st_in_ms = TimeUtils.dt_str_to_ms(st, format="%Y-%m-%d %H:%M:%S")
-        et_in_ms = TimeUtils.dt_str_to_ms(et, format="%Y-%m-%d %H:%M:%S")
-        interval_in_ms = TimeUtils.interval_str_to_ms(interval)
+    def parse_kline_page(cls, payload: List[List[Any]], interval_in_ms: int) -> np.ndarray:
+        return klines_to_array(payload)
 
-        # TODO need tests
-        # TODO check if it's including or excluding for et_
-        # create params for each symbol and for every request interval
-        # Response will include et
-        ret = {}
-        for symbol in symbols:
-            params = [{
-                "pair": symbol,
-                "contractType": "PERPETUAL",
-                "interval": interval,
-                "startTime": st_,
-                "endTime": et_in_ms,
-                "limit": limit
-            } for st_ in range(st_in_ms, et_in_ms, interval_in_ms*limit)]
-
-            # create dictionary using pair name and klines
-            ret[symbol] = cls.get_klines(params)
-        return ret
+class BybitExchange(BaseAPIHandler):
+    """
+    USDT perpetuals of Bybit, klines carry no trade count and taker volumes so those fields stay nan.
+    """
+    base_url="https://api.bybit.com"
+    # 600 requests per 5 seconds per ip, half of it is left for other processes
+    limit_per_second=int(600 / 5 / 2)
+    kline_endpoint="/v5/market/kline"
+    ping_endpoint="/v5/market/time"
+    intervals={"1m": "1", "3m": "3", "5m": "5", "15m": "15", "30m": "30", "1h": "60", "2h": "120", "4h": "240",
+               "6h": "360", "12h": "720", "1d": "D", "1w": "W"}
 
     @classmethod
-    def get_aggregated_symbols_kline(cls, symbols: List[str], interval: str, st: str, et: str) -> pd.DataFrame:
-        klines = cls.get_klines_by_symbol(symbols, interval, st, et)
-        def parse(kline: List[List[Any]]):
-            kl_df = pd.DataFrame(kline, columns=["ots", "open", "high", "low", "close", "volume", "ts",
-                                            "usd_v", "n_trades", "taker_buy_v", "taker_buy_usd", "ig"]).drop(["ots", "ig"], axis=1)
-            kl_df['ts'] = kl_df['ts'] + 1
-            kl_df['ts'] = kl_df['ts'].apply(TimeUtils.ms_to_timestamp)
-            kl_df.set_index("ts", inplace=True)
-            return kl_df
-        # turn list in dict into df
-        klines = {pair: parse(kline) for pair, kline in klines.items()}
-
-        btc = klines["BTCUSDT"]
-        st = btc.index[0]
-        et = btc.index[-1]
-
-        ts_lis = btc.index.tolist()
-        col = btc.columns.tolist() + ['vwap']
-
-        # symbols = list(klines.keys())
-        multi_idx = pd.MultiIndex.from_product([ts_lis, symbols], names=["ts", "symbol"])
-        data = np.full(shape=(len(ts_lis), len(symbols), len(col)), fill_value=np.nan)
-
-        # wrong_symbol = []
-        for symbol, kline in klines.items():
-            indice = symbols.index(symbol)
-            try:
-                kline = kline.loc[(kline.index >= st) & (kline.index <= et)]
-                kline = kline.apply(pd.to_numeric)
-                kline['vwap'] = (kline['usd_v'] / kline['volume']).ffill().bfill()  # volume可能为0而导致nan，填充即可
-                st_idx = ts_lis.index(kline.index[0])
-                ed_idx = ts_lis.index(kline.index[-1])
-                data[st_idx:ed_idx + 1, indice, :] = kline.values
-            except:
-                # wrong_symbol.append(symbol)
-                traceback.print_exc()
-
-        aggregated_klines = pd.DataFrame(data.reshape(-1, data.shape[-1]), index=multi_idx, columns=col)
-        # symbols = list(set(symbols).difference(set(wrong_symbol)))
-        # df = df.loc[(slice(None), symbols), :]
-        aggregated_klines['return_1'] = (aggregated_klines['close'].unstack().diff(1).shift(-1) / aggregated_klines[
-            'close'].unstack()).stack()
-        # symbols_with_complete_data = aggregated_klines["close"].unstack().isna().sum(axis=0)[
-        #    aggregated_klines["close"].unstack().isna().sum(axis=0) == 0].index.tolist()
-        # aggregated_klines = aggregated_klines.loc[(slice(None), symbols_with_complete_data), :]
-
-
-        return aggregated_klines
+    def get_exchange_info(cls) -> Dict:
+        return cls.get_json(endpoint="/v5/market/instruments-info", params={"category": "linear", "limit": 1000})
+
+    @classmethod
+    def get_symbol_info(cls):
+        # same columns and values as BinanceExchange.get_symbol_info
+        data = [
+            {
+                "symbol": each["symbol"],
+                "contractType": "PERPETUAL" if each["contractType"] == "LinearPerpetual" else each["contractType"],
+                "status": each["status"].upper(),
+                "volume_precision": cls.parse_volume_precision(each["lotSizeFilter"]["qtyStep"]),
+                "notional": float(each["lotSizeFilter"].get("minNotionalValue", 0))
+            } for each in cls.get_exchange_info()["result"]["list"]
+        ]
+
+        symbol_info = pd.DataFrame(data)
+        symbol_info = symbol_info.loc[(symbol_info["contractType"] == "PERPETUAL") & (symbol_info["status"] == "TRADING")]
+        return symbol_info
+
+    @classmethod
+    def kline_params(cls, symbol: str, interval: str, st_in_ms: int, et_in_ms: int, limit: int) -> Dict[str, ResponseType]:
+        return {
+            "category": "linear",
+            "symbol": symbol,
+            "interval": cls.intervals[interval],
+            "start": st_in_ms,
+            "end": et_in_ms,
+            "limit": limit
+        }
+
+    @classmethod
+    def parse_kline_page(cls, payload: Dict[str, Any], interval_in_ms: int) -> np.ndarray:
+        if payload["retCode"] != 0:
+            raise ValueError(f"retCode={payload['retCode']} retMsg={payload.get('retMsg')}")
+        # [start, open, high, low, close, volume, turnover], newest first
+        return ohlcv_to_klines(payload["result"]["list"][::-1], interval_in_ms)
+
+
+class BitgetExchange(BaseAPIHandler):
+    """
+    USDT perpetuals of Bitget, klines carry no trade count and taker volumes so those fields stay nan.
+    The candles endpoint only serves recent history, it is meant as a secondary for the latest bars.
+    """
+    base_url="https://api.bitget.com"
+    limit_per_second=20
+    kline_endpoint="/api/v2/mix/market/candles"
+    ping_endpoint="/api/v2/public/time"
+    intervals={"1m": "1m", "3m": "3m", "5m": "5m", "15m": "15m", "30m": "30m", "1h": "1H", "4h": "4H",
+               "6h": "6H", "12h": "12H", "1d": "1D", "1w": "1W"}
+
+    @classmethod
+    def get_exchange_info(cls) -> Dict:
+        return cls.get_json(endpoint="/api/v2/mix/market/contracts", params={"productType": "usdt-futures"})
+
+    @classmethod
+    def get_symbol_info(cls):
+        # same columns and values as BinanceExchange.get_symbol_info
+        data = [
+            {
+                "symbol": each["symbol"],
+                "contractType": "PERPETUAL" if each["symbolType"] == "perpetual" else each["symbolType"].upper(),
+                "status": "TRADING" if each["symbolStatus"] == "normal" else each["symbolStatus"].upper(),
+                "volume_precision": int(each["volumePlace"]),
+                "notional": float(each["minTradeUSDT"])
+            } for each in cls.get_exchange_info()["data"]
+        ]
+
+        symbol_info = pd.DataFrame(data)
+        symbol_info = symbol_info.loc[(symbol_info["contractType"] == "PERPETUAL") & (symbol_info["status"] == "TRADING")]
+        return symbol_info
+
+    @classmethod
+    def kline_params(cls, symbol: str, interval: str, st_in_ms: int, et_in_ms: int, limit: int) -> Dict[str, ResponseType]:
+        return {
+            "symbol": symbol,
+            "productType": "usdt-futures",
+            "granularity": cls.intervals[interval],
+            "startTime": st_in_ms,
+            "endTime": et_in_ms,
+            "limit": limit
+        }
+
+    @classmethod
+    def parse_kline_page(cls, payload: Dict[str, Any], interval_in_ms: int) -> np.ndarray:
+        if payload["code"] != "00000":
+            raise ValueError(f"code={payload['code']} msg={payload.get('msg')}")
+        # [ts, open, high, low, close, base volume, quote volume], oldest first
+        return ohlcv_to_klines(payload["data"], interval_in_ms)
+
 
 if __name__ == '__main__':
     symbols = ["BTCUSDT", "ETHUSDT"]
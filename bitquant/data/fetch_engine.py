@@ -0,0 +1,208 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Callable, Awaitable, Tuple, Mapping
+
+import aiohttp
+
+# (status, headers, payload)
+TransportResponse = Tuple[int, Mapping[str, str], Any]
+Transport = Callable[[str, Dict[str, Any]], Awaitable[TransportResponse]]
+
+RETRY_STATUS = (418, 429, 500, 502, 503, 504)
+
+
+class FetchError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status=} {message=}")
+        self.status = status
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every request of one exchange.
+
+    `rate` tokens are added per second up to `capacity`. With the default capacity of one token requests are
+    paced evenly, so no one second window ever sees more than `rate` requests (plus the single stored token),
+    while a saturated queue still fills the limit exactly.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = None
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, tokens: float = 1.0):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # the lock keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds`, used for Retry-After and exhausted weight windows"""
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated_at = self.paused_until
+
+
+@dataclass
+class FetchResult:
+    """
+    Outcome of a batch, `responses` and `errors` are keyed by the position of the param in the request list
+    """
+    responses: Dict[int, Any] = field(default_factory=dict)
+    errors: Dict[int, Exception] = field(default_factory=dict)
+
+    @property
+    def complete(self) -> bool:
+        return len(self.errors) == 0
+
+    def ordered_responses(self) -> List[Any]:
+        return [self.responses[i] for i in sorted(self.responses)]
+
+
+class FetchEngine:
+    """
+    Rate limited fetcher for one exchange.
+
+    All engines of a process share one background event loop and one pooled aiohttp session, so the limiter and
+    the connection pool hold across every caller, whatever event loop or thread the caller runs in.
+    """
+
+    _loop: asyncio.AbstractEventLoop = None
+    _loop_pid: int = None
+    _session: aiohttp.ClientSession = None
+    _loop_lock = threading.Lock()
+
+    def __init__(self, limit_per_second: float, max_concurrency: int = 16, max_retries: int = 4,
+                 backoff: float = 0.5, timeout: float = 10, request_weight: int = 1,
+                 weight_header: str = None, weight_limit: int = None, weight_window: float = 60,
+                 transport: Transport = None):
+        self.limiter = TokenBucket(limit_per_second)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.request_weight = request_weight
+        self.weight_header = weight_header
+        self.weight_limit = weight_limit
+        self.weight_window = weight_window
+        self.transport = transport or self.http_transport
+        self._semaphore = None
+
+    # ===== shared loop and session =====
+
+    @classmethod
+    def get_loop(cls) -> asyncio.AbstractEventLoop:
+        with cls._loop_lock:
+            # a forked child does not inherit the loop thread
+            if cls._loop is None or cls._loop_pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="bitquant-fetch-engine", daemon=True)
+                thread.start()
+                cls._loop, cls._loop_pid, cls._session = loop, os.getpid(), None
+            return cls._loop
+
+    @classmethod
+    async def get_session(cls) -> aiohttp.ClientSession:
+        if cls._session is None or cls._session.closed:
+            connector = aiohttp.TCPConnector(limit=100, ttl_dns_cache=300)
+            cls._session = aiohttp.ClientSession(connector=connector)
+        return cls._session
+
+    async def http_transport(self, url: str, param: Dict[str, Any]) -> TransportResponse:
+        session = await self.get_session()
+        async with session.get(url, params=param, timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+            payload = await response.json(content_type=None) if response.status == 200 else await response.text()
+            return response.status, response.headers, payload
+
+    # ===== fetching =====
+
+    def _observe_weight(self, headers: Mapping[str, str]):
+        if self.weight_header is None or self.weight_limit is None:
+            return
+        used_weight = headers.get(self.weight_header)
+        if used_weight is None:
+            return
+        # leave room for the requests that are already in flight
+        if int(used_weight) + self.request_weight * self.max_concurrency >= self.weight_limit:
+            self.limiter.pause(self.weight_window - time.time() % self.weight_window)
+
+    async def fetch(self, url: str, param: Dict[str, Any]) -> Any:
+        """Fetch one page, retrying throttled and transient failures with jittered exponential backoff"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    # take the token inside the semaphore, otherwise freed slots would release a burst
+                    await self.limiter.acquire()
+                    status, headers, payload = await self.transport(url, param)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            else:
+                self._observe_weight(headers)
+                if status == 200:
+                    return payload
+                if status in (418, 429):
+                    self.limiter.pause(float(headers.get("Retry-After", self.backoff * 2 ** attempt)))
+                error = FetchError(status, str(payload)[:200])
+                if status not in RETRY_STATUS:
+                    raise error
+            if attempt >= self.max_retries:
+                raise error
+            await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    async def _fetch_all(self, url: str, params: List[Dict[str, Any]],
+                         on_result: Callable[[int, Any], None] = None) -> FetchResult:
+        result = FetchResult()
+
+        async def fetch_one(i, param):
+            try:
+                payload = await self.fetch(url, param)
+            except Exception as e:
+                result.errors[i] = e
+                return
+            result.responses[i] = payload
+            if on_result is not None:
+                on_result(i, payload)
+
+        await asyncio.gather(*[fetch_one(i, param) for i, param in enumerate(params)])
+        return result
+
+    async def fetch_all(self, url: str, params: List[Dict[str, Any]],
+                        on_result: Callable[[int, Any], None] = None) -> FetchResult:
+        """
+        Fetch every param from any event loop, failed pages are reported in FetchResult.errors instead of raising.
+        `on_result(i, payload)` is called on the engine loop as soon as page i arrives.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._fetch_all(url, params, on_result), self.get_loop())
+        return await asyncio.wrap_future(future)
+
+    def run(self, url: str, params: List[Dict[str, Any]],
+            on_result: Callable[[int, Any], None] = None) -> FetchResult:
+        """Blocking version of fetch_all"""
+        return asyncio.run_coroutine_threadsafe(self._fetch_all(url, params, on_result), self.get_loop()).result()
@@ -0,0 +1,91 @@
+from typing import List, Dict, Any, Union, Tuple
+import numpy as np
+
+# numeric columns of a kline row, the trailing "ignore" field is dropped
+KLINE_COLUMNS = ["ots", "open", "high", "low", "close", "volume", "ts",
+                 "usd_v", "n_trades", "taker_buy_v", "taker_buy_usd"]
+
+# dtype of the panels the data client builds, features are computed in float32 to halve memory and bandwidth,
+# values that need double precision (prices at execution, cumulative equity) are converted where they are used
+FEATURE_DTYPE = np.float32
+
+# fields of the parsed panel, in order
+PANEL_FIELDS = ["open", "high", "low", "close", "volume", "usd_v", "n_trades", "taker_buy_v", "taker_buy_usd", "vwap"]
+
+_RAW_FIELDS = [KLINE_COLUMNS.index(field) for field in PANEL_FIELDS[:-1]]
+_TS = KLINE_COLUMNS.index("ts")
+_USD_V = KLINE_COLUMNS.index("usd_v")
+_VOLUME = KLINE_COLUMNS.index("volume")
+
+
+def klines_to_array(kline: Union[List[List[Any]], np.ndarray]) -> np.ndarray:
+    """
+    Convert raw kline rows (numbers are sent as strings) into a float64 array of shape (n, len(KLINE_COLUMNS))
+    """
+    if len(kline) == 0:
+        return np.empty((0, len(KLINE_COLUMNS)), dtype=np.float64)
+    # numpy parses the numeric strings itself, the rows are converted in one call without slicing each of them
+    return np.asarray(kline, dtype=np.float64)[:, :len(KLINE_COLUMNS)]
+
+
+def ohlcv_to_klines(rows: Union[List[List[Any]], np.ndarray], interval_in_ms: int) -> np.ndarray:
+    """
+    Convert [ots, open, high, low, close, volume, usd_v] rows of an exchange without the Binance layout
+    into a KLINE_COLUMNS array, ts is the close time of the bar and the fields the exchange does not send are nan
+    """
+    if len(rows) == 0:
+        return klines_to_array([])
+    rows = np.asarray(rows, dtype=np.float64)[:, :7]
+    ret = np.full((len(rows), len(KLINE_COLUMNS)), np.nan)
+    ret[:, :6] = rows[:, :6]
+    ret[:, _TS] = rows[:, 0] + interval_in_ms - 1
+    ret[:, _USD_V] = rows[:, 6]
+    return ret
+
+
+def _ffill_bfill(a: np.ndarray) -> np.ndarray:
+    """forward fill then backward fill the nan of a 1D array"""
+    valid = ~np.isnan(a)
+    if not valid.any():
+        return a
+    idx = np.maximum.accumulate(np.where(valid, np.arange(len(a)), 0))
+    # leading nan take the first valid value
+    idx[:np.argmax(valid)] = np.argmax(valid)
+    return a[idx]
+
+
+def parse_klines(klines: Dict[str, Union[List[List[Any]], np.ndarray]], symbols: List[str],
+                 dtype=np.float64) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse the klines of every symbol into one dense panel.
+
+    The time axis is the union of the bar close times of all symbols (close time + 1ms, i.e. the timestamp
+    the bar is known at), bars are placed with searchsorted so gaps and late listings stay nan.
+
+    Return:
+        ts_in_ms: int64 array (n_ts,)
+        data: array (n_ts, n_symbols, len(PANEL_FIELDS)) of dtype
+    """
+    arrays = {symbol: klines_to_array(klines[symbol]) for symbol in symbols if symbol in klines}
+    ts_in_ms = np.unique(np.concatenate([kline[:, _TS] for kline in arrays.values()] + [np.empty(0)])).astype(np.int64) + 1
+
+    data = np.full(shape=(len(ts_in_ms), len(symbols), len(PANEL_FIELDS)), fill_value=np.nan, dtype=dtype)
+    for j, symbol in enumerate(symbols):
+        kline = arrays.get(symbol)
+        if kline is None or len(kline) == 0:
+            continue
+        rows = np.searchsorted(ts_in_ms, kline[:, _TS].astype(np.int64) + 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # volume can be 0 and give nan, filling is fine
+            vwap = _ffill_bfill(kline[:, _USD_V] / kline[:, _VOLUME])
+        data[rows, j, :-1] = kline[:, _RAW_FIELDS]
+        data[rows, j, -1] = vwap
+    return ts_in_ms, data
+
+
+def calc_return_1(close: np.ndarray) -> np.ndarray:
+    """(close[t+1] - close[t]) / close[t] along the first axis, the last row is nan"""
+    ret = np.full_like(close, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ret[:-1] = (close[1:] - close[:-1]) / close[:-1]
+    return ret
@@ -0,0 +1,118 @@
+import os
+import json
+from typing import List, Tuple
+import numpy as np
+from bitquant.data.kline_parser import KLINE_COLUMNS
+from bitquant.utils.timeutils import TimeUtils
+
+DAY_IN_MS = 24 * 60 * 60 * 1000
+
+
+class KlineStore:
+    """
+    Local on-disk kline history so that DataClient only has to request what it has not seen before.
+
+    Layout:
+        <root>/<interval>/<symbol>/<YYYY-MM-DD>.npz   one compressed array per column in KLINE_COLUMNS, keyed by "ots"
+        <root>/<interval>/<symbol>/coverage.json      [[st, et], ...] open time ranges that were already requested
+
+    Coverage is tracked separately from the rows because the exchange returns nothing for ranges where a symbol
+    was not listed yet, those ranges should not be requested again either.
+    Only closed bars are stored, the still forming bar is left to the caller.
+    """
+
+    def __init__(self, root: str = "~/.bitquant/klines"):
+        self.root = os.path.expanduser(root)
+
+    def _symbol_dir(self, symbol: str, interval: str) -> str:
+        return os.path.join(self.root, interval, symbol)
+
+    def _partition_path(self, symbol: str, interval: str, day: int) -> str:
+        day_str = np.datetime64(day, "D").astype(str)
+        return os.path.join(self._symbol_dir(symbol, interval), f"{day_str}.npz")
+
+    def _coverage_path(self, symbol: str, interval: str) -> str:
+        return os.path.join(self._symbol_dir(symbol, interval), "coverage.json")
+
+    @staticmethod
+    def _atomic_write(path: str, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def _load_partition(self, path: str) -> np.ndarray:
+        if not os.path.exists(path):
+            return np.empty((0, len(KLINE_COLUMNS)), dtype=np.float64)
+        with np.load(path) as partition:
+            return np.column_stack([partition[col].astype(np.float64) for col in KLINE_COLUMNS])
+
+    def read(self, symbol: str, interval: str, st_in_ms: int, et_in_ms: int) -> np.ndarray:
+        """
+        Return:
+            float64 array of shape (n, len(KLINE_COLUMNS)) with st_in_ms <= ots <= et_in_ms, ascending by ots
+        """
+        parts = [self._load_partition(self._partition_path(symbol, interval, day))
+                 for day in range(st_in_ms // DAY_IN_MS, et_in_ms // DAY_IN_MS + 1)]
+        klines = np.concatenate(parts, axis=0)
+        return klines[(klines[:, 0] >= st_in_ms) & (klines[:, 0] <= et_in_ms)]
+
+    def write(self, symbol: str, interval: str, klines: np.ndarray):
+        """
+        Merge closed klines (float64 array laid out as KLINE_COLUMNS) into their day partitions,
+        rows with an already stored open time are replaced.
+        """
+        if len(klines) == 0:
+            return
+        days = klines[:, 0].astype(np.int64) // DAY_IN_MS
+        for day in np.unique(days):
+            path = self._partition_path(symbol, interval, int(day))
+            merged = np.concatenate([klines[days == day], self._load_partition(path)], axis=0)
+            # np.unique keeps the first occurrence, so new rows win over stored ones
+            _, first = np.unique(merged[:, 0], return_index=True)
+            merged = merged[first]
+            columns = {col: merged[:, i] for i, col in enumerate(KLINE_COLUMNS)}
+            columns["ots"] = columns["ots"].astype(np.int64)
+            columns["ts"] = columns["ts"].astype(np.int64)
+            self._atomic_write(path, lambda f: np.savez_compressed(f, **columns))
+
+    def get_coverage(self, symbol: str, interval: str) -> List[Tuple[int, int]]:
+        path = self._coverage_path(symbol, interval)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r") as f:
+            return [tuple(each) for each in json.load(f)]
+
+    def mark_covered(self, symbol: str, interval: str, st_in_ms: int, et_in_ms: int, interval_in_ms: int):
+        """Record that every open time in [st_in_ms, et_in_ms] was requested, merging adjacent ranges"""
+        ranges = sorted(self.get_coverage(symbol, interval) + [(int(st_in_ms), int(et_in_ms))])
+        merged = [list(ranges[0])]
+        for st_, et_ in ranges[1:]:
+            if st_ <= merged[-1][1] + interval_in_ms:
+                merged[-1][1] = max(merged[-1][1], et_)
+            else:
+                merged.append([st_, et_])
+        self._atomic_write(self._coverage_path(symbol, interval), lambda f: f.write(json.dumps(merged).encode()))
+
+    def missing_ranges(self, symbol: str, interval: str, st_in_ms: int, et_in_ms: int,
+                       interval_in_ms: int) -> List[Tuple[int, int]]:
+        """
+        Return:
+            [(st, et), ...] open time ranges on the interval grid inside [st_in_ms, et_in_ms] that are not covered yet
+        """
+        st_in_ms = TimeUtils.ceil_ms(st_in_ms, interval_in_ms)
+        et_in_ms = TimeUtils.floor_ms(et_in_ms, interval_in_ms)
+        missing = []
+        cursor = st_in_ms
+        for covered_st, covered_et in self.get_coverage(symbol, interval):
+            if covered_et < cursor:
+                continue
+            if covered_st > et_in_ms:
+                break
+            if covered_st > cursor:
+                missing.append((cursor, min(covered_st - interval_in_ms, et_in_ms)))
+            cursor = covered_et + interval_in_ms
+        if cursor <= et_in_ms:
+            missing.append((cursor, et_in_ms))
+        return missing
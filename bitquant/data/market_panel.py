@@ -0,0 +1,506 @@
+import os
+import json
+from typing import List, Dict, Any, Union, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from bitquant.data.kline_parser import PANEL_FIELDS, parse_klines, calc_return_1
+from bitquant.utils.timeutils import TimeUtils
+
+
+def ffill(values: np.ndarray) -> np.ndarray:
+    """forward fill the nan of an array along the first axis"""
+    valid = ~np.isnan(values)
+    idx = np.where(valid, np.arange(len(values)).reshape((-1,) + (1,) * (values.ndim - 1)), 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return np.take_along_axis(values, idx, axis=0)
+
+
+def to_ms(ts: Union[Sequence, pd.DatetimeIndex]) -> np.ndarray:
+    """convert timestamps (datetime, pd.Timestamp, datetime64 or ms) to int64 epoch ms"""
+    return TimeUtils.to_ms_array(ts)
+
+
+PANEL_FILE_MAGIC = b"BQPANEL1"
+# data blocks of a panel file start on this alignment
+_ALIGNMENT = 64
+# path -> (mtime, read only byte map of the file), one mapping per file and process
+_mapped_files: Dict[str, Tuple[float, np.memmap]] = {}
+
+
+def _map_file(path: str) -> np.memmap:
+    mtime = os.path.getmtime(path)
+    if path not in _mapped_files or _mapped_files[path][0] != mtime:
+        _mapped_files[path] = (mtime, np.memmap(path, dtype=np.uint8, mode="r"))
+    return _mapped_files[path][1]
+
+
+def _open_mapped_view(path: str, offset: int, shape: Tuple[int, ...], strides: Tuple[int, ...], dtype: str,
+                      ts_in_ms: np.ndarray, symbols: List[str], fields: List[str], interval: str) -> "MarketPanel":
+    """unpickle a panel whose values live in a panel file, the values are mapped again instead of copied"""
+    file_map = _map_file(path)
+    values = np.ndarray(shape, dtype=np.dtype(dtype), buffer=file_map, offset=offset, strides=strides)
+    panel = MarketPanel(values, ts_in_ms, symbols, fields, interval)
+    panel._file = (path, file_map)
+    return panel
+
+
+def _indexer(positions: np.ndarray) -> Union[slice, np.ndarray]:
+    """positions as a slice when they are evenly spaced so that indexing returns a view instead of a copy"""
+    if len(positions) == 0:
+        return slice(0, 0)
+    if len(positions) == 1:
+        return slice(positions[0], positions[0] + 1)
+    step = positions[1] - positions[0]
+    if step > 0 and np.all(np.diff(positions) == step):
+        return slice(positions[0], positions[-1] + 1, step)
+    return positions
+
+
+class PanelValidity:
+    """
+    Which rows of every symbol of a panel hold a bar, computed once per panel and kept up to date by its appends,
+    so symbol filtering, warm up trimming and masking are lookups per symbol instead of nan scans of the panel.
+
+    has_bar: bool (n_ts, n_symbols)
+    first_valid / last_valid: (n_symbols,) row of the first / last bar of every symbol, -1 without any bar
+    n_valid: (n_symbols,) number of bars of every symbol
+    """
+
+    def __init__(self, has_bar: np.ndarray):
+        self._buffer = np.array(has_bar, dtype=bool)
+        self._n = len(has_bar)
+        any_bar = self._buffer.any(axis=0)
+        self.first_valid = np.where(any_bar, self._buffer.argmax(axis=0), -1)
+        self.last_valid = np.where(any_bar, self._n - 1 - self._buffer[::-1].argmax(axis=0), -1)
+        self.n_valid = self._buffer.sum(axis=0)
+
+    @property
+    def has_bar(self) -> np.ndarray:
+        return self._buffer[:self._n]
+
+    @property
+    def n_gaps(self) -> np.ndarray:
+        """rows without a bar between the first and the last bar of every symbol"""
+        return np.where(self.first_valid >= 0, self.last_valid - self.first_valid + 1 - self.n_valid, 0)
+
+    def complete(self) -> np.ndarray:
+        """bool (n_symbols,), a bar in every row"""
+        return self.n_valid == self._n
+
+    def warm_up_row(self) -> int:
+        """first row from which every symbol with a bar has started"""
+        listed = self.first_valid[self.first_valid >= 0]
+        return int(listed.max()) if len(listed) else 0
+
+    def rows_with_bars(self, min_symbols: int = 1) -> np.ndarray:
+        """bool (n_ts,), rows where at least min_symbols symbols have a bar"""
+        return self.has_bar.sum(axis=1) >= min_symbols
+
+    def take_symbols(self, indexer: Union[slice, np.ndarray]) -> "PanelValidity":
+        validity = PanelValidity.__new__(PanelValidity)
+        validity._buffer = self.has_bar[:, indexer].copy()
+        validity._n = self._n
+        validity.first_valid, validity.last_valid, validity.n_valid = \
+            self.first_valid[indexer], self.last_valid[indexer], self.n_valid[indexer]
+        return validity
+
+    def take_rows(self, indexer: Union[slice, np.ndarray]) -> "PanelValidity":
+        """
+        Validity of a time slice, the first / last bar of a symbol without gaps is clamped into a contiguous slice
+        instead of looked up, the other symbols and other indexers scan the rows of the bitmap they keep.
+        """
+        has_bar = self.has_bar[indexer]
+        if not isinstance(indexer, slice) or indexer.step not in (None, 1):
+            return PanelValidity(has_bar)
+        st, et, _ = indexer.indices(self._n)
+        et = max(et, st)
+        validity = PanelValidity.__new__(PanelValidity)
+        validity._buffer = has_bar.copy()
+        validity._n = et - st
+        first, last = np.maximum(self.first_valid, st), np.minimum(self.last_valid, et - 1)
+        any_bar = (self.first_valid >= 0) & (first <= last)
+        validity.first_valid = np.where(any_bar, first - st, -1)
+        validity.last_valid = np.where(any_bar, last - st, -1)
+        validity.n_valid = np.where(any_bar, last - first + 1, 0)
+        gapped = np.flatnonzero((self.n_gaps > 0) & any_bar)
+        if len(gapped):
+            gapped_validity = PanelValidity(has_bar[:, gapped])
+            validity.first_valid[gapped] = gapped_validity.first_valid
+            validity.last_valid[gapped] = gapped_validity.last_valid
+            validity.n_valid[gapped] = gapped_validity.n_valid
+        return validity
+
+    def refresh(self, first_row: int, has_bar: np.ndarray):
+        """replace the rows from first_row on by has_bar, rows after the last one are appended"""
+        n = first_row + len(has_bar)
+        if n > len(self._buffer):
+            buffer = np.empty((max(n, len(self._buffer) + len(self._buffer) // 2, 16),) + self._buffer.shape[1:], dtype=bool)
+            buffer[:self._n] = self.has_bar
+            self._buffer = buffer
+        self.n_valid = self.n_valid - self._buffer[first_row:self._n].sum(axis=0) + has_bar.sum(axis=0)
+        self._buffer[first_row:n] = has_bar
+        self._n = n
+
+        any_new = has_bar.any(axis=0)
+        # the first bar only moves when it was among the replaced rows
+        replaced_first = (self.first_valid < 0) | (self.first_valid >= first_row)
+        self.first_valid = np.where(replaced_first, np.where(any_new, first_row + has_bar.argmax(axis=0), -1),
+                                    self.first_valid)
+        lost_last = ~any_new & (self.last_valid >= first_row)
+        self.last_valid = np.where(any_new, n - 1 - has_bar[::-1].argmax(axis=0), self.last_valid)
+        # a replaced row lost the last bar of a symbol, which never happens for klines, look for the one before
+        for j in np.flatnonzero(lost_last):
+            before = np.flatnonzero(self._buffer[:first_row, j])
+            self.last_valid[j] = before[-1] if len(before) else -1
+
+
+class MarketPanel:
+    """
+    Dense market data of shape (n_ts, n_symbols, n_fields) in one contiguous array.
+
+    Fields, symbol subsets and time slices are numpy views whenever the selection is evenly spaced,
+    the (ts, symbol) MultiIndex DataFrame used by the legacy code is only built on request by to_frame.
+    New bars are appended in place by update_klines, rows are reserved with amortized growth so `values`
+    stays a view of a larger buffer, views taken before a growth keep pointing at the old buffer.
+    Which (ts, symbol) hold a bar is kept in `validity`, a bar is a row with a close (any value without close).
+    """
+
+    def __init__(self, values: np.ndarray, ts_in_ms: np.ndarray, symbols: List[str], fields: List[str],
+                 interval: str = None):
+        if values.shape != (len(ts_in_ms), len(symbols), len(fields)):
+            raise ValueError(f"values of shape {values.shape} do not match "
+                             f"{(len(ts_in_ms), len(symbols), len(fields))=}")
+        self.values = values
+        self.ts_in_ms = np.asarray(ts_in_ms, dtype=np.int64)
+        self.symbols = list(symbols)
+        self.fields = list(fields)
+        self.interval = interval
+        self._frame = None
+        # (path, byte map) when values are a view of a panel file
+        self._file = None
+        # rows reserved for appending, values and ts_in_ms are the first len(self) rows of these
+        self._buffer = None
+        self._ts_buffer = None
+        self._validity = None
+
+    @classmethod
+    def from_klines(cls, klines: Dict[str, Union[List[List[Any]], np.ndarray]], symbols: List[str],
+                    dtype=np.float64, interval: str = None) -> "MarketPanel":
+        """Panel of PANEL_FIELDS plus return_1, allocated once"""
+        ts_in_ms, data = parse_klines(klines, symbols, dtype=dtype)
+        values = np.empty(data.shape[:2] + (data.shape[2] + 1,), dtype=dtype)
+        values[:, :, :-1] = data
+        values[:, :, -1] = calc_return_1(data[:, :, PANEL_FIELDS.index("close")])
+        panel = cls(values, ts_in_ms, symbols, PANEL_FIELDS + ["return_1"], interval)
+        # computed at ingestion, the later stages only look it up
+        panel._validity = PanelValidity(panel._has_bar(0))
+        return panel
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, dtype=None) -> "MarketPanel":
+        """
+        Panel of a (ts, symbol) MultiIndex DataFrame, missing (ts, symbol) rows are nan.
+        dtype defaults to the one of the columns (at least float32) like make_XY, a float32 frame stays float32.
+        """
+        dtype = np.result_type(*df.dtypes, np.float32) if dtype is None else dtype
+        ts = df.index.get_level_values(0).unique()
+        symbols = df.index.get_level_values(1).unique().tolist()
+        full_idx = pd.MultiIndex.from_product([ts, symbols], names=df.index.names)
+        values = df.reindex(full_idx).to_numpy(dtype=dtype).reshape(len(ts), len(symbols), df.shape[1])
+        return cls(values, to_ms(ts), symbols, df.columns.tolist())
+
+    # ===== metadata =====
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self.values.shape
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def ts(self) -> pd.DatetimeIndex:
+        return pd.to_datetime(self.ts_in_ms, unit="ms", utc=True)
+
+    def __len__(self):
+        return len(self.ts_in_ms)
+
+    @property
+    def validity(self) -> PanelValidity:
+        """computed on first use for panels that were not built from klines, e.g. views and factor panels"""
+        if self._validity is None:
+            self._validity = PanelValidity(self._has_bar(0))
+        return self._validity
+
+    def _has_bar(self, first_row: int) -> np.ndarray:
+        if "close" in self.fields:
+            return ~np.isnan(self.field("close")[first_row:])
+        return ~np.isnan(self.values[first_row:]).all(axis=2)
+
+    def _refresh_validity(self, first_row: int):
+        if self._validity is not None:
+            self._validity.refresh(first_row, self._has_bar(first_row))
+
+    def complete_symbols(self) -> List[str]:
+        """symbols with a bar in every row"""
+        return [symbol for symbol, complete in zip(self.symbols, self.validity.complete()) if complete]
+
+    def trim_warm_up(self) -> "MarketPanel":
+        """view from the first row at which every symbol with a bar has started, e.g. after a late listing"""
+        return self.iloc_time(slice(self.validity.warm_up_row(), None))
+
+    def __repr__(self):
+        return (f"MarketPanel(n_ts={len(self.ts_in_ms)}, interval={self.interval}, symbols={self.symbols}, "
+                f"fields={self.fields}, dtype={self.dtype})")
+
+    # ===== views =====
+
+    def field(self, name: str) -> np.ndarray:
+        """(n_ts, n_symbols) view of one field"""
+        return self.values[:, :, self.fields.index(name)]
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.field(name)
+
+    def _new(self, values: np.ndarray, ts_in_ms=None, symbols=None, fields=None) -> "MarketPanel":
+        panel = MarketPanel(values,
+                            self.ts_in_ms if ts_in_ms is None else ts_in_ms,
+                            self.symbols if symbols is None else symbols,
+                            self.fields if fields is None else fields,
+                            self.interval)
+        panel._file = self._file
+        return panel
+
+    def with_values(self, values: np.ndarray) -> "MarketPanel":
+        """panel of the same rows, symbols and fields holding other values, e.g. scaled factors, with its bars"""
+        panel = MarketPanel(values, self.ts_in_ms, self.symbols, self.fields, self.interval)
+        panel._validity = self._validity
+        return panel
+
+    def select_fields(self, fields: List[str]) -> "MarketPanel":
+        indexer = _indexer(np.array([self.fields.index(name) for name in fields], dtype=np.int64))
+        panel = self._new(self.values[:, :, indexer], fields=fields)
+        # the bars are the rows with a close as long as the close is kept
+        if self._validity is not None and "close" in self.fields and "close" in fields:
+            panel._validity = self._validity
+        return panel
+
+    def select_symbols(self, symbols: List[str]) -> "MarketPanel":
+        indexer = _indexer(np.array([self.symbols.index(symbol) for symbol in symbols], dtype=np.int64))
+        panel = self._new(self.values[:, indexer], symbols=symbols)
+        if self._validity is not None:
+            panel._validity = self._validity.take_symbols(indexer)
+        return panel
+
+    def slice_time(self, st=None, et=None) -> "MarketPanel":
+        """view of the rows with st <= ts <= et, st and et are ms or timestamps"""
+        st_idx = 0 if st is None else np.searchsorted(self.ts_in_ms, to_ms([st])[0], side="left")
+        et_idx = len(self.ts_in_ms) if et is None else np.searchsorted(self.ts_in_ms, to_ms([et])[0], side="right")
+        return self.iloc_time(slice(st_idx, et_idx))
+
+    def iloc_time(self, indexer: Union[slice, Sequence[int]]) -> "MarketPanel":
+        if not isinstance(indexer, slice):
+            indexer = _indexer(np.asarray(indexer, dtype=np.int64))
+        panel = self._new(self.values[indexer], ts_in_ms=self.ts_in_ms[indexer])
+        if self._validity is not None:
+            panel._validity = self._validity.take_rows(indexer)
+        return panel
+
+    def time_positions(self, ts: Sequence) -> np.ndarray:
+        """row positions of the given timestamps, raise KeyError for timestamps that are not in the panel"""
+        ts_in_ms = to_ms(ts)
+        positions = np.searchsorted(self.ts_in_ms, ts_in_ms).clip(max=max(len(self.ts_in_ms) - 1, 0))
+        if len(ts_in_ms) and (len(self.ts_in_ms) == 0 or np.any(self.ts_in_ms[positions] != ts_in_ms)):
+            raise KeyError(f"timestamps not in panel: {ts_in_ms[self.ts_in_ms[positions] != ts_in_ms][:5]}")
+        return positions
+
+    # ===== appending =====
+
+    def reserve(self, n_rows: int):
+        """make room for n_rows rows, growing by half of the current capacity at least so appends are amortized"""
+        if self._buffer is not None and n_rows <= len(self._buffer) and self._buffer.flags.writeable:
+            return
+        capacity = len(self) if self._buffer is None else len(self._buffer)
+        capacity = max(n_rows, capacity + capacity // 2, 16)
+        buffer = np.empty((capacity,) + self.values.shape[1:], dtype=self.values.dtype)
+        ts_buffer = np.empty(capacity, dtype=np.int64)
+        buffer[:len(self)] = self.values
+        ts_buffer[:len(self)] = self.ts_in_ms
+        self._buffer, self._ts_buffer = buffer, ts_buffer
+        # the rows now live in memory, the panel is no longer a view of a panel file
+        self._file = None
+        self.values, self.ts_in_ms = buffer[:len(self)], ts_buffer[:len(self)]
+
+    def append_time(self, ts_in_ms: np.ndarray):
+        """append nan rows for timestamps after the last row in place"""
+        ts_in_ms = np.asarray(ts_in_ms, dtype=np.int64)
+        if len(ts_in_ms) == 0:
+            return
+        if len(self) and ts_in_ms[0] <= self.ts_in_ms[-1]:
+            raise ValueError(f"can only append after the last row {self.ts_in_ms[-1]}, got {ts_in_ms[0]}")
+        n, m = len(self), len(self) + len(ts_in_ms)
+        self.reserve(m)
+        self._buffer[n:m] = np.nan
+        self._ts_buffer[n:m] = ts_in_ms
+        self.values, self.ts_in_ms = self._buffer[:m], self._ts_buffer[:m]
+        self._frame = None
+        self._refresh_validity(n)
+
+    def replace_rows(self, first_row: int, ts_in_ms: np.ndarray, values: np.ndarray):
+        """
+        Overwrite the rows from first_row on in place, rows after the last one are appended.
+        ts_in_ms has to start with the timestamps of the rows it replaces.
+        """
+        ts_in_ms = np.asarray(ts_in_ms, dtype=np.int64)
+        n_replaced = len(self) - first_row
+        if len(ts_in_ms) < n_replaced or np.any(self.ts_in_ms[first_row:] != ts_in_ms[:n_replaced]):
+            raise ValueError(f"timestamps of the rows from {first_row=} on do not match")
+        if not self.values.flags.writeable:
+            self.reserve(len(self))
+        self.append_time(ts_in_ms[n_replaced:])
+        self.values[first_row:] = values
+        self._frame = None
+        self._refresh_validity(first_row)
+
+    def update_klines(self, klines: Dict[str, Union[List[List[Any]], np.ndarray]]) -> int:
+        """
+        Write klines into the panel in place, bars after the last row are appended and bars of existing rows
+        (e.g. the bar that was still forming when the panel was built) are replaced.
+        vwap of the new bars and return_1 of the rows before them are recomputed.
+
+        Return:
+            position of the first row that changed, len(self) if nothing changed
+        """
+        ts_in_ms, data = parse_klines(klines, self.symbols, dtype=self.dtype)
+        first_changed = len(self)
+        if len(ts_in_ms) == 0:
+            return first_changed
+        if not self.values.flags.writeable:
+            # e.g. a read only panel file, the rows are copied into memory once
+            self.reserve(len(self))
+        self.append_time(ts_in_ms[ts_in_ms > self.ts_in_ms[-1]] if len(self) else ts_in_ms)
+        rows = np.searchsorted(self.ts_in_ms, ts_in_ms)
+        in_panel = self.ts_in_ms[rows.clip(max=len(self) - 1)] == ts_in_ms
+        if not in_panel.all():
+            print(f"{(~in_panel).sum()} bars between existing rows of the panel are skipped: {ts_in_ms[~in_panel][:5]}")
+
+        # only (ts, symbol) that got a bar are written, the rest keeps its value
+        has_bar = ~np.isnan(data[:, :, PANEL_FIELDS.index("close")]) & in_panel[:, None]
+        bar_rows, bar_symbols = np.nonzero(has_bar)
+        if len(bar_rows) == 0:
+            return first_changed
+        kline_fields = [k for k, field in enumerate(PANEL_FIELDS) if field in self.fields]
+        panel_fields = [self.fields.index(PANEL_FIELDS[k]) for k in kline_fields]
+        self.values[rows[bar_rows][:, None], bar_symbols[:, None], np.array(panel_fields)[None, :]] = \
+            data[bar_rows, bar_symbols][:, kline_fields]
+
+        first_changed = int(rows[bar_rows].min())
+        if "return_1" in self.fields and "close" in self.fields:
+            # return_1 of the row before the first change depends on its close
+            st_idx = max(first_changed - 1, 0)
+            self.field("return_1")[st_idx:] = calc_return_1(self.field("close")[st_idx:])
+        self._frame = None
+        self._refresh_validity(first_changed)
+        return first_changed
+
+    # ===== memory mapped file =====
+
+    def save(self, path: str):
+        """
+        Write the panel to a file that any process can map with MarketPanel.open.
+
+        Layout:
+            PANEL_FILE_MAGIC, uint64 header length, json header (shape, dtype, symbols, fields, offsets),
+            int64 ts_in_ms, C ordered values and the bool (n_ts, n_symbols) has_bar of the validity,
+            all aligned to 64 bytes
+        """
+        path = os.path.expanduser(path)
+        values_dtype = self.values.dtype.str
+        has_bar = self.validity.has_bar
+        header = {"shape": list(self.values.shape), "dtype": values_dtype, "symbols": self.symbols,
+                  "fields": self.fields, "interval": self.interval, "ts_offset": 0, "values_offset": 0,
+                  "has_bar_offset": 0}
+        # the offsets depend on the header length, reserve room for them first
+        header_len = len(json.dumps(header)) + 96
+        ts_offset = -(-(len(PANEL_FILE_MAGIC) + 8 + header_len) // _ALIGNMENT) * _ALIGNMENT
+        values_offset = -(-(ts_offset + self.ts_in_ms.nbytes) // _ALIGNMENT) * _ALIGNMENT
+        has_bar_offset = -(-(values_offset + self.values.nbytes) // _ALIGNMENT) * _ALIGNMENT
+        header.update(ts_offset=ts_offset, values_offset=values_offset, has_bar_offset=has_bar_offset)
+        header_bytes = json.dumps(header).encode().ljust(header_len)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(PANEL_FILE_MAGIC)
+            f.write(np.uint64(header_len).tobytes())
+            f.write(header_bytes)
+            f.seek(ts_offset)
+            self.ts_in_ms.astype("<i8").tofile(f)
+            f.seek(values_offset)
+            # tofile writes C order without building a contiguous copy first
+            self.values.tofile(f)
+            f.seek(has_bar_offset)
+            np.ascontiguousarray(has_bar).tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path: str) -> "MarketPanel":
+        """
+        Map a file written by save read only, the values are not read until they are used and every process
+        that opens the same file shares the page cache. Panels and views of it are pickled as a reference to the
+        file, so joblib or multiprocessing workers map the file instead of receiving a copy.
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        file_map = _map_file(path)
+        if bytes(file_map[:len(PANEL_FILE_MAGIC)]) != PANEL_FILE_MAGIC:
+            raise ValueError(f"{path} is not a panel file")
+        header_len = int(np.frombuffer(file_map[len(PANEL_FILE_MAGIC):len(PANEL_FILE_MAGIC) + 8], dtype=np.uint64)[0])
+        header_st = len(PANEL_FILE_MAGIC) + 8
+        header = json.loads(bytes(file_map[header_st:header_st + header_len]))
+        shape = tuple(header["shape"])
+        ts_in_ms = np.ndarray((shape[0],), dtype="<i8", buffer=file_map, offset=header["ts_offset"])
+        values = np.ndarray(shape, dtype=np.dtype(header["dtype"]), buffer=file_map, offset=header["values_offset"])
+        panel = cls(values, ts_in_ms, header["symbols"], header["fields"], header.get("interval"))
+        panel._file = (path, file_map)
+        # files written before the validity was saved scan the values on first use
+        if header.get("has_bar_offset"):
+            panel._validity = PanelValidity(np.ndarray(shape[:2], dtype=bool, buffer=file_map,
+                                                       offset=header["has_bar_offset"]))
+        return panel
+
+    def __reduce__(self):
+        # the validity travels with the panel, workers do not scan the values again
+        state = {"_validity": self._validity}
+        if self._file is not None:
+            path, file_map = self._file
+            if np.shares_memory(self.values, file_map):
+                offset = self.values.__array_interface__["data"][0] - file_map.__array_interface__["data"][0]
+                return _open_mapped_view, (path, offset, self.values.shape, self.values.strides,
+                                           self.values.dtype.str, np.asarray(self.ts_in_ms), self.symbols, self.fields,
+                                           self.interval), state
+        return MarketPanel, (self.values, self.ts_in_ms, self.symbols, self.fields, self.interval), state
+
+    # ===== legacy exports =====
+
+    def to_XY(self, y_field: str = "return_1") -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """
+        Same layout as make_XY, X: (n_ts, n_feature, n_symbols), Y: (n_ts, n_symbols), feature names.
+        X and Y are views when y_field is the first or the last field.
+        """
+        k = self.fields.index(y_field)
+        if k == len(self.fields) - 1:
+            features = self.values[:, :, :k]
+        elif k == 0:
+            features = self.values[:, :, 1:]
+        else:
+            features = np.delete(self.values, k, axis=2)
+        return features.transpose(0, 2, 1), self.values[:, :, k], self.fields[:k] + self.fields[k + 1:]
+
+    def to_frame(self) -> pd.DataFrame:
+        """(ts, symbol) MultiIndex DataFrame with fields as columns, built once and cached"""
+        if self._frame is None:
+            multi_idx = pd.MultiIndex.from_product([self.ts, self.symbols], names=["ts", "symbol"])
+            self._frame = pd.DataFrame(self.values.reshape(-1, self.values.shape[-1]), index=multi_idx,
+                                       columns=self.fields)
+        return self._frame
@@ -0,0 +1,251 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Callable, Tuple, Union, Type, Optional
+import numpy as np
+
+from bitquant.data.exchange import BinanceExchange, ResponseType
+from bitquant.data.fetch_engine import Transport, TransportResponse
+from bitquant.data.kline_parser import KLINE_COLUMNS
+from bitquant.data.kline_store import KlineStore
+from bitquant.utils.timeutils import TimeUtils
+
+
+class SyntheticKlines:
+    """
+    Deterministic klines for any symbol and range, a bar only depends on (seed, symbol, open time), so every
+    page of the same range is identical no matter how the range was split into requests.
+
+    listed_at: {symbol: open time in ms of its first bar}, earlier ranges are empty like a late listing
+    """
+
+    def __init__(self, seed: int = 0, listed_at: Dict[str, int] = None):
+        self.seed = seed
+        self.listed_at = listed_at or {}
+
+    def _noise(self, symbol: str, n: np.ndarray, k: int) -> np.ndarray:
+        """uniform [0, 1) per bar, a multiplicative hash of the bar index"""
+        symbol_seed = sum((i + 1) * ord(c) for i, c in enumerate(symbol)) + self.seed * 7919 + k * 104729
+        return ((n * 2654435761 + symbol_seed * 40503) % 4294967296) / 4294967296
+
+    def read(self, symbol: str, interval: str, st_in_ms: int, et_in_ms: int) -> np.ndarray:
+        interval_in_ms = TimeUtils.interval_str_to_ms(interval)
+        st_in_ms = max(st_in_ms, self.listed_at.get(symbol, 0))
+        ots = TimeUtils.interval_grid(st_in_ms, et_in_ms, interval_in_ms)
+        n = ots // interval_in_ms
+        base = 10 + self._noise(symbol, np.zeros(1, dtype=np.int64), 0) * 1000
+        # slow waves plus per bar noise, the price never depends on earlier bars
+        close = base * np.exp(0.2 * np.sin(n / 500) + 0.05 * np.sin(n / 37) + 0.01 * (self._noise(symbol, n, 1) - 0.5))
+        open_ = close * (1 + 0.004 * (self._noise(symbol, n, 2) - 0.5))
+        high = np.maximum(open_, close) * (1 + 0.003 * self._noise(symbol, n, 3))
+        low = np.minimum(open_, close) * (1 - 0.003 * self._noise(symbol, n, 4))
+        volume = np.floor(1000 * self._noise(symbol, n, 5)) / 10
+        usd_v = volume * (open_ + close) / 2
+        n_trades = np.floor(volume * 3)
+        taker_buy_v = np.floor(volume * self._noise(symbol, n, 6) * 10) / 10
+        return np.column_stack([ots, open_, high, low, close, volume, ots + interval_in_ms - 1, usd_v, n_trades,
+                                taker_buy_v, taker_buy_v * (open_ + close) / 2])
+
+
+@dataclass
+class ReplayServer:
+    """
+    In process stand-in for the Binance futures endpoints used by bitquant.data,
+    /fapi/v1/exchangeInfo, /fapi/v1/continuousKlines and /fapi/v1/ping.
+
+    source:       SyntheticKlines or a KlineStore with recorded history
+    symbols:      symbols listed by exchangeInfo
+    latency:      seconds per response, or (min, max) for a uniform latency
+    limit_per_second / weight_limit:
+                  server side limits, a request over either gets 429 with Retry-After like the exchange,
+                  the used weight of the current minute is sent in X-MBX-USED-WEIGHT-1M
+    error_rate:   probability of answering 503, to test retries and partial results
+    now_in_ms:    bars are only served up to this time, the last one is still forming
+    """
+    source: Union[SyntheticKlines, KlineStore] = field(default_factory=SyntheticKlines)
+    symbols: List[str] = field(default_factory=lambda: ["BTCUSDT", "ETHUSDT"])
+    latency: Union[float, Tuple[float, float]] = 0.0
+    limit_per_second: float = None
+    weight_limit: int = None
+    error_rate: float = 0.0
+    seed: int = 0
+    now_in_ms: Callable[[], int] = TimeUtils.now_in_ms
+
+    def __post_init__(self):
+        self.random = random.Random(self.seed)
+        self.stats = {"requests": 0, "ok": 0, "throttled": 0, "errors": 0}
+        self._request_times = deque()
+        self._weight_minute = None
+        self._used_weight = 0
+        self._lock = threading.Lock()
+        self._http = None
+
+    # ===== endpoints =====
+
+    def exchange_info(self) -> Dict[str, Any]:
+        def filters(symbol):
+            return [{"filterType": "PRICE_FILTER", "tickSize": "0.01"},
+                    {"filterType": "LOT_SIZE", "stepSize": "0.001" if symbol.startswith("BTC") else "0.01"},
+                    {"filterType": "MARKET_LOT_SIZE", "stepSize": "0.001"},
+                    {"filterType": "MAX_NUM_ORDERS", "limit": 200},
+                    {"filterType": "MAX_NUM_ALGO_ORDERS", "limit": 10},
+                    {"filterType": "MIN_NOTIONAL", "notional": "5"}]
+        return {"symbols": [{"symbol": symbol, "pair": symbol, "contractType": "PERPETUAL", "status": "TRADING",
+                             "filters": filters(symbol)} for symbol in self.symbols]}
+
+    def continuous_klines(self, params: Dict[str, ResponseType]) -> List[List[Any]]:
+        interval = params["interval"]
+        limit = min(int(params.get("limit", 500)), 1500)
+        interval_in_ms = TimeUtils.interval_str_to_ms(interval)
+        now_in_ms = self.now_in_ms()
+        et_in_ms = min(int(params.get("endTime", now_in_ms)), now_in_ms)
+        st_in_ms = int(params.get("startTime", et_in_ms - interval_in_ms * (limit - 1)))
+        et_in_ms = min(et_in_ms, TimeUtils.ceil_ms(st_in_ms, interval_in_ms) + interval_in_ms * (limit - 1))
+        klines = self.source.read(params["pair"], interval, st_in_ms, et_in_ms)[:limit]
+        # same json as the exchange, numbers as strings except the times and the trade count
+        return [[int(row[0]), *[repr(float(v)) for v in row[1:6]], int(row[6]), repr(float(row[7])), int(row[8]),
+                 repr(float(row[9])), repr(float(row[10])), "0"] for row in klines]
+
+    def request_weight(self, path: str, params: Dict[str, ResponseType]) -> int:
+        if path.endswith("/exchangeInfo") or path.endswith("/ping"):
+            return 1
+        limit = int(params.get("limit", 500))
+        return 1 if limit < 100 else 2 if limit < 500 else 5 if limit <= 1000 else 10
+
+    def respond(self, path: str, params: Dict[str, ResponseType]) -> TransportResponse:
+        """answer one request without latency"""
+        with self._lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            minute = int(time.time() // 60)
+            if minute != self._weight_minute:
+                self._weight_minute, self._used_weight = minute, 0
+            while self._request_times and self._request_times[0] <= now - 1:
+                self._request_times.popleft()
+            weight = self.request_weight(path, params)
+            over_rate = self.limit_per_second is not None and len(self._request_times) >= self.limit_per_second
+            over_weight = self.weight_limit is not None and self._used_weight + weight > self.weight_limit
+            if over_rate or over_weight:
+                self.stats["throttled"] += 1
+                retry_after = 60 - time.time() % 60 if over_weight else 1
+                return 429, {"Retry-After": str(int(np.ceil(retry_after))),
+                             "X-MBX-USED-WEIGHT-1M": str(self._used_weight)}, "Too many requests"
+            self._request_times.append(now)
+            self._used_weight += weight
+            headers = {"X-MBX-USED-WEIGHT-1M": str(self._used_weight)}
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return 503, headers, "Service Unavailable"
+
+        if path.endswith("/fapi/v1/exchangeInfo"):
+            payload = self.exchange_info()
+        elif path.endswith("/fapi/v1/continuousKlines"):
+            payload = self.continuous_klines(params)
+        elif path.endswith("/fapi/v1/ping"):
+            payload = {}
+        else:
+            return 404, headers, f"unknown endpoint {path}"
+        with self._lock:
+            self.stats["ok"] += 1
+        return 200, headers, payload
+
+    def _latency(self) -> float:
+        if isinstance(self.latency, tuple):
+            return self.random.uniform(*self.latency)
+        return self.latency
+
+    async def handle(self, path: str, params: Dict[str, ResponseType]) -> TransportResponse:
+        latency = self._latency()
+        if latency > 0:
+            await asyncio.sleep(latency)
+        return self.respond(path, params)
+
+    # ===== local http stand-in =====
+
+    def serve_http(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Serve the endpoints over http on a background thread, so the real aiohttp transport can be measured.
+
+        Return:
+            base url of the server, e.g. "http://127.0.0.1:53121"
+        """
+        from aiohttp import web
+
+        async def endpoint(request):
+            status, headers, payload = await self.handle(request.path, dict(request.query))
+            if status == 200:
+                return web.json_response(payload, headers=headers)
+            return web.Response(status=status, text=str(payload), headers=headers)
+
+        async def start():
+            app = web.Application()
+            app.router.add_get("/fapi/v1/exchangeInfo", endpoint)
+            app.router.add_get("/fapi/v1/continuousKlines", endpoint)
+            app.router.add_get("/fapi/v1/ping", endpoint)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, host, port)
+            await site.start()
+            return runner, runner.addresses[0][1]
+
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="bitquant-replay-server", daemon=True).start()
+        runner, bound_port = asyncio.run_coroutine_threadsafe(start(), loop).result()
+        self._http = (loop, runner)
+        return f"http://{host}:{bound_port}"
+
+    def stop_http(self):
+        if self._http is None:
+            return
+        loop, runner = self._http
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        self._http = None
+
+
+class ReplayExchange(BinanceExchange):
+    """
+    BinanceExchange answered by a ReplayServer instead of fapi.binance.com, for offline benchmarks and tests.
+
+    Create one class per server with `ReplayExchange.using(server)`, every exchange class has its own
+    fetch engine so client side limits and results of different servers do not mix.
+    Without over_http the requests are answered in process, with over_http they go through a local http server
+    and the same aiohttp transport as the real exchange.
+    """
+    base_url = "replay://"
+    server: ReplayServer = None
+    over_http: bool = False
+
+    @classmethod
+    def using(cls, server: ReplayServer, over_http: bool = False, limit_per_second: float = None,
+              **attributes) -> Type["ReplayExchange"]:
+        attributes.update(server=server, over_http=over_http)
+        if limit_per_second is not None:
+            attributes["limit_per_second"] = limit_per_second
+        if over_http:
+            attributes["base_url"] = server.serve_http()
+        return type(f"{cls.__name__}Using{id(server):x}", (cls,), attributes)
+
+    @classmethod
+    def _transport(cls) -> Optional[Transport]:
+        return None if cls.over_http else cls._serve
+
+    @classmethod
+    async def _serve(cls, url: str, param: Dict[str, ResponseType]) -> TransportResponse:
+        return await cls.server.handle(url[len(cls.base_url):], param)
+
+    @classmethod
+    def get_json(cls, endpoint: str, params: Dict[str, ResponseType] = {}):
+        if cls.over_http:
+            return super().get_json(endpoint, params)
+        latency = cls.server._latency()
+        if latency > 0:
+            time.sleep(latency)
+        status, headers, payload = cls.server.respond(endpoint, params)
+        if status != 200:
+            print(f"error {status=} {payload=} for {endpoint=} for {params=} for {cls.__name__}")
+            return None
+        return payload
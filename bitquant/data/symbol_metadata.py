@@ -0,0 +1,86 @@
+import time
+import threading
+import traceback
+from typing import List, Dict, Type
+import pandas as pd
+
+
+class SymbolMetadata:
+    """
+    Symbol metadata of one exchange (contractType, status, volume_precision, notional) indexed by symbol.
+
+    The exchange info is only requested on the first call and then again in a background thread once the
+    metadata is older than `ttl` seconds, callers keep getting the cached metadata while it is refreshed.
+    If a refresh fails the cached metadata is kept and the refresh is tried again after the next `retry` seconds.
+    """
+
+    _instances: Dict[type, "SymbolMetadata"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, exchange: Type, ttl: float = 3600, retry: float = 60):
+        self.exchange = exchange
+        self.ttl = ttl
+        self.retry = retry
+        self.by_symbol: pd.DataFrame = None
+        self.updated_at = 0.0
+        self._next_refresh_at = 0.0
+        self._lock = threading.Lock()
+        self._first_load_lock = threading.Lock()
+        self._refreshing = False
+
+    @classmethod
+    def for_exchange(cls, exchange: Type) -> "SymbolMetadata":
+        """one shared instance per exchange class, so every client of the process uses the same cache"""
+        with cls._instances_lock:
+            if exchange not in cls._instances:
+                cls._instances[exchange] = cls(exchange)
+            return cls._instances[exchange]
+
+    def refresh(self):
+        """request the exchange info now and replace the cached metadata"""
+        try:
+            by_symbol = self.exchange.get_symbol_info().set_index("symbol")
+        except Exception:
+            traceback.print_exc()
+            with self._lock:
+                self._next_refresh_at = time.monotonic() + self.retry
+            if self.by_symbol is None:
+                raise
+            return
+        with self._lock:
+            self.by_symbol = by_symbol
+            self.updated_at = time.monotonic()
+            self._next_refresh_at = self.updated_at + self.ttl
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            self._refreshing = False
+
+    def get(self) -> pd.DataFrame:
+        """
+        Return:
+            DataFrame indexed by symbol, blocks only while nothing is cached yet
+        """
+        if self.by_symbol is None:
+            with self._first_load_lock:
+                if self.by_symbol is None:
+                    self.refresh()
+        elif time.monotonic() >= self._next_refresh_at and not self._refreshing:
+            with self._lock:
+                start_refresh = not self._refreshing
+                self._refreshing = True
+            if start_refresh:
+                threading.Thread(target=self._refresh_in_background, name="bitquant-symbol-metadata",
+                                 daemon=True).start()
+        return self.by_symbol
+
+    def get_symbol_info(self) -> pd.DataFrame:
+        """same layout as exchange.get_symbol_info, one row per symbol with "symbol" as column"""
+        return self.get().reset_index()
+
+    def get_symbol_info_by_symbols(self, symbols: List[str]) -> pd.DataFrame:
+        """rows of the given symbols in the order of `symbols`, unknown symbols are left out"""
+        by_symbol = self.get()
+        return by_symbol.loc[[symbol for symbol in symbols if symbol in by_symbol.index]].reset_index()
@@ -3,6 +3,7 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from typing import List
+from bitquant.data.market_panel import MarketPanel
 
 
 @nb.njit
@@ -42,9 +43,19 @@ class Simulator:
 
     def __init__(self, portfolio_weight_matrix: np.array, price_matrix: np.array, ts_lis: List, symbol_lis: List, init_cash: float, order_size: float, taker_fee: float,
                  volume_precision: np.array, min_notional: np.array, display=True, plot=True):
+        """
+        price_matrix: (n_ts, n_symbols, 5) array of open, low, high, close, vwap, or a MarketPanel with those fields.
+            For a MarketPanel ts_lis and symbol_lis can be None and are taken from the panel.
+        """
         self.portfolio_weight_matrix = portfolio_weight_matrix
         self.price_matrix = price_matrix
 
+        if isinstance(price_matrix, MarketPanel):
+            ts_lis = price_matrix.ts if ts_lis is None else ts_lis
+            symbol_lis = price_matrix.symbols if symbol_lis is None else symbol_lis
+            price_matrix = price_matrix.select_fields(["open", "low", "high", "close", "vwap"]).values
+        # cash, positions and equity are accumulated in float64, a float32 panel is converted once
+        price_matrix = np.asarray(price_matrix, dtype=np.float64)
         self.open_price_matrix = price_matrix[:, :, 0]
         self.low_price_matrix = price_matrix[:, :, 1]
         self.hight_price_matrix = price_matrix[:, :, 2]
@@ -68,8 +79,8 @@ class Simulator:
 
     def result_analysis(self):
         self.position_matrix = self.res[:, :-1].copy()
-        self.mark_price_matrix = self.price_matrix[:, :, 3]  # close
-        self.filled_price_matrix = self.price_matrix[:, :, 0]  # open
+        self.mark_price_matrix = self.close_price_matrix  # close
+        self.filled_price_matrix = self.open_price_matrix  # open
         self.res[:, :-1] = self.res[:, :-1] * self.mark_price_matrix  # close
         if not isinstance(self.symbol_lis, list):
             self.symbol_lis = self.symbol_lis.tolist()
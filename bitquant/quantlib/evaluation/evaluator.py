@@ -1,5 +1,6 @@
 import numpy as np
 import numba as nb
+from bitquant.data.market_panel import MarketPanel
 
 @nb.njit
 def _start_loop(portfolio_weight_matrix, trade_price_matrix, init_cash, order_size, taker_fee, volume_precision, min_notional):
@@ -36,6 +37,11 @@ def _start_loop(portfolio_weight_matrix, trade_price_matrix, init_cash, order_si
 
 class Evaluator:
     def evaluate(self, portfolio_weight_matrix: np.array, price_matrix: np.array, init_cash: float, order_size:float, taker_fee: float, volume_precision: np.array, min_notional: np.array):
+        """price_matrix: (n_ts, n_symbols, 5) array of open, low, high, close, vwap, or a MarketPanel with those fields"""
+        if isinstance(price_matrix, MarketPanel):
+            price_matrix = price_matrix.select_fields(["open", "low", "high", "close", "vwap"]).values
+        # cash and positions are accumulated in float64, a float32 panel is converted once
+        price_matrix = np.asarray(price_matrix, dtype=np.float64)
         open_price_matrix = price_matrix[:, :, 0]
         low_price_matrix = price_matrix[:, :, 1]
         hight_price_matrix = price_matrix[:, :, 2]
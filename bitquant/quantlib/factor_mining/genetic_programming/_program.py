@@ -14,7 +14,7 @@ Author: Shawn_RPC
 from copy import copy,deepcopy
 import numpy as np
 from sklearn.utils.random import sample_without_replacement
-from bitquant.quantlib.functions.functions import _Function
+from bitquant.quantlib.functions.functions import _Function, BufferPool
 from bitquant.quantlib.factor_mining.genetic_programming.utils import check_random_state
 import warnings
 from copy import deepcopy
@@ -559,11 +559,14 @@ class _Program(object):
         # col_dict = self._get_name_map(X)
 
         if isinstance(node, float):
-            return np.tile(node, (X.shape[0], X.shape[2]))
+            return np.full((X.shape[0], X.shape[2]), node, dtype=X.dtype)
         if isinstance(node, int):
             return X[:, node, :]
 
         apply_stack = []
+        # the intermediate results are recycled, float terminals are read only views of one value
+        pool = BufferPool()
+        shape = (X.shape[0], X.shape[2])
 
         for node in self.program:
 
@@ -584,19 +587,19 @@ class _Program(object):
                 # alpha_pool
                 elif (function.need_param is not None) and (function.name.startswith('alpha_pool')):
 
-                    terminals = [np.tile(t, (X.shape[0],X.shape[2])) if isinstance(t, float)
+                    terminals = [np.broadcast_to(X.dtype.type(t), shape) if isinstance(t, float)
                 else X[:,t,:] if isinstance(t, int)
                     else t for t in apply_stack[-1][1:]]
                     terminals.append(X[:, list(self.feature_names).index(function.need_param[0]), :])
                     # print(1, terminals)
 
                 else:
-                    terminals = [np.tile(t, (X.shape[0],X.shape[2])) if isinstance(t, float)
+                    terminals = [np.broadcast_to(X.dtype.type(t), shape) if isinstance(t, float)
                 else X[:,t,:] if isinstance(t, int)
                     else t for t in apply_stack[-1][1:]]
                     # print(2, terminals)
                 # print('final', len(terminals))
-                intermediate_result = function(*terminals)
+                intermediate_result = pool.call(function, *terminals)
                 if len(apply_stack) != 1:
                     apply_stack.pop()
                     apply_stack[-1].append(intermediate_result)
@@ -15,6 +15,7 @@ from joblib import wrap_non_picklable_objects
 from scipy.stats import rankdata, spearmanr
 import pandas as pd
 from numba import jit, prange
+from bitquant.quantlib.functions.utils import cs_rank, cs_corr, cs_nanquantile
 __all__ = ['make_fitness']
 
 
@@ -390,7 +391,7 @@ def _bt_sharpe_old_version(y, y_pred, w, rolling_window_1=180, rolling_window_2=
         hedge_ret = np.nanmean(np.select([signal_matrix==1, signal_matrix==-1], [y_notna, -1 * y_notna], default=np.nan), axis=1)
         turnover_rate = np.concatenate([np.abs(signal_matrix[0, :].reshape((1, -1))), np.abs(np.diff(signal_matrix, axis=0))], axis=0).sum(axis=1) / np.abs(signal_matrix[0, :]).sum()
         fee_cost = turnover_rate * fee
-        equity = 1+(hedge_ret - fee_cost).cumsum()
+        equity = 1+(hedge_ret - fee_cost).cumsum(dtype=np.float64)
         sharpe = np.nanmean(np.diff(equity)) / np.nanstd(np.diff(equity))
 
     if sharpe is not None:
@@ -400,6 +401,23 @@ def _bt_sharpe_old_version(y, y_pred, w, rolling_window_1=180, rolling_window_2=
     return -1.
 
 
+def _rank_ic_and_signals(y_pred, y):
+    """
+    Spearman ic of every row of y_pred with y, and the long (1) / short (-1) signals of the symbols above the 0.8 and
+    below the 0.2 quantile of their row. Like spearmanr and np.quantile, a row with a nan has a nan ic and no signal.
+    """
+    # float64 ranks for float32 features, the ic is not rounded
+    ic = cs_corr(cs_rank(y_pred, out=np.empty(y_pred.shape)), cs_rank(y, out=np.empty(y.shape)))
+    has_nan = np.isnan(y_pred).any(axis=1)
+    upper = cs_nanquantile(y_pred, 0.8)
+    lower = cs_nanquantile(y_pred, 0.2)
+    upper[has_nan] = np.nan
+    lower[has_nan] = np.nan
+    signals = np.select(condlist=[y_pred > upper[:, np.newaxis], y_pred < lower[:, np.newaxis]],
+                        choicelist=[1, -1], default=0)
+    return ic, signals
+
+
 import numba as nb
 @nb.njit
 def _start_loop_for_fitness(n, m, trade_p_matrix, signal_matrix, taker_fee):
@@ -455,21 +473,15 @@ def _bt_sharpe(y, y_pred, w, rolling_window_1=180, rolling_window_2=90, fee=0.00
 
     
     with np.errstate(divide='ignore', invalid='ignore'):
-        no_future_beta = []
-        origin_signals_df = np.array([0]*y_pred_normalized.shape[1])
-        for i in range(len(y_pred_normalized)):
-            no_future_beta.append(spearmanr(y_pred_normalized[i], y_normalized[i])[0])
-            signals = np.select(condlist=[y_pred_normalized[i] > np.quantile(y_pred_normalized[i], 0.8), y_pred_normalized[i] < np.quantile(y_pred_normalized[i], 0.2)],
-                                choicelist=[1, -1], default=0)
-            origin_signals_df = np.vstack((origin_signals_df, signals))
-        origin_signals_df = origin_signals_df[1:, :]
+        no_future_beta, origin_signals_df = _rank_ic_and_signals(y_pred_normalized, y_normalized)
         no_future_beta = pd.Series(no_future_beta).shift(1).fillna(0)
         y_notna = y_normalized[no_future_beta.rolling(rolling_window_2, min_periods=rolling_window_2).mean().notna()]
         origin_signals_df_notna = origin_signals_df[no_future_beta.rolling(rolling_window_2, min_periods=rolling_window_2).mean().notna()]
         no_future_beta_rolling = no_future_beta.rolling(rolling_window_2, min_periods=rolling_window_2).mean().dropna()
         signal_matrix = np.diag(np.sign(no_future_beta_rolling)) @ origin_signals_df_notna
     
-        present_price = np.concatenate([np.array([1] * y_notna.shape[1]).reshape((1, -1)), 1+y_notna], axis=0).cumprod(axis=0)[:-1]
+        # cumulative prices and equity stay float64 for float32 features
+        present_price = np.concatenate([np.array([1] * y_notna.shape[1]).reshape((1, -1)), 1+y_notna], axis=0).cumprod(axis=0, dtype=np.float64)[:-1]
         n, m = signal_matrix.shape
         res = _start_loop_for_fitness(n, m, present_price, signal_matrix, fee)
         res[:, :-1] = res[:, :-1] * present_price
@@ -498,21 +510,15 @@ def _bt_pnl(y, y_pred, w, rolling_window_1=180, rolling_window_2=90, fee=0.0003)
 
     
     with np.errstate(divide='ignore', invalid='ignore'):
-        no_future_beta = []
-        origin_signals_df = np.array([0]*y_pred_normalized.shape[1])
-        for i in range(len(y_pred_normalized)):
-            no_future_beta.append(spearmanr(y_pred_normalized[i], y_normalized[i])[0])
-            signals = np.select(condlist=[y_pred_normalized[i] > np.quantile(y_pred_normalized[i], 0.8), y_pred_normalized[i] < np.quantile(y_pred_normalized[i], 0.2)],
-                                choicelist=[1, -1], default=0)
-            origin_signals_df = np.vstack((origin_signals_df, signals))
-        origin_signals_df = origin_signals_df[1:, :]
+        no_future_beta, origin_signals_df = _rank_ic_and_signals(y_pred_normalized, y_normalized)
         no_future_beta = pd.Series(no_future_beta).shift(1).fillna(0)
         y_notna = y_normalized[no_future_beta.rolling(rolling_window_2, min_periods=rolling_window_2).mean().notna()]
         origin_signals_df_notna = origin_signals_df[no_future_beta.rolling(rolling_window_2, min_periods=rolling_window_2).mean().notna()]
         no_future_beta_rolling = no_future_beta.rolling(rolling_window_2, min_periods=rolling_window_2).mean().dropna()
         signal_matrix = np.diag(np.sign(no_future_beta_rolling)) @ origin_signals_df_notna
     
-        present_price = np.concatenate([np.array([1] * y_notna.shape[1]).reshape((1, -1)), 1+y_notna], axis=0).cumprod(axis=0)[:-1]
+        # cumulative prices and equity stay float64 for float32 features
+        present_price = np.concatenate([np.array([1] * y_notna.shape[1]).reshape((1, -1)), 1+y_notna], axis=0).cumprod(axis=0, dtype=np.float64)[:-1]
         n, m = signal_matrix.shape
         res = _start_loop_for_fitness(n, m, present_price, signal_matrix, fee)
         res[:, :-1] = res[:, :-1] * present_price
@@ -14,6 +14,7 @@ from abc import ABCMeta, abstractmethod
 from time import time
 from warnings import warn
 import warnings
+import numba
 import numpy as np
 import pandas as pd
 from joblib import Parallel, delayed
@@ -28,7 +29,7 @@ from bitquant.quantlib.factor_mining.genetic_programming.utils import _syntax_ad
 from bitquant.quantlib.factor_mining.genetic_programming._program import _Program
 from bitquant.quantlib.factor_mining.genetic_programming.fitness import _fitness_map, _Fitness, _extra_map, _weighted_pearson_3D, _weighted_Information_Ratio_3D
 import re
-from bitquant.quantlib.functions.functions import _function_map, _Function, sig1 as sigmoid
+from bitquant.quantlib.functions.functions import _function_map, _Function, sig1 as sigmoid, set_column_threads
 
 # 对字典进行合并
 all_cal_dictionary = dict(list(_function_map.items()))
@@ -40,8 +41,12 @@ STOCK_COL = "symbol"
 DATE_COL = "col"
 
 
-def _parallel_evolve_3D(n_programs, parents, X, y, sample_weight, seeds, params):
+def _parallel_evolve_3D(n_programs, parents, X, y, sample_weight, seeds, params, worker=False):
     """Private function used to build a batch of programs within a job."""
+    if worker:
+        # the jobs already fill the cpus, the primitives of a job run on its own thread
+        set_column_threads(1)
+        numba.set_num_threads(1)
     # 这里是并行调用Parallel 进行改进的地方，通过修改这个部分，能够把数据结构进行修正
     n_dates, n_features, n_stocks = X.shape
 
@@ -520,7 +525,8 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
                                               y,
                                               sample_weight,
                                               seeds[starts[i]:starts[i + 1]],
-                                              params)
+                                              params,
+                                              worker=n_jobs > 1)
                     for i in range(n_jobs))
             else:
                 population = []
@@ -561,7 +567,7 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
                         new_string = formulation
                         for number in numbers:
                             new_string = new_string.replace(number,
-                                                            "np.tile({}, (X.shape[0], X.shape[2]))".format(number))
+                                                            "np.broadcast_to(X.dtype.type({}), (X.shape[0], X.shape[2]))".format(number))
                         formulation = new_string
 
                     for feature, feature_input in feature_dictionary.items():
@@ -1670,7 +1676,7 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
                     new_string = formulation
                     for number in numbers:
                         new_string = new_string.replace(number,
-                                                        "np.tile({}, (trainX.shape[0], trainX.shape[2]))".format(
+                                                        "np.broadcast_to(trainX.dtype.type({}), (trainX.shape[0], trainX.shape[2]))".format(
                                                             number))
                     formulation = new_string
                 for feature, feature_input in feature_dictionary.items():
@@ -1748,7 +1754,7 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
                     new_string = formulation
                     for number in numbers:
                         new_string = new_string.replace(number,
-                                                        "np.tile({}, (trainX.shape[0], trainX.shape[2]))".format(
+                                                        "np.broadcast_to(trainX.dtype.type({}), (trainX.shape[0], trainX.shape[2]))".format(
                                                             number))
                     formulation = new_string
                 for feature, feature_input in feature_dictionary.items():
@@ -1825,7 +1831,7 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
                     new_string = formulation
                     for number in numbers:
                         new_string = new_string.replace(number,
-                                                        "np.tile({}, (trainX.shape[0], trainX.shape[2]))".format(
+                                                        "np.broadcast_to(trainX.dtype.type({}), (trainX.shape[0], trainX.shape[2]))".format(
                                                             number))
                     formulation = new_string
                 for feature, feature_input in feature_dictionary.items():
@@ -10,20 +10,29 @@ import numbers
 import numpy as np
 from joblib import cpu_count
 from copy import deepcopy
+from bitquant.data.market_panel import MarketPanel
 
-def make_XY(df, index_name, columns_name, Y_column1,):
+def make_XY(df, index_name, columns_name, Y_column1, dtype=None):
     '''
+    dtype: defaults to the dtype of the data, float32 and float64 are kept
     return: X: ndarray[n_dates, n_feature, n_stocks], Y: ndarray[n_dates, n_stocks], X_feature_names
     '''
+    if isinstance(df, MarketPanel):
+        # views of the panel, nothing to pivot
+        X, Y1, feature_names = df.to_XY(Y_column1)
+        if dtype is not None and X.dtype != dtype:
+            X, Y1 = X.astype(dtype), Y1.astype(dtype)
+        return X, Y1, feature_names
+    dtype = np.result_type(*df.dtypes, np.float32) if dtype is None else dtype
     df = deepcopy(df.reset_index())
     df = df.pivot_table(index=[index_name], columns=[columns_name], sort=False, dropna=False)
-    Y1 = df.loc[:,(Y_column1,)].to_numpy(dtype=np.double)
+    Y1 = df.loc[:,(Y_column1,)].to_numpy(dtype=dtype)
 
     df = df.drop([Y_column1,],axis=1)
     X_0_len = len(df.index)
     X_1_len = len(df.columns.levels[0]) - 1
     X_2_len = len(df.columns.levels[1])
-    return df.to_numpy(dtype=np.double).reshape((X_0_len, X_1_len, X_2_len)), Y1, df.columns.levels[0].drop([Y_column1,])
+    return df.to_numpy(dtype=dtype).reshape((X_0_len, X_1_len, X_2_len)), Y1, df.columns.levels[0].drop([Y_column1,])
 
 def check_random_state(seed):
     """Turn seed into a np.random.RandomState instance
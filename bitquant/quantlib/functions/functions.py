@@ -10,10 +10,16 @@ own custom functions.
 # License: BSD 3 clause
 
 from joblib import wrap_non_picklable_objects
+from concurrent.futures import ThreadPoolExecutor, wait
 import copy
+import inspect
+import os
+import threading
 import numpy as np
 import pandas as pd
-from bitquant.quantlib.functions.utils import rolling_window, calc_zscore_2d, rolling_nanmean, rolling_max, rolling_nanstd, cal_rolling_ic
+from bitquant.quantlib.functions.utils import rolling_window, calc_zscore_2d, rolling_nanmean, rolling_max, rolling_nanstd, cal_rolling_ic, \
+    rolling_min, rolling_argmax, rolling_rank, rolling_quantile, cs_rank, cs_zscore, cs_demean, cs_quantile
+from bitquant.quantlib.functions import indicators
 
 
 import talib as ta
@@ -41,9 +47,18 @@ class _Function(object):
     arity : int
         The number of arguments that the ``function`` takes.
 
+    lookback : (int, int)
+        (slope, constant) of the number of bars before the current one the
+        function needs, slope * t + constant for its first int parameter t.
+        Its output is not valid (nan, 0 for ts_ht_trendmode) for that many bars
+        at the start of its input.
+
+    The output of a function that takes an ``out`` keyword (or a NumPy ufunc)
+    can be written into a preallocated array, see :class:`BufferPool`.
+
     """
 
-    def __init__(self, function, name, arity,isRandom=(False,(1,100)), need_param=None):
+    def __init__(self, function, name, arity,isRandom=(False,(1,100)), need_param=None, lookback=(0, 0)):
         self.function = function
         self.name = name
         # self.origin_name = name
@@ -63,17 +78,97 @@ class _Function(object):
         """
         self.baseConst = 5
 
+        self._lookback = lookback
+
+        self.has_out = _accepts_out(function)
+
+    def lookback(self, *params):
+        """bars before the current one a node with the int parameters params needs, before its first valid output"""
+        slope, constant = self._lookback
+        return slope * params[0] + constant if slope else constant
 
-    def __call__(self, *args):
+    def __call__(self, *args, out=None):
+        # out is only passed to the functions that take it
+        kwargs = {} if out is None else {'out': out}
         if self.isRandom and self.baseConst>0:
             if len(args)>1 and isinstance(args[-1],int):
-                return self.function(*args)
+                return self.function(*args, **kwargs)
             else:
-                return self.function(*args,self.baseConst)
+                return self.function(*args,self.baseConst, **kwargs)
         else:
-            return self.function(*args)
+            return self.function(*args, **kwargs)
+
+
+def _accepts_out(function):
+    """whether function can write its result into an out keyword argument"""
+    if isinstance(function, np.ufunc):
+        return True
+    try:
+        return 'out' in inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return False
 
 
+class BufferPool:
+    """
+    Output arrays of the primitives recycled by shape and dtype within the evaluation of one program.
+
+    call(function, *args) calls the _Function with an array of the pool as its out when it takes one (and its
+    array arguments share one shape and dtype). The results the pool owns, its arrays and the new arrays returned
+    by the primitives without out, go back to the pool once they are passed to their parent node, so a tree needs
+    about one array per level instead of one per node. The arrays of the caller, e.g. the features, are never
+    written. The result of the root is the caller's, take a new pool for the next program.
+
+    usage:
+        pool = BufferPool()
+        delta = pool.call(ts_delta, X[:, 0, :], 5)
+        value = pool.call(add2, delta, X[:, 1, :])  # writes into a new array, delta is free again
+        pool.n_allocated                            # 2
+    """
+
+    def __init__(self):
+        self._free = {}
+        self._owned = {}
+        self.n_allocated = 0
+
+    def _take(self, shape, dtype):
+        free = self._free.get((shape, dtype))
+        if free:
+            array = free.pop()
+        else:
+            array = np.empty(shape, dtype=dtype)
+            self.n_allocated += 1
+        self._owned[id(array)] = array
+        return array
+
+    def _give(self, array):
+        if self._owned.pop(id(array), None) is not None:
+            self._free.setdefault((array.shape, array.dtype), []).append(array)
+
+    def call(self, function, *args):
+        arrays = [arg for arg in args if isinstance(arg, np.ndarray)]
+        out = None
+        if (function.has_out and arrays
+                and all(x.shape == arrays[0].shape and x.dtype == arrays[0].dtype for x in arrays)):
+            out = self._take(arrays[0].shape, arrays[0].dtype)
+            result = function(*args, out=out)
+        else:
+            # the primitive allocates its own result, a free array of the pool is released in exchange
+            if arrays and self._free.get((arrays[0].shape, arrays[0].dtype)):
+                self._free[(arrays[0].shape, arrays[0].dtype)].pop()
+            result = function(*args)
+        if result is not out:
+            if out is not None:
+                self._give(out)
+            # a new array of the primitive, not one of its arguments or a view
+            if (isinstance(result, np.ndarray) and result.base is None and result.flags.writeable
+                    and not any(result is x for x in arrays)):
+                self._owned[id(result)] = result
+        for x in arrays:
+            if x is not result:
+                self._give(x)
+        return result
+
 
 def make_function(*, function, name, arity, wrap=True):
     """Make a function node, a representation of a mathematical relationship.
@@ -150,27 +245,104 @@ def make_function(*, function, name, arity, wrap=True):
                      arity=arity)
 
 
-def _protected_division(x1, x2):
+def _as_double(x1):
+    """talib only takes float64, float32 features are converted one column at a time"""
+    return np.ascontiguousarray(x1, dtype=np.float64)
+
+
+# threads the symbols of a talib indicator are split across, talib releases the GIL in its C loops.
+# Set it to 1 with set_column_threads where programs are already evaluated in parallel processes
+_column_threads = os.cpu_count() or 1
+_column_executor = None
+_column_executor_lock = threading.Lock()
+
+
+def set_column_threads(n_threads: int):
+    global _column_threads, _column_executor
+    with _column_executor_lock:
+        if _column_executor is not None:
+            _column_executor.shutdown(wait=False)
+        _column_threads, _column_executor = max(int(n_threads), 1), None
+
+
+def _get_column_executor() -> ThreadPoolExecutor:
+    global _column_executor
+    with _column_executor_lock:
+        if _column_executor is None:
+            _column_executor = ThreadPoolExecutor(max_workers=_column_threads, thread_name_prefix="bitquant-talib")
+        return _column_executor
+
+
+def _map_columns(indicator, *xs, out=None, **kwargs):
+    """
+    Apply a per symbol indicator, e.g. ta.RSI, to every column of the 2D inputs.
+
+    The columns are split in one chunk per thread and written into one preallocated array of the dtype of x1
+    (or into out), every input column is passed as float64 like talib needs, kwargs are passed to every call.
+    An error of any column is raised to the caller once every chunk has returned, so no thread still writes into
+    out when the caller hands it on.
+    """
+    x1 = xs[0]
+    if out is None:
+        out = np.empty(x1.shape, dtype=x1.dtype)
+    # errstate is per thread, the workers use the one of the caller
+    err = np.geterr()
+
+    def run(cols):
+        with np.errstate(**err):
+            for col in cols:
+                out[:, col] = indicator(*(_as_double(x[:, col]) for x in xs), **kwargs)
+
+    n_chunks = min(_column_threads, x1.shape[1])
+    if n_chunks <= 1:
+        run(range(x1.shape[1]))
+    else:
+        executor = _get_column_executor()
+        chunks = np.array_split(np.arange(x1.shape[1]), n_chunks)
+        futures = [executor.submit(run, cols) for cols in chunks]
+        wait(futures)
+        for future in futures:
+            future.result()
+    return out
+
+
+def _protected_division(x1, x2, out=None):
     """Closure of division (x1/x2) for zero denominator."""
     with np.errstate(divide='ignore', invalid='ignore'):
-        return np.where(np.abs(x2) > 0.001, np.divide(x1, x2), 1.)
+        if out is None:
+            return np.where(np.abs(x2) > 0.001, np.divide(x1, x2), 1.)
+        closed = ~(np.abs(x2, out=out) > 0.001)
+        np.divide(x1, x2, out=out)
+        np.copyto(out, 1., where=closed)
+        return out
 
 
-def _protected_sqrt(x1):
+def _protected_sqrt(x1, out=None):
     """Closure of square root for negative arguments."""
-    return np.sqrt(np.abs(x1))
+    return np.sqrt(np.abs(x1, out=out), out=out)
 
 
-def _protected_log(x1):
+def _protected_log(x1, out=None):
     """Closure of log for zero and negative arguments."""
     with np.errstate(divide='ignore', invalid='ignore'):
-        return np.where(np.abs(x1) > 0.001, np.log(np.abs(x1)), 0.)
+        if out is None:
+            return np.where(np.abs(x1) > 0.001, np.log(np.abs(x1)), 0.)
+        np.abs(x1, out=out)
+        closed = ~(out > 0.001)
+        np.log(out, out=out)
+        np.copyto(out, 0., where=closed)
+        return out
 
 
-def _protected_inverse(x1):
+def _protected_inverse(x1, out=None):
     """Closure of inverse for zero arguments."""
     with np.errstate(divide='ignore', invalid='ignore'):
-        return np.where(np.abs(x1) > 0.001, 1. / x1, 0.)
+        if out is None:
+            return np.where(np.abs(x1) > 0.001, 1. / x1, 0.)
+        closed = ~(np.abs(x1, out=out) > 0.001)
+        np.divide(1., x1, out=out)
+        np.copyto(out, 0., where=closed)
+        return out
 
 
 def _add(X: pd.DataFrame):
@@ -206,33 +378,72 @@ def ts_std_10(x1):
         return np.nanstd(rolling_window(x1, 10), axis=x1.ndim)
 
 
-def _ts_delay(x1, t):
-    return pd.DataFrame(x1).shift(t).values
+def _ts_delay(x1, t, out=None):
+    """x1 shifted down by t rows, the first t rows are nan"""
+    if out is None:
+        out = np.empty(x1.shape, dtype=np.result_type(x1, np.float32))
+    t = min(t, len(x1))
+    out[:t] = np.nan
+    out[t:] = x1[:len(x1) - t]
+    return out
 
 
-def _ts_delta(x1, t):
-    return x1 - _ts_delay(x1, t)
+def _ts_delta(x1, t, out=None):
+    delayed = _ts_delay(x1, t, out=out)
+    return np.subtract(x1, delayed, out=delayed)
 
 
-def _sigmoid(x1):
+def _sigmoid(x1, out=None):
     """Special case of logistic function to transform to probabilities."""
     with np.errstate(over='ignore', under='ignore'):
-        return 1 / (1 + np.exp(-x1))
+        if out is None:
+            return 1 / (1 + np.exp(-x1))
+        np.negative(x1, out=out)
+        np.exp(out, out=out)
+        np.add(1, out, out=out)
+        return np.divide(1, out, out=out)
+
+
+def _ts_std(x1, t, out=None):
+    with np.errstate(over='ignore', under='ignore'):
+        return rolling_nanstd(x1, t, out=out)
+
+
+def _ts_mean(x1, t, out=None):
+    with np.errstate(over='ignore', under='ignore'):
+        return rolling_nanmean(x1, t, out=out)
 
 
-def _ts_std(x1, t):
+def _ts_max(x1, t, out=None):
     with np.errstate(over='ignore', under='ignore'):
-        return rolling_nanstd(x1, t)
+        return rolling_max(x1, t, out=out)
 
 
-def _ts_mean(x1, t):
+def _ts_min(x1, t, out=None):
     with np.errstate(over='ignore', under='ignore'):
-        return rolling_nanmean(x1, t)
+        return rolling_min(x1, t, out=out)
 
 
-def _ts_max(x1, t):
+def _ts_argmax(x1, t, out=None):
+    """position of the max in the last t bars, 0 for the oldest bar and t - 1 for the current one"""
     with np.errstate(over='ignore', under='ignore'):
-        return rolling_max(x1, t)
+        return rolling_argmax(x1, t, out=out)
+
+
+def _ts_range(x1, t, out=None):
+    with np.errstate(over='ignore', under='ignore'):
+        highest = rolling_max(x1, t, out=out)
+        return np.subtract(highest, rolling_min(x1, t), out=highest)
+
+
+def _ts_rank(x1, t, out=None):
+    """percentile rank of the current bar among the last t bars, in (0, 1]"""
+    return rolling_rank(x1, t, out=out)
+
+
+def _ts_quantile(x1, t, q=0.5, out=None):
+    """q quantile of the last t bars, the median by default"""
+    return rolling_quantile(x1, t, q, out=out)
 
 
 def _ts_normalize_180(x1):
@@ -257,12 +468,53 @@ tan1 = _Function(function=np.tan, name='common_tan', arity=1)
 sig1 = _Function(function=_sigmoid, name='common_sig', arity=1)
 
 
-dynamic_ts_std = _Function(function=_ts_std, name='dynamic_ts_std', arity=1, isRandom=(True, [7, 14, 21, 28]))
-dynamic_ts_mean = _Function(function=_ts_mean, name='dynamic_ts_mean', arity=1, isRandom=(True, [7, 14, 21, 28]))
-dynamic_ts_max = _Function(function=_ts_max, name='dynamic_ts_max', arity=1, isRandom=(True, [7, 14, 21, 28]))
-ts_delay = _Function(function=_ts_delay, name='ts_delay', arity=1, isRandom=(True, [1, 3, 5, 7, 12, 14]))
-ts_delta = _Function(function=_ts_delta, name='ts_delta', arity=1, isRandom=(True, [1, 3, 5, 7, 12, 14]))
-ts_normalize_180 = _Function(function=_ts_normalize_180, name='ts_normalize_180', arity=1)
+dynamic_ts_std = _Function(function=_ts_std, name='dynamic_ts_std', arity=1, isRandom=(True, [7, 14, 21, 28]),
+                           lookback=(1, -1))
+dynamic_ts_mean = _Function(function=_ts_mean, name='dynamic_ts_mean', arity=1, isRandom=(True, [7, 14, 21, 28]),
+                            lookback=(1, -1))
+dynamic_ts_max = _Function(function=_ts_max, name='dynamic_ts_max', arity=1, isRandom=(True, [7, 14, 21, 28]),
+                           lookback=(1, -1))
+ts_min = _Function(function=_ts_min, name='ts_min', arity=1, isRandom=(True, [7, 14, 21, 28]), lookback=(1, -1))
+ts_argmax = _Function(function=_ts_argmax, name='ts_argmax', arity=1, isRandom=(True, [7, 14, 21, 28]),
+                      lookback=(1, -1))
+ts_range = _Function(function=_ts_range, name='ts_range', arity=1, isRandom=(True, [7, 14, 21, 28]), lookback=(1, -1))
+ts_delay = _Function(function=_ts_delay, name='ts_delay', arity=1, isRandom=(True, [1, 3, 5, 7, 12, 14]),
+                     lookback=(1, 0))
+ts_delta = _Function(function=_ts_delta, name='ts_delta', arity=1, isRandom=(True, [1, 3, 5, 7, 12, 14]),
+                     lookback=(1, 0))
+ts_rank = _Function(function=_ts_rank, name='ts_rank', arity=1, isRandom=(True, [7, 14, 21, 28]), lookback=(1, -1))
+ts_quantile = _Function(function=_ts_quantile, name='ts_quantile', arity=1, isRandom=(True, [7, 14, 21, 28]),
+                        lookback=(1, -1))
+ts_normalize_180 = _Function(function=_ts_normalize_180, name='ts_normalize_180', arity=1, lookback=(0, 180))
+
+
+"""---------------------------------------------Cross Section---------------------------------------------"""
+
+
+def _cs_rank(x1, out=None):
+    """percentile rank of every symbol in its bar, in (0, 1]"""
+    return cs_rank(x1, out=out)
+
+
+def _cs_zscore(x1, out=None):
+    with np.errstate(over='ignore', under='ignore'):
+        return cs_zscore(x1, out=out)
+
+
+def _cs_demean(x1, out=None):
+    with np.errstate(over='ignore', under='ignore'):
+        return cs_demean(x1, out=out)
+
+
+def _cs_quantile(x1, t, out=None):
+    """quantile bucket of every symbol in its bar, 0 to t - 1 from the lowest to the highest"""
+    return cs_quantile(x1, t, out=out)
+
+
+cs_rank1 = _Function(function=_cs_rank, name='cs_rank', arity=1)
+cs_zscore1 = _Function(function=_cs_zscore, name='cs_zscore', arity=1)
+cs_demean1 = _Function(function=_cs_demean, name='cs_demean', arity=1)
+cs_quantile1 = _Function(function=_cs_quantile, name='cs_quantile', arity=1, isRandom=(True, [3, 5, 10]))
 
 
 
@@ -274,7 +526,7 @@ ts_normalize_180 = _Function(function=_ts_normalize_180, name='ts_normalize_180'
 """------Overlap Studies Functions------"""
 
 
-def _BBANDS(x1: np.ndarray, t) -> np.ndarray:
+def _BBANDS(x1: np.ndarray, t, out=None) -> np.ndarray:
     """
     Calculate the Bollinger Bands for each column of the input 2D array.
 
@@ -286,38 +538,33 @@ def _BBANDS(x1: np.ndarray, t) -> np.ndarray:
     - 2D Numpy array with the upper Bollinger Band values. (Can be adjusted for middle and lower bands)
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            upper, middle, lower = ta.BBANDS(x1[:, col], timeperiod=t)
-            factor_table[:, col] = (upper - middle) / (middle - lower)
+        def bands(close):
+            upper, middle, lower = ta.BBANDS(close, timeperiod=t)
+            return (upper - middle) / (middle - lower)
 
-        return factor_table
+        return _map_columns(bands, x1, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_bbands = _Function(function=_BBANDS, name='ts_bbands', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                      need_param=['close'])
+                      need_param=['close'], lookback=(1, -1))
 
 
-def _DEMA(x1, t):
+def _DEMA(x1, t, out=None):
     try:
         with np.errstate(divide='ignore', invalid='ignore'):
-            factor_table = copy.deepcopy(x1)
-            for col in range(x1.shape[1]):
-                factor_table[:, col] = ta.DEMA(x1[:, col], t)
-            return factor_table
+            return _map_columns(ta.DEMA, x1, timeperiod=t, out=out)
     except:
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_dema = _Function(function=_DEMA, name='ts_dema', arity=1, isRandom=(True, [7, 14, 21, 28]))
+ts_dema = _Function(function=_DEMA, name='ts_dema', arity=1, isRandom=(True, [7, 14, 21, 28]), lookback=(2, -2))
 
 
-def _HT_TRENDMODE(x1: np.ndarray) -> np.ndarray:
+def _HT_TRENDMODE(x1: np.ndarray, out=None) -> np.ndarray:
     """
     Calculate the Hilbert Transform - Trend vs Cycle Mode for each column of the input 2D array.
 
@@ -328,80 +575,71 @@ def _HT_TRENDMODE(x1: np.ndarray) -> np.ndarray:
     - 2D Numpy array with the Trend vs Cycle Mode values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.HT_TRENDMODE(x1[:, col])
-
-        return factor_table
+        return _map_columns(ta.HT_TRENDMODE, x1, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_ht_trendmode = _Function(function=_HT_TRENDMODE, name='ts_ht_trendmode', arity=0, isRandom=(False, []),
-                            need_param=['close'])
+                            need_param=['close'], lookback=(0, 63))
 
 
-def _KAMA(x1, t):
+def _KAMA(x1, t, out=None):
     try:
         with np.errstate(divide='ignore', invalid='ignore'):
-            factor_table = copy.deepcopy(x1)
-            for col in range(x1.shape[1]):
-                factor_table[:, col] = ta.KAMA(x1[:, col], t)
-            return factor_table
+            return _map_columns(ta.KAMA, x1, timeperiod=t, out=out)
     except:
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_kama = _Function(function=_KAMA, name='ts_kama', arity=1, isRandom=(True, [7, 14, 21, 28]))
+ts_kama = _Function(function=_KAMA, name='ts_kama', arity=1, isRandom=(True, [7, 14, 21, 28]), lookback=(1, 0))
 
 
-def _MIDPOINT(x1, t):
+def _MIDPOINT(x1, t, out=None):
+    # (highest + lowest) / 2 of the last t bars like ta.MIDPOINT, from the rolling extremum kernels
     try:
         with np.errstate(divide='ignore', invalid='ignore'):
-            factor_table = copy.deepcopy(x1)
-            for col in range(x1.shape[1]):
-                factor_table[:, col] = ta.MIDPOINT(x1[:, col], t)
-            return factor_table
+            highest = rolling_max(x1, t, out=out)
+            np.add(highest, rolling_min(x1, t), out=highest)
+            return np.divide(highest, 2, out=highest)
     except:
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_midpoint = _Function(function=_MIDPOINT, name='ts_midpoint', arity=1, isRandom=(True, [7, 14, 21, 28]))
+ts_midpoint = _Function(function=_MIDPOINT, name='ts_midpoint', arity=1, isRandom=(True, [7, 14, 21, 28]),
+                        lookback=(1, -1))
 
 
-def _MIDPRICE(x1: np.ndarray, x2: np.ndarray, t) -> np.ndarray:
+def _MIDPRICE(x1: np.ndarray, x2: np.ndarray, t, out=None) -> np.ndarray:
+    # (highest high + lowest low) / 2 of the last t bars like ta.MIDPRICE
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.MIDPRICE(x1[:, col], x2[:, col], timeperiod=t)
-        return factor_table
+        highest = rolling_max(x1, t, out=out)
+        np.add(highest, rolling_min(x2, t), out=highest)
+        return np.divide(highest, 2, out=highest)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_midprice = _Function(function=_MIDPRICE, name='ts_midprice', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                        need_param=['high', 'low'])
+                        need_param=['high', 'low'], lookback=(1, -1))
 
 
-def _SAR(x1: np.ndarray, x2: np.ndarray, acceleration=0.02, maximum=0.2) -> np.ndarray:
+def _SAR(x1: np.ndarray, x2: np.ndarray, acceleration=0.02, maximum=0.2, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.SAR(x1[:, col], x2[:, col], acceleration=acceleration, maximum=maximum)
-        return factor_table
+        return _map_columns(ta.SAR, x1, x2, acceleration=acceleration, maximum=maximum, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_sar = _Function(function=_SAR, name='ts_sar', arity=0, isRandom=(False, []), need_param=['high', 'low'])
+ts_sar = _Function(function=_SAR, name='ts_sar', arity=0, isRandom=(False, []), need_param=['high', 'low'],
+                   lookback=(0, 1))
 
 
-def _SMA(x1: np.ndarray, t) -> np.ndarray:
+def _SMA(x1: np.ndarray, t, out=None) -> np.ndarray:
     """
     Calculate the SMA for each column of the input 2D array.
 
@@ -413,128 +651,109 @@ def _SMA(x1: np.ndarray, t) -> np.ndarray:
     - 2D Numpy array with the SMA values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.SMA(x1[:, col], timeperiod=t)
-
-        return factor_table
+        return _map_columns(ta.SMA, x1, timeperiod=t, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_sma = _Function(function=_SMA, name='ts_sma', arity=1, isRandom=(True, [7, 14, 21, 28]))
+ts_sma = _Function(function=_SMA, name='ts_sma', arity=1, isRandom=(True, [7, 14, 21, 28]), lookback=(1, -1))
 
 
-def _TEMA(x1: np.ndarray, t) -> np.ndarray:
+def _TEMA(x1: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.TEMA(x1[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.TEMA, x1, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_tema = _Function(function=_TEMA, name='ts_tema', arity=1, isRandom=(True, [7, 14, 21, 28]))
+ts_tema = _Function(function=_TEMA, name='ts_tema', arity=1, isRandom=(True, [7, 14, 21, 28]), lookback=(3, -3))
 
 
-def _TRIMA(x1: np.ndarray, t) -> np.ndarray:
+def _TRIMA(x1: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.TRIMA(x1[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.TRIMA, x1, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_trima = _Function(function=_TRIMA, name='ts_trima', arity=1, isRandom=(True, [7, 14, 21, 28]))
+ts_trima = _Function(function=_TRIMA, name='ts_trima', arity=1, isRandom=(True, [7, 14, 21, 28]), lookback=(1, -1))
 
 """-------Momentum Indicator Functions-------"""
 
 
-def _ADX(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t=14) -> np.ndarray:
+def _ADX(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t=14, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.ADX(x1[:, col], x2[:, col], x3[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.ADX, x1, x2, x3, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_adx = _Function(function=_ADX, name='ts_adx', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                   need_param=['high', 'low', 'close'])
+                   need_param=['high', 'low', 'close'], lookback=(2, -1))
 
 
-def _ADXR(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t) -> np.ndarray:
+def _ADXR(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.ADXR(x1[:, col], x2[:, col], x3[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.ADXR, x1, x2, x3, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_adxr = _Function(function=_ADXR, name='ts_adxr', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                    need_param=['high', 'low', 'close'])
+                    need_param=['high', 'low', 'close'], lookback=(3, -2))
 
 
-def _APO(x1: np.ndarray, t) -> np.ndarray:
+def _APO(x1: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.APO(x1[:, col], fastperiod=t, slowperiod=2 * (t + 1))
-        return factor_table
+        return _map_columns(ta.APO, x1, fastperiod=t, slowperiod=2 * (t + 1), out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_apo = _Function(function=_APO, name='ts_apo', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'])
+ts_apo = _Function(function=_APO, name='ts_apo', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'],
+                   lookback=(2, 1))
 
 
-def _STOCHRSI(x1: np.ndarray, t, fastk_period=5, fastd_period=3, fastd_matype=0) -> np.ndarray:
+def _STOCHRSI(x1: np.ndarray, t, fastk_period=5, fastd_period=3, fastd_matype=0, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            fastk, fastd = ta.STOCHRSI(x1[:, col], timeperiod=t, fastk_period=fastk_period, fastd_period=fastd_period,
+        def stochrsi(close):
+            fastk, fastd = ta.STOCHRSI(close, timeperiod=t, fastk_period=fastk_period, fastd_period=fastd_period,
                                        fastd_matype=fastd_matype)
-            factor_table[:, col] = fastk / fastd  # You can also choose to return fastd or both
-        return factor_table
+            # fastd is 0 where every fastk of its window is 0, the running sum of TA-Lib then rounds to exactly 0
+            # or to a residual, the ratio is 0 either way
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(fastd == 0, 0., fastk / fastd)  # You can also choose to return fastd or both
+
+        return _map_columns(stochrsi, x1, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_stochrsi = _Function(function=_STOCHRSI, name='ts_stochrsi', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                        need_param=['close'])
+                        need_param=['close'], lookback=(1, 6))
 
 
-def _AROONOSC(x1: np.ndarray, x2: np.ndarray, t) -> np.ndarray:
+def _AROONOSC(x1: np.ndarray, x2: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.AROONOSC(x1[:, col], x2[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.AROONOSC, x1, x2, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_aroonosc = _Function(function=_AROONOSC, name='ts_aroonosc', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                        need_param=['high', 'low'])
+                        need_param=['high', 'low'], lookback=(1, 0))
 
 
-def _BOP(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, x4: np.ndarray) -> np.ndarray:
+def _BOP(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, x4: np.ndarray, out=None) -> np.ndarray:
     """
     Calculate the Balance of Power (BOP) for each column of the input 2D arrays.
 
@@ -548,17 +767,12 @@ def _BOP(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, x4: np.ndarray) -> np.n
     - 2D Numpy array with the BOP values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.BOP(x1[:, col], x2[:, col], x3[:, col], x4[:, col])
-
-        return factor_table
+        return _map_columns(ta.BOP, x1, x2, x3, x4, out=out)
 
     except Exception as e:
         # Ideally, you'd log the exception here for debugging
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 # Assuming the `_Function` class/factory is defined somewhere:
@@ -566,7 +780,7 @@ ts_bop = _Function(function=_BOP, name='ts_bop', arity=0, isRandom=(False, []),
                    need_param=['open', 'high', 'low', 'close'])
 
 
-def _CCI(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t: int = 14) -> np.ndarray:
+def _CCI(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t: int = 14, out=None) -> np.ndarray:
     """
     Calculate the CCI for each column of the input 2D arrays.
 
@@ -580,52 +794,42 @@ def _CCI(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t: int = 14) -> np.ndar
     - 2D Numpy array with the CCI values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.CCI(x1[:, col], x2[:, col], x3[:, col], timeperiod=t)
-
-        return factor_table
+        return _map_columns(ta.CCI, x1, x2, x3, timeperiod=t, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_cci = _Function(function=_CCI, name='ts_cci', arity=0, isRandom=(True, [7, 14, 21]),
-                   need_param=['high', 'low', 'close'])
+                   need_param=['high', 'low', 'close'], lookback=(1, -1))
 
 
-def _CMO(x1: np.ndarray, t) -> np.ndarray:
+def _CMO(x1: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.CMO(x1[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.CMO, x1, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_cmo = _Function(function=_CMO, name='ts_cmo', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'])
+ts_cmo = _Function(function=_CMO, name='ts_cmo', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'],
+                   lookback=(1, 0))
 
 
-def _DX(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t) -> np.ndarray:
+def _DX(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.DX(x1[:, col], x2[:, col], x3[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.DX, x1, x2, x3, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_dx = _Function(function=_DX, name='ts_dx', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                  need_param=['high', 'low', 'close'])
+                  need_param=['high', 'low', 'close'], lookback=(1, 0))
 
 
-def _MACD(x1: np.ndarray, t) -> np.ndarray:
+def _MACD(x1: np.ndarray, t, out=None) -> np.ndarray:
     """
     Calculate the MACD for each column of the input 2D array.
 
@@ -636,68 +840,58 @@ def _MACD(x1: np.ndarray, t) -> np.ndarray:
     - 2D Numpy array with the MACD values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
+        def macd(close):
+            macd_line, signal_line, hist = ta.MACD(close, fastperiod=t, slowperiod=2 * (t + 1), signalperiod=t - 4)
+            return macd_line
 
-        for col in range(x1.shape[1]):
-            macd_line, signal_line, hist = ta.MACD(x1[:, col], fastperiod=t, slowperiod=2 * (t + 1), signalperiod=t - 4)
-            factor_table[:, col] = macd_line
-
-        return factor_table
+        return _map_columns(macd, x1, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_macd = _Function(function=_MACD, name='ts_macd', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'])
+ts_macd = _Function(function=_MACD, name='ts_macd', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'],
+                    lookback=(3, -4))
 
 
-def _MFI(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, x4: np.ndarray, t) -> np.ndarray:
+def _MFI(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, x4: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.MFI(x1[:, col], x2[:, col], x3[:, col], x4[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.MFI, x1, x2, x3, x4, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_mfi = _Function(function=_MFI, name='ts_mfi', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                   need_param=['high', 'low', 'close', 'volume'])
+                   need_param=['high', 'low', 'close', 'volume'], lookback=(1, 0))
 
 
-def _MINUS_DI(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t) -> np.ndarray:
+def _MINUS_DI(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.MINUS_DI(x1[:, col], x2[:, col], x3[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.MINUS_DI, x1, x2, x3, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_minus_di = _Function(function=_MINUS_DI, name='ts_minus_di', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                        need_param=['high', 'low', 'close'])
+                        need_param=['high', 'low', 'close'], lookback=(1, 0))
 
 
-def _MINUS_DM(x1: np.ndarray, x2: np.ndarray, t) -> np.ndarray:
+def _MINUS_DM(x1: np.ndarray, x2: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.MINUS_DM(x1[:, col], x2[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.MINUS_DM, x1, x2, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_minus_dm = _Function(function=_MINUS_DM, name='ts_minus_dm', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                        need_param=['high', 'low'])
+                        need_param=['high', 'low'], lookback=(1, -1))
 
 
-def _MOM(x1: np.ndarray, t) -> np.ndarray:
+def _MOM(x1: np.ndarray, t, out=None) -> np.ndarray:
     """
     Calculate the Momentum for each column of the input 2D array.
 
@@ -709,66 +903,54 @@ def _MOM(x1: np.ndarray, t) -> np.ndarray:
     - 2D Numpy array with the Momentum values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.MOM(x1[:, col], timeperiod=t)
-
-        return factor_table
+        return _map_columns(ta.MOM, x1, timeperiod=t, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_mom = _Function(function=_MOM, name='ts_mom', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'])
+ts_mom = _Function(function=_MOM, name='ts_mom', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'],
+                   lookback=(1, 0))
 
 
-def _PLUS_DI(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t) -> np.ndarray:
+def _PLUS_DI(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.PLUS_DI(x1[:, col], x2[:, col], x3[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.PLUS_DI, x1, x2, x3, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_plus_di = _Function(function=_PLUS_DI, name='ts_plus_di', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                       need_param=['high', 'low', 'close'])
+                       need_param=['high', 'low', 'close'], lookback=(1, 0))
 
 
-def _PLUS_DM(x1: np.ndarray, x2: np.ndarray, t) -> np.ndarray:
+def _PLUS_DM(x1: np.ndarray, x2: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.PLUS_DM(x1[:, col], x2[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.PLUS_DM, x1, x2, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_plus_dm = _Function(function=_PLUS_DM, name='ts_plus_dm', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                       need_param=['high', 'low'])
+                       need_param=['high', 'low'], lookback=(1, -1))
 
 
-def _PPO(x1: np.ndarray, t) -> np.ndarray:
+def _PPO(x1: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.PPO(x1[:, col], fastperiod=t, slowperiod=2 * (t + 1))
-        return factor_table
+        return _map_columns(ta.PPO, x1, fastperiod=t, slowperiod=2 * (t + 1), out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_ppo = _Function(function=_PPO, name='ts_ppo', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'])
+ts_ppo = _Function(function=_PPO, name='ts_ppo', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'],
+                   lookback=(2, 1))
 
 
-def _ROC(x1: np.ndarray, t: int = 10) -> np.ndarray:
+def _ROC(x1: np.ndarray, t: int = 10, out=None) -> np.ndarray:
     """
     Calculate the Rate of Change for each column of the input 2D array.
 
@@ -780,22 +962,18 @@ def _ROC(x1: np.ndarray, t: int = 10) -> np.ndarray:
     - 2D Numpy array with the ROC values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.ROC(x1[:, col], timeperiod=t)
-
-        return factor_table
+        return _map_columns(ta.ROC, x1, timeperiod=t, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_roc = _Function(function=_ROC, name='ts_roc', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'])
+ts_roc = _Function(function=_ROC, name='ts_roc', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'],
+                   lookback=(1, 0))
 
 
-def _RSI(x1: np.ndarray, t) -> np.ndarray:
+def _RSI(x1: np.ndarray, t, out=None) -> np.ndarray:
     """
     Calculate the RSI for each column of the input 2D array.
 
@@ -806,22 +984,18 @@ def _RSI(x1: np.ndarray, t) -> np.ndarray:
     - 2D Numpy array with the RSI values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.RSI(x1[:, col], timeperiod=t)
-
-        return factor_table
+        return _map_columns(ta.RSI, x1, timeperiod=t, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_rsi = _Function(function=_RSI, name='ts_rsi', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'])
+ts_rsi = _Function(function=_RSI, name='ts_rsi', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'],
+                   lookback=(1, 0))
 
 
-def _STOCH(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray) -> np.ndarray:
+def _STOCH(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, out=None) -> np.ndarray:
     """
     Calculate the Stochastic Oscillator for each column of the input 2D arrays.
 
@@ -834,54 +1008,46 @@ def _STOCH(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray) -> np.ndarray:
     - 2D Numpy array with the Stochastic Oscillator K values. (Can be adjusted for D values)
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            slowk, slowd = ta.STOCH(x1[:, col], x2[:, col], x3[:, col])
-            factor_table[:, col] = slowk / slowd
+        def stoch(high, low, close):
+            slowk, slowd = ta.STOCH(high, low, close)
+            return slowk / slowd
 
-        return factor_table
+        return _map_columns(stoch, x1, x2, x3, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_stoch = _Function(function=_STOCH, name='ts_stoch', arity=0, isRandom=(False, []),
-                     need_param=['high', 'low', 'close'])
+                     need_param=['high', 'low', 'close'], lookback=(0, 8))
 
 
-def _TRIX(x1: np.ndarray, t) -> np.ndarray:
+def _TRIX(x1: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.TRIX(x1[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.TRIX, x1, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_trix = _Function(function=_TRIX, name='ts_trix', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'])
+ts_trix = _Function(function=_TRIX, name='ts_trix', arity=0, isRandom=(True, [7, 14, 21, 28]), need_param=['close'],
+                    lookback=(3, -2))
 
 
-def _ULTOSC(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t) -> np.ndarray:
+def _ULTOSC(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.ULTOSC(x1[:, col], x2[:, col], x3[:, col], timeperiod1=t, timeperiod2=2 * t,
-                                             timeperiod3=4 * t)
-        return factor_table
+        return _map_columns(ta.ULTOSC, x1, x2, x3, timeperiod1=t, timeperiod2=2 * t, timeperiod3=4 * t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_ultosc = _Function(function=_ULTOSC, name='ts_ultosc', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                      need_param=['high', 'low', 'close'])
+                      need_param=['high', 'low', 'close'], lookback=(4, 0))
 
 
-def _WILLR(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t: int = 14) -> np.ndarray:
+def _WILLR(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t: int = 14, out=None) -> np.ndarray:
     """
     Calculate the Williams %R for each column of the input 2D arrays.
 
@@ -895,54 +1061,44 @@ def _WILLR(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, t: int = 14) -> np.nd
     - 2D Numpy array with the Williams %R values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.WILLR(x1[:, col], x2[:, col], x3[:, col], timeperiod=t)
-
-        return factor_table
+        return _map_columns(ta.WILLR, x1, x2, x3, timeperiod=t, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_willr = _Function(function=_WILLR, name='ts_willr', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                     need_param=['high', 'low', 'close'])
+                     need_param=['high', 'low', 'close'], lookback=(1, -1))
 
 """------Volume Indicator Functions------"""
 
 
-def _AD(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, x4: np.ndarray) -> np.ndarray:
+def _AD(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, x4: np.ndarray, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.AD(x1[:, col], x2[:, col], x3[:, col], x4[:, col])
-        return factor_table
+        return _map_columns(ta.AD, x1, x2, x3, x4, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_ad = _Function(function=_AD, name='ts_ad', arity=0, need_param=['high', 'low', 'close', 'volume'])
 
 
-def _ADOSC(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, x4: np.ndarray, fastperiod=3, slowperiod=10) -> np.ndarray:
+def _ADOSC(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, x4: np.ndarray, fastperiod=3, slowperiod=10,
+           out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.ADOSC(x1[:, col], x2[:, col], x3[:, col], x4[:, col], fastperiod=fastperiod,
-                                            slowperiod=slowperiod)
-        return factor_table
+        return _map_columns(ta.ADOSC, x1, x2, x3, x4, fastperiod=fastperiod, slowperiod=slowperiod, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_adosc = _Function(function=_ADOSC, name='ts_adosc', arity=0, need_param=['high', 'low', 'close', 'volume'])
+ts_adosc = _Function(function=_ADOSC, name='ts_adosc', arity=0, need_param=['high', 'low', 'close', 'volume'],
+                     lookback=(0, 9))
 
 
-def _OBV(x1: np.ndarray, x2: np.ndarray) -> np.ndarray:
+def _OBV(x1: np.ndarray, x2: np.ndarray, out=None) -> np.ndarray:
     """
     Calculate the OBV for each column of the input 2D array.
 
@@ -954,16 +1110,11 @@ def _OBV(x1: np.ndarray, x2: np.ndarray) -> np.ndarray:
     - 2D Numpy array with the OBV values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.OBV(x1[:, col], x2[:, col])
-
-        return factor_table
+        return _map_columns(ta.OBV, x1, x2, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_obv = _Function(function=_OBV, name='ts_obv', arity=0, isRandom=(False, []), need_param=['close', 'volume'])
@@ -971,53 +1122,44 @@ ts_obv = _Function(function=_OBV, name='ts_obv', arity=0, isRandom=(False, []),
 """------Volatility Indicator Functions------"""
 
 
-def _NATR(x1, x2, x3, t):
+def _NATR(x1, x2, x3, t, out=None):
     try:
         with np.errstate(divide='ignore', invalid='ignore'):
-            factor_table = copy.deepcopy(x1)
-            for col in range(x1.shape[1]):
-                factor_table[:, col] = ta.NATR(x1[:, col], x2[:, col], x3[:, col], t)
-            return factor_table
+            return _map_columns(ta.NATR, x1, x2, x3, timeperiod=t, out=out)
     except:
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_natr = _Function(function=_NATR, name='ts_natr', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                    need_param=['high', 'low', 'close'])
+                    need_param=['high', 'low', 'close'], lookback=(1, 0))
 
 
-def _ATR(x1, x2, x3, t):
+def _ATR(x1, x2, x3, t, out=None):
     try:
         with np.errstate(divide='ignore', invalid='ignore'):
-            factor_table = copy.deepcopy(x1)
-            for col in range(x1.shape[1]):
-                factor_table[:, col] = ta.ATR(x1[:, col], x2[:, col], x3[:, col], t)
-            return factor_table
+            return _map_columns(ta.ATR, x1, x2, x3, timeperiod=t, out=out)
     except:
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_atr = _Function(function=_ATR, name='ts_atr', arity=0, isRandom=(True, [7, 14, 21, 28]),
-                   need_param=['high', 'low', 'close'])
+                   need_param=['high', 'low', 'close'], lookback=(1, 0))
 
 
-def _TRANGE(x1, x2, x3):
+def _TRANGE(x1, x2, x3, out=None):
     try:
         with np.errstate(divide='ignore', invalid='ignore'):
-            factor_table = copy.deepcopy(x1)
-            for col in range(x1.shape[1]):
-                factor_table[:, col] = ta.TRANGE(x1[:, col], x2[:, col], x3[:, col])
-            return factor_table
+            return _map_columns(ta.TRANGE, x1, x2, x3, out=out)
     except:
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_trange = _Function(function=_TRANGE, name='ts_trange', arity=0, need_param=['high', 'low', 'close'])
+ts_trange = _Function(function=_TRANGE, name='ts_trange', arity=0, need_param=['high', 'low', 'close'], lookback=(0, 1))
 
 """-----Price Transform Functions-----"""
 
 
-def _AVGPRICE(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, x4: np.ndarray) -> np.ndarray:
+def _AVGPRICE(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, x4: np.ndarray, out=None) -> np.ndarray:
     """
     Calculate the Average Price for each column of the input 2D arrays.
 
@@ -1031,23 +1173,18 @@ def _AVGPRICE(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, x4: np.ndarray) ->
     - 2D Numpy array with the Average Price values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.AVGPRICE(x1[:, col], x2[:, col], x3[:, col], x4[:, col])
-
-        return factor_table
+        return _map_columns(ta.AVGPRICE, x1, x2, x3, x4, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_avgprice = _Function(function=_AVGPRICE, name='ts_avgprice', arity=0, isRandom=(False, []),
                         need_param=['open', 'high', 'low', 'close'])
 
 
-def _MEDPRICE(x1: np.ndarray, x2: np.ndarray) -> np.ndarray:
+def _MEDPRICE(x1: np.ndarray, x2: np.ndarray, out=None) -> np.ndarray:
     """
     Calculate the Median Price for each column of the input 2D arrays.
 
@@ -1059,23 +1196,18 @@ def _MEDPRICE(x1: np.ndarray, x2: np.ndarray) -> np.ndarray:
     - 2D Numpy array with the Median Price values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.MEDPRICE(x1[:, col], x2[:, col])
-
-        return factor_table
+        return _map_columns(ta.MEDPRICE, x1, x2, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_medprice = _Function(function=_MEDPRICE, name='ts_medprice', arity=0, isRandom=(False, []),
                         need_param=['high', 'low'])
 
 
-def _TYPPRICE(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray) -> np.ndarray:
+def _TYPPRICE(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, out=None) -> np.ndarray:
     """
     Calculate the Typical Price for each column of the input 2D arrays.
 
@@ -1088,23 +1220,18 @@ def _TYPPRICE(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray) -> np.ndarray:
     - 2D Numpy array with the Typical Price values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.TYPPRICE(x1[:, col], x2[:, col], x3[:, col])
-
-        return factor_table
+        return _map_columns(ta.TYPPRICE, x1, x2, x3, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_typprice = _Function(function=_TYPPRICE, name='ts_typprice', arity=0, isRandom=(False, []),
                         need_param=['high', 'low', 'close'])
 
 
-def _WCLPRICE(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray) -> np.ndarray:
+def _WCLPRICE(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray, out=None) -> np.ndarray:
     """
     Calculate the Weighted Close Price for each column of the input 2D arrays.
 
@@ -1117,16 +1244,11 @@ def _WCLPRICE(x1: np.ndarray, x2: np.ndarray, x3: np.ndarray) -> np.ndarray:
     - 2D Numpy array with the Weighted Close Price values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.WCLPRICE(x1[:, col], x2[:, col], x3[:, col])
-
-        return factor_table
+        return _map_columns(ta.WCLPRICE, x1, x2, x3, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_wclprice = _Function(function=_WCLPRICE, name='ts_wclprice', arity=0, isRandom=(False, []),
@@ -1135,7 +1257,7 @@ ts_wclprice = _Function(function=_WCLPRICE, name='ts_wclprice', arity=0, isRando
 """------Cycle indicators-------"""
 
 
-def _HT_DCPERIOD(x1: np.ndarray) -> np.ndarray:
+def _HT_DCPERIOD(x1: np.ndarray, out=None) -> np.ndarray:
     """
     Calculate the Hilbert Transform - Dominant Cycle Period for each column of the input 2D array.
 
@@ -1146,23 +1268,18 @@ def _HT_DCPERIOD(x1: np.ndarray) -> np.ndarray:
     - 2D Numpy array with the Dominant Cycle Period values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.HT_DCPERIOD(x1[:, col])
-
-        return factor_table
+        return _map_columns(ta.HT_DCPERIOD, x1, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_ht_dcperiod = _Function(function=_HT_DCPERIOD, name='ts_ht_dcperiod', arity=0, isRandom=(False, []),
-                           need_param=['close'])
+                           need_param=['close'], lookback=(0, 32))
 
 
-def _HT_DCPHASE(x1: np.ndarray) -> np.ndarray:
+def _HT_DCPHASE(x1: np.ndarray, out=None) -> np.ndarray:
     """
     Calculate the Hilbert Transform - Dominant Cycle Phase for each column of the input 2D array.
 
@@ -1173,23 +1290,18 @@ def _HT_DCPHASE(x1: np.ndarray) -> np.ndarray:
     - 2D Numpy array with the Dominant Cycle Phase values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.HT_DCPHASE(x1[:, col])
-
-        return factor_table
+        return _map_columns(ta.HT_DCPHASE, x1, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_ht_dcphase = _Function(function=_HT_DCPHASE, name='ts_ht_dcphase', arity=0, isRandom=(False, []),
-                          need_param=['close'])
+                          need_param=['close'], lookback=(0, 63))
 
 
-def _HT_PHASOR(x1: np.ndarray) -> np.ndarray:
+def _HT_PHASOR(x1: np.ndarray, out=None) -> np.ndarray:
     """
     Calculate the Hilbert Transform - Phasor Components for each column of the input 2D array.
 
@@ -1200,23 +1312,22 @@ def _HT_PHASOR(x1: np.ndarray) -> np.ndarray:
     - 2D Numpy array with the Phasor Components values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
-
-        for col in range(x1.shape[1]):
-            inPhase, quadrature = ta.HT_PHASOR(x1[:, col])
-            factor_table[:, col] = inPhase  # Using inPhase component. Adjust if needed.
+        def phasor(close):
+            inPhase, quadrature = ta.HT_PHASOR(close)
+            return inPhase  # Using inPhase component. Adjust if needed.
 
-        return factor_table
+        return _map_columns(phasor, x1, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_ht_phasor = _Function(function=_HT_PHASOR, name='ts_ht_phasor', arity=0, isRandom=(False, []), need_param=['close'])
+ts_ht_phasor = _Function(function=_HT_PHASOR, name='ts_ht_phasor', arity=0, isRandom=(False, []), need_param=['close'],
+                         lookback=(0, 32))
 
 
-def _HT_SINE(x1: np.ndarray) -> np.ndarray:
+def _HT_SINE(x1: np.ndarray, out=None) -> np.ndarray:
     """
     Calculate the Hilbert Transform - SineWave for each column of the input 2D array.
 
@@ -1227,122 +1338,101 @@ def _HT_SINE(x1: np.ndarray) -> np.ndarray:
     - 2D Numpy array with the SineWave values.
     """
     try:
-        factor_table = copy.deepcopy(x1)
+        def sine_wave(close):
+            sine, leadsine = ta.HT_SINE(close)
+            return sine  # Using sine component. Adjust if needed.
 
-        for col in range(x1.shape[1]):
-            sine, leadsine = ta.HT_SINE(x1[:, col])
-            factor_table[:, col] = sine  # Using sine component. Adjust if needed.
-
-        return factor_table
+        return _map_columns(sine_wave, x1, out=out)
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_ht_sine = _Function(function=_HT_SINE, name='ts_ht_sine', arity=0, isRandom=(False, []), need_param=['close'])
+ts_ht_sine = _Function(function=_HT_SINE, name='ts_ht_sine', arity=0, isRandom=(False, []), need_param=['close'],
+                       lookback=(0, 63))
 
 """-----Statistic Functions------"""
 
-def _BETA(x1, x2, t):
+def _BETA(x1, x2, t, out=None):
     try:
         with np.errstate(divide='ignore', invalid='ignore'):
-            factor_table = copy.deepcopy(x1)
-            for col in range(x1.shape[1]):
-                factor_table[:, col] = ta.BETA(x1[:, col], x2[:, col], t)
-            return factor_table
+            return _map_columns(ta.BETA, x1, x2, timeperiod=t, out=out)
     except:
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_beta = _Function(function=_BETA, name='ts_beta', arity=2, isRandom=(True, [7, 14, 21, 28]))
+ts_beta = _Function(function=_BETA, name='ts_beta', arity=2, isRandom=(True, [7, 14, 21, 28]), lookback=(1, 0))
 
 
-def _CORREL(x1, x2, t):
+def _CORREL(x1, x2, t, out=None):
     try:
         with np.errstate(divide='ignore', invalid='ignore'):
-            factor_table = copy.deepcopy(x1)
-            for col in range(x1.shape[1]):
-                factor_table[:, col] = ta.CORREL(x1[:, col], x2[:, col], t)
-            return factor_table
+            return _map_columns(ta.CORREL, x1, x2, timeperiod=t, out=out)
     except:
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_correl = _Function(function=_CORREL, name='ts_correl', arity=2, isRandom=(True, [7, 14, 21, 28]))
+ts_correl = _Function(function=_CORREL, name='ts_correl', arity=2, isRandom=(True, [7, 14, 21, 28]), lookback=(1, -1))
 
 
-def _LINEARREG(x1: np.ndarray, t) -> np.ndarray:
+def _LINEARREG(x1: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.LINEARREG(x1[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.LINEARREG, x1, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_linearreg = _Function(function=_LINEARREG, name='ts_linearreg', arity=1, isRandom=(True, [7, 14, 21, 28]))
+ts_linearreg = _Function(function=_LINEARREG, name='ts_linearreg', arity=1, isRandom=(True, [7, 14, 21, 28]),
+                         lookback=(1, -1))
 
 
-def _LINEARREG_ANGLE(x1, t):
+def _LINEARREG_ANGLE(x1, t, out=None):
     try:
         with np.errstate(divide='ignore', invalid='ignore'):
-            factor_table = copy.deepcopy(x1)
-            for col in range(x1.shape[1]):
-                factor_table[:, col] = ta.LINEARREG_ANGLE(x1[:, col], t)
-            return factor_table
+            return _map_columns(ta.LINEARREG_ANGLE, x1, timeperiod=t, out=out)
     except:
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_linearreg_angle = _Function(function=_LINEARREG_ANGLE, name='ts_linearreg_angle', arity=1,
-                               isRandom=(True, [7, 14, 21, 28]))
+                               isRandom=(True, [7, 14, 21, 28]), lookback=(1, -1))
 
 
-def _LINEARREG_INTERCEPT(x1: np.ndarray, t) -> np.ndarray:
+def _LINEARREG_INTERCEPT(x1: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.LINEARREG_INTERCEPT(x1[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.LINEARREG_INTERCEPT, x1, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_linearreg_intercept = _Function(function=_LINEARREG_INTERCEPT, name='ts_linearreg_intercept', arity=1,
-                                   isRandom=(True, [7, 14, 21, 28]))
+                                   isRandom=(True, [7, 14, 21, 28]), lookback=(1, -1))
 
 
-def _LINEARREG_SLOPE(x1, t):
+def _LINEARREG_SLOPE(x1, t, out=None):
     try:
         with np.errstate(divide='ignore', invalid='ignore'):
-            factor_table = copy.deepcopy(x1)
-            for col in range(x1.shape[1]):
-                factor_table[:, col] = ta.LINEARREG_SLOPE(x1[:, col], t)
-            return factor_table
+            return _map_columns(ta.LINEARREG_SLOPE, x1, timeperiod=t, out=out)
     except:
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 ts_linearreg_slope = _Function(function=_LINEARREG_SLOPE, name='ts_linearreg_slope', arity=1,
-                               isRandom=(True, [7, 14, 21, 28]))
+                               isRandom=(True, [7, 14, 21, 28]), lookback=(1, -1))
 
 
-def _TSF(x1: np.ndarray, t) -> np.ndarray:
+def _TSF(x1: np.ndarray, t, out=None) -> np.ndarray:
     try:
-        factor_table = copy.deepcopy(x1)
-        for col in range(x1.shape[1]):
-            factor_table[:, col] = ta.TSF(x1[:, col], timeperiod=t)
-        return factor_table
+        return _map_columns(ta.TSF, x1, timeperiod=t, out=out)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
-ts_tsf = _Function(function=_TSF, name='ts_tsf', arity=1, isRandom=(True, [7, 14, 21, 28]))
+ts_tsf = _Function(function=_TSF, name='ts_tsf', arity=1, isRandom=(True, [7, 14, 21, 28]), lookback=(1, -1))
 
 
 
@@ -1364,9 +1454,18 @@ _function_map = {
     "dynamic_ts_std": dynamic_ts_std,
     "dynamic_ts_mean": dynamic_ts_mean,
     "dynamic_ts_max": dynamic_ts_max,
+    "ts_min": ts_min,
+    "ts_argmax": ts_argmax,
+    "ts_range": ts_range,
     "ts_delay": ts_delay,
     "ts_delta": ts_delta,
+    "ts_rank": ts_rank,
+    "ts_quantile": ts_quantile,
     "ts_normalize_180": ts_normalize_180,
+    "cs_rank": cs_rank1,
+    "cs_zscore": cs_zscore1,
+    "cs_demean": cs_demean1,
+    "cs_quantile": cs_quantile1,
     "ts_bbands": ts_bbands,
     "ts_dema": ts_dema,
     "ts_ht_trendmode": ts_ht_trendmode,
@@ -1423,13 +1522,73 @@ _function_map = {
     "ts_tsf": ts_tsf
 }
 
+
+"""------Numba Indicators------"""
+
+
+def _native(indicator):
+    """
+    Wrap a function of bitquant.quantlib.functions.indicators like the talib wrappers above, the indicator takes
+    the arguments of the talib wrapper. A timeperiod talib rejects gives nan like talib, other errors are raised.
+    """
+    def function(x1, *args):
+        try:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return indicator(x1, *args)
+        except ValueError:
+            return np.full(x1.shape, np.nan, dtype=x1.dtype)
+
+    return function
+
+
+def _native_bbands(x1, t):
+    upper, middle, lower = indicators.bbands(x1, timeperiod=t, dtype=np.float64)
+    return ((upper - middle) / (middle - lower)).astype(x1.dtype, copy=False)
+
+
+def _native_macd(x1, t):
+    macd_line, signal_line, hist = indicators.macd(x1, fastperiod=t, slowperiod=2 * (t + 1), signalperiod=t - 4)
+    return macd_line
+
+
+# same primitives as _function_map, the indicators above that indicators.py implements are computed by numba
+# instead of talib, pass it to FactorCalculator or take the function_set of the genetic programming from it
+_native_indicators = {
+    "ts_sma": lambda x1, t: indicators.sma(x1, t),
+    "ts_dema": lambda x1, t: indicators.dema(x1, t),
+    "ts_tema": lambda x1, t: indicators.tema(x1, t),
+    "ts_kama": lambda x1, t: indicators.kama(x1, t),
+    "ts_bbands": _native_bbands,
+    "ts_rsi": lambda x1, t: indicators.rsi(x1, t),
+    "ts_macd": _native_macd,
+    "ts_adx": lambda x1, x2, x3, t=14: indicators.adx(x1, x2, x3, t),
+    "ts_dx": lambda x1, x2, x3, t: indicators.dx(x1, x2, x3, t),
+    "ts_atr": lambda x1, x2, x3, t: indicators.atr(x1, x2, x3, t),
+    "ts_natr": lambda x1, x2, x3, t: indicators.natr(x1, x2, x3, t),
+    "ts_beta": lambda x1, x2, t: indicators.beta(x1, x2, t),
+    "ts_correl": lambda x1, x2, t: indicators.correl(x1, x2, t),
+    "ts_linearreg": lambda x1, t: indicators.linearreg(x1, t),
+    "ts_linearreg_angle": lambda x1, t: indicators.linearreg_angle(x1, t),
+    "ts_linearreg_intercept": lambda x1, t: indicators.linearreg_intercept(x1, t),
+    "ts_linearreg_slope": lambda x1, t: indicators.linearreg_slope(x1, t),
+    "ts_tsf": lambda x1, t: indicators.tsf(x1, t),
+}
+
+_native_function_map = dict(_function_map)
+for _name, _indicator in _native_indicators.items():
+    _talib_function = _function_map[_name]
+    _native_function_map[_name] = _Function(function=_native(_indicator), name=_name, arity=_talib_function.arity,
+                                            isRandom=(_talib_function.isRandom, _talib_function.RandRange),
+                                            need_param=_talib_function.need_param,
+                                            lookback=_talib_function._lookback)
+
 """
 def _alpha_pool_2(x1, x2, close):
     try:
         x1 = copy.deepcopy(x1)
         x2 = copy.deepcopy(x2)
         if (x1 is None) or (x2 is None):
-            return np.full(x1.shape, np.nan)
+            return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
         rolling_window_1 = 180
         rolling_window_2 = 90
@@ -1444,7 +1603,7 @@ def _alpha_pool_2(x1, x2, close):
             x = x1 + x2
             return x
     except:
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 
 alpha_pool_2 = _Function(function=_alpha_pool_2, name='alpha_pool_2', arity=2, need_param=['close'])
@@ -1456,7 +1615,7 @@ def _alpha_pool_3(x1, x2, x3, close):
         x2 = copy.deepcopy(x2)
         x3 = copy.deepcopy(x3)
         if (x1 is None) or (x2 is None) or (x3 is None):
-            return np.full(x1.shape, np.nan)
+            return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
         rolling_window_1 = 180
         rolling_window_2 = 90
@@ -1473,7 +1632,7 @@ def _alpha_pool_3(x1, x2, x3, close):
             x = x1 + x2 + x3
             return x
     except:
-        return np.full(x1.shape, np.nan)
+        return np.full(x1.shape, np.nan, dtype=x1.dtype)
 
 alpha_pool_3 = _Function(function=_alpha_pool_3, name='alpha_pool_3', arity=3, need_param=['close'])
 """
\ No newline at end of file
@@ -0,0 +1,619 @@
+"""
+Numba implementations of the most used TA-Lib indicators on 2D (time x symbol) arrays.
+
+Every indicator runs one symbol per prange iteration on a float64 copy of its column and follows the TA-Lib
+algorithm, the values equal ta.XXX of every column without gaps within 1e-9 (1e-7 for a timeperiod of 2, where
+talib's running sums cancel): rows before the first row where all inputs are valid, and the lookback rows after it,
+are nan. A nan inside a column makes the window indicators (sma, bbands, the linearreg family, correl, beta) nan
+while it is in the window, the recursive ones stay nan.
+The result takes the dtype of the first input, float32 features give float32 indicators, or is written to out.
+Unlike the talib wrappers of functions.py errors are raised, nothing is replaced by nan.
+"""
+import math
+import numpy as np
+from numba import jit, njit, prange
+
+
+@njit(inline="always")
+def _is_zero(x):
+    return -0.00000000000001 < x < 0.00000000000001
+
+
+@njit(inline="always")
+def _is_zero_or_neg(x):
+    return x < 0.00000000000001
+
+
+# ===== per symbol kernels, x is the float64 column from its first valid row, res is nan from there on =====
+
+
+@njit(error_model="numpy")
+def _sma_1d(x, period, res):
+    # the running sum of talib, the nan values are counted instead of added so a gap leaves with the window
+    total = 0.
+    n_nan = 0
+    for i in range(len(x)):
+        if x[i] == x[i]:
+            total += x[i]
+        else:
+            n_nan += 1
+        if i >= period - 1:
+            res[i] = total / period if n_nan == 0 else np.nan
+            trailing = x[i - period + 1]
+            if trailing == trailing:
+                total -= trailing
+            else:
+                n_nan -= 1
+
+
+@njit(error_model="numpy")
+def _ema_1d(x, period, k, res):
+    """ema seeded with the sma of the first period values, the first value is at period - 1"""
+    n = len(x)
+    if n < period:
+        return
+    value = 0.
+    for i in range(period):
+        value += x[i]
+    value /= period
+    res[period - 1] = value
+    for i in range(period, n):
+        value = (x[i] - value) * k + value
+        res[i] = value
+
+
+@njit(error_model="numpy")
+def _sma(xs, params, res):
+    _sma_1d(xs[0], int(params[0]), res[0])
+
+
+@njit(error_model="numpy")
+def _ema(xs, params, res):
+    period = int(params[0])
+    _ema_1d(xs[0], period, 2. / (period + 1), res[0])
+
+
+@njit(error_model="numpy")
+def _dema(xs, params, res):
+    period = int(params[0])
+    k = 2. / (period + 1)
+    n = len(xs[0])
+    if n < 2 * period - 1:
+        return
+    first = np.full(n, np.nan)
+    _ema_1d(xs[0], period, k, first)
+    second = np.full(n, np.nan)
+    _ema_1d(first[period - 1:], period, k, second[period - 1:])
+    for i in range(2 * (period - 1), n):
+        res[0, i] = 2. * first[i] - second[i]
+
+
+@njit(error_model="numpy")
+def _tema(xs, params, res):
+    period = int(params[0])
+    k = 2. / (period + 1)
+    n = len(xs[0])
+    if n < 3 * period - 2:
+        return
+    first = np.full(n, np.nan)
+    _ema_1d(xs[0], period, k, first)
+    second = np.full(n, np.nan)
+    _ema_1d(first[period - 1:], period, k, second[period - 1:])
+    third = np.full(n, np.nan)
+    _ema_1d(second[2 * (period - 1):], period, k, third[2 * (period - 1):])
+    for i in range(3 * (period - 1), n):
+        res[0, i] = 3. * first[i] - 3. * second[i] + third[i]
+
+
+@njit(error_model="numpy")
+def _kama(xs, params, res):
+    x = xs[0]
+    period = int(params[0])
+    n = len(x)
+    if n <= period:
+        return
+    const_max = 2. / (30. + 1.)
+    const_diff = 2. / (2. + 1.) - const_max
+    sum_roc = 0.
+    today = 0
+    trailing = 0
+    for i in range(period):
+        sum_roc += abs(x[today] - x[today + 1])
+        today += 1
+    prev = x[today - 1]
+    value = x[today]
+    trailing_value = x[trailing]
+    period_roc = value - trailing_value
+    trailing += 1
+    if sum_roc <= period_roc or _is_zero(sum_roc):
+        ratio = 1.
+    else:
+        ratio = abs(period_roc / sum_roc)
+    sc = ratio * const_diff + const_max
+    sc *= sc
+    prev = (x[today] - prev) * sc + prev
+    res[0, today] = prev
+    today += 1
+    while today < n:
+        value = x[today]
+        trailing_x = x[trailing]
+        trailing += 1
+        period_roc = value - trailing_x
+        sum_roc -= abs(trailing_value - trailing_x)
+        sum_roc += abs(value - x[today - 1])
+        trailing_value = trailing_x
+        if sum_roc <= period_roc or _is_zero(sum_roc):
+            ratio = 1.
+        else:
+            ratio = abs(period_roc / sum_roc)
+        sc = ratio * const_diff + const_max
+        sc *= sc
+        prev = (x[today] - prev) * sc + prev
+        res[0, today] = prev
+        today += 1
+
+
+@njit(error_model="numpy")
+def _rsi(xs, params, res):
+    x = xs[0]
+    period = int(params[0])
+    n = len(x)
+    if n <= period:
+        return
+    gain = 0.
+    loss = 0.
+    prev = x[0]
+    for i in range(1, period + 1):
+        diff = x[i] - prev
+        prev = x[i]
+        if diff < 0:
+            loss -= diff
+        else:
+            gain += diff
+    loss /= period
+    gain /= period
+    total = gain + loss
+    res[0, period] = 100. * (gain / total) if not _is_zero(total) else 0.
+    for i in range(period + 1, n):
+        diff = x[i] - prev
+        prev = x[i]
+        loss *= period - 1
+        gain *= period - 1
+        if diff < 0:
+            loss -= diff
+        else:
+            gain += diff
+        loss /= period
+        gain /= period
+        total = gain + loss
+        res[0, i] = 100. * (gain / total) if not _is_zero(total) else 0.
+
+
+@njit(error_model="numpy", inline="always")
+def _true_range(high, low, prev_close):
+    value = high - low
+    other = abs(high - prev_close)
+    if other > value:
+        value = other
+    other = abs(low - prev_close)
+    if other > value:
+        value = other
+    return value
+
+
+@njit(error_model="numpy")
+def _atr_1d(high, low, close, period, normalized, res):
+    n = len(high)
+    if n <= period:
+        return
+    # wilder smoothing of the true range, seeded with the sma of the first period true ranges
+    total = 0.
+    for i in range(1, period):
+        total += _true_range(high[i], low[i], close[i - 1])
+    total += _true_range(high[period], low[period], close[period - 1])
+    atr = total / period
+    for i in range(period, n):
+        if i > period:
+            atr *= period - 1
+            atr += _true_range(high[i], low[i], close[i - 1])
+            atr /= period
+        if normalized:
+            res[i] = (atr / close[i]) * 100. if not _is_zero(close[i]) else 0.
+        else:
+            res[i] = atr
+
+
+@njit(error_model="numpy")
+def _atr(xs, params, res):
+    _atr_1d(xs[0], xs[1], xs[2], int(params[0]), False, res[0])
+
+
+@njit(error_model="numpy")
+def _natr(xs, params, res):
+    _atr_1d(xs[0], xs[1], xs[2], int(params[0]), True, res[0])
+
+
+@njit(error_model="numpy")
+def _directional_movement(high, low, close, period, adx, res):
+    """dx (or adx) from wilder smoothed +DM, -DM and true range like TA_DX / TA_ADX"""
+    n = len(high)
+    lookback = 2 * period - 1 if adx else period
+    if n <= lookback:
+        return
+    minus_dm = 0.
+    plus_dm = 0.
+    tr = 0.
+    prev_high = high[0]
+    prev_low = low[0]
+    prev_close = close[0]
+    today = 0
+    for i in range(period - 1):
+        today += 1
+        diff_p = high[today] - prev_high
+        prev_high = high[today]
+        diff_m = prev_low - low[today]
+        prev_low = low[today]
+        if diff_m > 0 and diff_p < diff_m:
+            minus_dm += diff_m
+        elif diff_p > 0 and diff_p > diff_m:
+            plus_dm += diff_p
+        tr += _true_range(prev_high, prev_low, prev_close)
+        prev_close = close[today]
+
+    n_smoothed = period if adx else 1
+    sum_dx = 0.
+    dx = 0.
+    for i in range(n_smoothed):
+        today += 1
+        diff_p = high[today] - prev_high
+        prev_high = high[today]
+        diff_m = prev_low - low[today]
+        prev_low = low[today]
+        minus_dm -= minus_dm / period
+        plus_dm -= plus_dm / period
+        if diff_m > 0 and diff_p < diff_m:
+            minus_dm += diff_m
+        elif diff_p > 0 and diff_p > diff_m:
+            plus_dm += diff_p
+        tr = tr - tr / period + _true_range(prev_high, prev_low, prev_close)
+        prev_close = close[today]
+        if not _is_zero(tr):
+            minus_di = 100. * (minus_dm / tr)
+            plus_di = 100. * (plus_dm / tr)
+            total = minus_di + plus_di
+            if not _is_zero(total):
+                dx = 100. * (abs(minus_di - plus_di) / total)
+                sum_dx += dx
+            elif not adx:
+                dx = 0.
+        elif not adx:
+            dx = 0.
+    value = sum_dx / period if adx else dx
+    res[today] = value
+
+    while today < n - 1:
+        today += 1
+        diff_p = high[today] - prev_high
+        prev_high = high[today]
+        diff_m = prev_low - low[today]
+        prev_low = low[today]
+        minus_dm -= minus_dm / period
+        plus_dm -= plus_dm / period
+        if diff_m > 0 and diff_p < diff_m:
+            minus_dm += diff_m
+        elif diff_p > 0 and diff_p > diff_m:
+            plus_dm += diff_p
+        tr = tr - tr / period + _true_range(prev_high, prev_low, prev_close)
+        prev_close = close[today]
+        if not _is_zero(tr):
+            minus_di = 100. * (minus_dm / tr)
+            plus_di = 100. * (plus_dm / tr)
+            total = minus_di + plus_di
+            if not _is_zero(total):
+                dx = 100. * (abs(minus_di - plus_di) / total)
+                value = (value * (period - 1) + dx) / period if adx else dx
+        res[today] = value
+
+
+@njit(error_model="numpy")
+def _dx(xs, params, res):
+    _directional_movement(xs[0], xs[1], xs[2], int(params[0]), False, res[0])
+
+
+@njit(error_model="numpy")
+def _adx(xs, params, res):
+    _directional_movement(xs[0], xs[1], xs[2], int(params[0]), True, res[0])
+
+
+@njit(error_model="numpy")
+def _bbands(xs, params, res):
+    """upper, middle and lower band around the sma with the population std"""
+    x = xs[0]
+    period = int(params[0])
+    nb_dev_up = params[1]
+    nb_dev_dn = params[2]
+    n = len(x)
+    if n < period:
+        return
+    middle = res[1]
+    _sma_1d(x, period, middle)
+    for i in range(period - 1, n):
+        # population variance of the window in two passes, it is compared to talib's 1e-8 zero threshold
+        mean = 0.
+        for k in range(i - period + 1, i + 1):
+            mean += x[k]
+        mean /= period
+        var = 0.
+        for k in range(i - period + 1, i + 1):
+            var += (x[k] - mean) * (x[k] - mean)
+        var /= period
+        std = math.sqrt(var) if not _is_zero_or_neg(var) else 0.
+        if nb_dev_up == nb_dev_dn:
+            band = std * nb_dev_up
+            res[0, i] = middle[i] + band
+            res[2, i] = middle[i] - band
+        else:
+            res[0, i] = middle[i] + std * nb_dev_up
+            res[2, i] = middle[i] - std * nb_dev_dn
+
+
+@njit(error_model="numpy")
+def _macd(xs, params, res):
+    """macd, signal and histogram, the fast ema is seeded so its first value is at the first slow ema value"""
+    x = xs[0]
+    fast = int(params[0])
+    slow = int(params[1])
+    signal = int(params[2])
+    if slow < fast:
+        fast, slow = slow, fast
+    n = len(x)
+    lookback = slow - 1 + signal - 1
+    if n <= lookback:
+        return
+    slow_ema = np.full(n, np.nan)
+    _ema_1d(x, slow, 2. / (slow + 1), slow_ema)
+    fast_ema = np.full(n, np.nan)
+    _ema_1d(x[slow - fast:], fast, 2. / (fast + 1), fast_ema[slow - fast:])
+    line = np.full(n, np.nan)
+    for i in range(slow - 1, n):
+        line[i] = fast_ema[i] - slow_ema[i]
+    signal_line = np.full(n, np.nan)
+    _ema_1d(line[slow - 1:], signal, 2. / (signal + 1), signal_line[slow - 1:])
+    for i in range(lookback, n):
+        res[0, i] = line[i]
+        res[1, i] = signal_line[i]
+        res[2, i] = line[i] - signal_line[i]
+
+
+# what the linear regression of the last period values returns
+_LINEARREG, _LINEARREG_SLOPE, _LINEARREG_INTERCEPT, _LINEARREG_ANGLE, _TSF = 0, 1, 2, 3, 4
+
+
+@njit(error_model="numpy")
+def _linearreg(xs, params, res):
+    x = xs[0]
+    period = int(params[0])
+    kind = int(params[1])
+    n = len(x)
+    sum_x = period * (period - 1) * 0.5
+    sum_x_sqr = period * (period - 1) * (2 * period - 1) / 6.
+    divisor = sum_x * sum_x - period * sum_x_sqr
+    for today in range(period - 1, n):
+        sum_xy = 0.
+        sum_y = 0.
+        for i in range(period - 1, -1, -1):
+            value = x[today - i]
+            sum_y += value
+            sum_xy += i * value
+        m = (period * sum_xy - sum_x * sum_y) / divisor
+        b = (sum_y - m * sum_x) / period
+        if kind == _LINEARREG:
+            res[0, today] = b + m * (period - 1)
+        elif kind == _LINEARREG_SLOPE:
+            res[0, today] = m
+        elif kind == _LINEARREG_INTERCEPT:
+            res[0, today] = b
+        elif kind == _LINEARREG_ANGLE:
+            res[0, today] = math.atan(m) * (180. / 3.14159265358979323846)
+        else:
+            res[0, today] = b + m * period
+
+
+@njit(error_model="numpy")
+def _correl(xs, params, res):
+    """pearson correlation of the window in two passes, 0 when either input is constant"""
+    x = xs[0]
+    y = xs[1]
+    period = int(params[0])
+    for today in range(period - 1, len(x)):
+        mean_x = 0.
+        mean_y = 0.
+        for i in range(today - period + 1, today + 1):
+            mean_x += x[i]
+            mean_y += y[i]
+        mean_x /= period
+        mean_y /= period
+        s_xy = s_xx = s_yy = 0.
+        for i in range(today - period + 1, today + 1):
+            s_xy += (x[i] - mean_x) * (y[i] - mean_y)
+            s_xx += (x[i] - mean_x) * (x[i] - mean_x)
+            s_yy += (y[i] - mean_y) * (y[i] - mean_y)
+        value = s_xx * s_yy
+        res[0, today] = s_xy / math.sqrt(value) if not _is_zero_or_neg(value) else 0.
+
+
+@njit(error_model="numpy", inline="always")
+def _simple_return(price, last_price):
+    return (price - last_price) / last_price if not _is_zero(last_price) else 0.
+
+
+@njit(error_model="numpy")
+def _beta(xs, params, res):
+    """beta of the simple returns of y on the simple returns of x over the last period returns"""
+    x = xs[0]
+    y = xs[1]
+    period = int(params[0])
+    for today in range(period, len(x)):
+        s_xx = s_xy = s_x = s_y = 0.
+        for i in range(today - period + 1, today + 1):
+            rx = _simple_return(x[i], x[i - 1])
+            ry = _simple_return(y[i], y[i - 1])
+            s_xx += rx * rx
+            s_xy += rx * ry
+            s_x += rx
+            s_y += ry
+        denominator = period * s_xx - s_x * s_x
+        res[0, today] = (period * s_xy - s_x * s_y) / denominator if not _is_zero(denominator) else 0.
+
+
+# ===== 2D drivers =====
+
+
+def _by_symbol(kernel):
+    """
+    prange over the symbols of X (n_inputs, time, symbol), every column is copied to float64 and passed to the
+    kernel from its first row where all inputs are valid, like the talib python wrapper does
+    """
+    @jit(nopython=True, nogil=True, parallel=True, error_model="numpy")
+    def run(X, params, out):
+        n_inputs, n_rows, n_cols = X.shape
+        for j in prange(n_cols):
+            xs = np.empty((n_inputs, n_rows))
+            for k in range(n_inputs):
+                for i in range(n_rows):
+                    xs[k, i] = X[k, i, j]
+            begin = n_rows
+            for i in range(n_rows):
+                valid = True
+                for k in range(n_inputs):
+                    if xs[k, i] != xs[k, i]:
+                        valid = False
+                        break
+                if valid:
+                    begin = i
+                    break
+            res = np.full((out.shape[0], n_rows), np.nan)
+            if begin < n_rows:
+                kernel(xs[:, begin:], params, res[:, begin:])
+            for k in range(out.shape[0]):
+                for i in range(n_rows):
+                    out[k, i, j] = res[k, i]
+        return out
+    return run
+
+
+_KERNELS = {}
+
+
+def _run(kernel, inputs, params, n_outputs=1, out=None, dtype=None):
+    """
+    inputs: 2D (time, symbol) or 1D arrays of the same shape
+    Return:
+        one array, or a tuple of n_outputs arrays, of the shape of the inputs
+    """
+    if kernel not in _KERNELS:
+        _KERNELS[kernel] = _by_symbol(kernel)
+    x1 = np.asarray(inputs[0])
+    shape = x1.shape
+    X = np.stack([np.asarray(x).reshape(len(x1), -1) for x in inputs])
+    params = np.asarray(params, dtype=np.float64)
+    if out is None:
+        dtype = np.result_type(x1, np.float32) if dtype is None else dtype
+        buffer = _KERNELS[kernel](X, params, np.empty((n_outputs,) + X.shape[1:], dtype=dtype))
+        outs = tuple(values.reshape(shape) for values in buffer)
+        return outs if n_outputs > 1 else outs[0]
+    if n_outputs == 1:
+        _KERNELS[kernel](X, params, out.reshape(len(out), -1)[np.newaxis])
+        return out
+    buffer = _KERNELS[kernel](X, params, np.empty((n_outputs,) + X.shape[1:], dtype=out[0].dtype))
+    for values, output in zip(buffer, out):
+        output[...] = values.reshape(shape)
+    return out
+
+
+def _check_period(period, minimum=2):
+    if int(period) < minimum:
+        raise ValueError(f"timeperiod must be at least {minimum}, got {period}")
+    return int(period)
+
+
+# ===== indicators, the names and defaults of talib =====
+
+
+def sma(close, timeperiod=30, out=None, dtype=None):
+    return _run(_sma, [close], [_check_period(timeperiod)], out=out, dtype=dtype)
+
+
+def ema(close, timeperiod=30, out=None, dtype=None):
+    return _run(_ema, [close], [_check_period(timeperiod)], out=out, dtype=dtype)
+
+
+def dema(close, timeperiod=30, out=None, dtype=None):
+    return _run(_dema, [close], [_check_period(timeperiod)], out=out, dtype=dtype)
+
+
+def tema(close, timeperiod=30, out=None, dtype=None):
+    return _run(_tema, [close], [_check_period(timeperiod)], out=out, dtype=dtype)
+
+
+def kama(close, timeperiod=30, out=None, dtype=None):
+    return _run(_kama, [close], [_check_period(timeperiod)], out=out, dtype=dtype)
+
+
+def rsi(close, timeperiod=14, out=None, dtype=None):
+    return _run(_rsi, [close], [_check_period(timeperiod)], out=out, dtype=dtype)
+
+
+def atr(high, low, close, timeperiod=14, out=None, dtype=None):
+    return _run(_atr, [high, low, close], [_check_period(timeperiod)], out=out, dtype=dtype)
+
+
+def natr(high, low, close, timeperiod=14, out=None, dtype=None):
+    return _run(_natr, [high, low, close], [_check_period(timeperiod)], out=out, dtype=dtype)
+
+
+def dx(high, low, close, timeperiod=14, out=None, dtype=None):
+    return _run(_dx, [high, low, close], [_check_period(timeperiod)], out=out, dtype=dtype)
+
+
+def adx(high, low, close, timeperiod=14, out=None, dtype=None):
+    return _run(_adx, [high, low, close], [_check_period(timeperiod)], out=out, dtype=dtype)
+
+
+def bbands(close, timeperiod=5, nbdevup=2., nbdevdn=2., out=None, dtype=None):
+    """(upper, middle, lower) like ta.BBANDS with the default sma"""
+    return _run(_bbands, [close], [_check_period(timeperiod), nbdevup, nbdevdn], n_outputs=3, out=out, dtype=dtype)
+
+
+def macd(close, fastperiod=12, slowperiod=26, signalperiod=9, out=None, dtype=None):
+    """(macd, signal, hist) like ta.MACD"""
+    params = [_check_period(fastperiod), _check_period(slowperiod), _check_period(signalperiod, 1)]
+    return _run(_macd, [close], params, n_outputs=3, out=out, dtype=dtype)
+
+
+def linearreg(close, timeperiod=14, out=None, dtype=None):
+    return _run(_linearreg, [close], [_check_period(timeperiod), _LINEARREG], out=out, dtype=dtype)
+
+
+def linearreg_slope(close, timeperiod=14, out=None, dtype=None):
+    return _run(_linearreg, [close], [_check_period(timeperiod), _LINEARREG_SLOPE], out=out, dtype=dtype)
+
+
+def linearreg_intercept(close, timeperiod=14, out=None, dtype=None):
+    return _run(_linearreg, [close], [_check_period(timeperiod), _LINEARREG_INTERCEPT], out=out, dtype=dtype)
+
+
+def linearreg_angle(close, timeperiod=14, out=None, dtype=None):
+    return _run(_linearreg, [close], [_check_period(timeperiod), _LINEARREG_ANGLE], out=out, dtype=dtype)
+
+
+def tsf(close, timeperiod=14, out=None, dtype=None):
+    return _run(_linearreg, [close], [_check_period(timeperiod), _TSF], out=out, dtype=dtype)
+
+
+def correl(x, y, timeperiod=30, out=None, dtype=None):
+    return _run(_correl, [x, y], [_check_period(timeperiod, 1)], out=out, dtype=dtype)
+
+
+def beta(x, y, timeperiod=5, out=None, dtype=None):
+    return _run(_beta, [x, y], [_check_period(timeperiod, 1)], out=out, dtype=dtype)
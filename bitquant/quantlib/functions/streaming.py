@@ -0,0 +1,884 @@
+"""
+Streaming versions of the primitives of functions._function_map, for live inference where only the newest row of a
+factor is needed.
+
+Every node of a factor gets a stream of its primitive, made from the _Function and the int parameters of the node:
+
+    stream = make_stream(ts_rsi, (14,))
+    state = stream.init(close)              # history of the inputs, (n_ts, n_symbols) arrays, O(n_ts) once
+    value = stream.update(state, close_t)   # inputs of the new bar, (n_symbols,) arrays, returns (n_symbols,)
+
+After init on rows [0, n) and an update with every later row the value equals the last row of the batch primitive
+over all the rows, within the tolerance of indicators.py on columns without gaps, and takes the dtype of its first
+input like the batch primitive.
+
+How the primitives are streamed:
+- elementwise primitives (common_*, the price transforms, bop) and the cross sectional cs_* have no state
+- ts_sma, dynamic_ts_mean / std and ts_delay / ts_delta keep running sums or a ring of their window, O(1) per bar
+- the recursive indicators (the ema family, macd, apo, ppo, trix, kama, rsi, cmo, stochrsi, atr, natr, the
+  directional movement family, obv, ad, adosc, sar) keep the variables of the TA-Lib recursion in a
+  (n_slots, n_symbols) array updated by a numba step, O(1) per bar
+- the other window primitives keep the last lookback + 1 rows of their inputs (_Function.lookback) and run the
+  batch primitive on them, O(window) per bar whatever the length of the history
+- the Hilbert transform indicators, and functions without an entry in _stream_map, are run on their whole input
+  history, their value depends on every past bar
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+from numba import njit
+
+from bitquant.quantlib.functions.indicators import _is_zero, _true_range
+from bitquant.quantlib.functions.utils import _nan_moments_push
+
+
+class _Stream(ABC):
+    """streaming version of one node, `function` is the batch _Function of the node and `params` its int parameters"""
+
+    def __init__(self, function, params):
+        self.function = function
+        self.params = tuple(params)
+
+    def batch(self, *xs):
+        return self.function(*xs, *self.params)
+
+    @abstractmethod
+    def init(self, *xs):
+        pass
+
+    @abstractmethod
+    def update(self, state, *values):
+        pass
+
+
+class _Elementwise(_Stream):
+
+    def init(self, *xs):
+        return None
+
+    def update(self, state, *values):
+        return self.batch(*(value[np.newaxis] for value in values))[0]
+
+
+class _RowBuffer(object):
+    """the last `rows` rows of every input in a buffer of twice that, moved back once every `rows` pushes"""
+
+    def __init__(self, xs, rows=None):
+        self.rows = rows
+        n = len(xs[0]) if rows is None else min(len(xs[0]), rows)
+        capacity = max(2 * n, 16) if rows is None else 2 * rows
+        self.buffers = [np.empty((capacity,) + x.shape[1:], dtype=x.dtype) for x in xs]
+        for buffer, x in zip(self.buffers, xs):
+            buffer[:n] = x[len(x) - n:]
+        self.n = n
+
+    def push(self, values):
+        if self.n == len(self.buffers[0]):
+            if self.rows is None:
+                self.buffers = [np.concatenate([buffer, np.empty_like(buffer)]) for buffer in self.buffers]
+            else:
+                for buffer in self.buffers:
+                    buffer[:self.rows - 1] = buffer[self.n - self.rows + 1:self.n]
+                self.n = self.rows - 1
+        for buffer, value in zip(self.buffers, values):
+            buffer[self.n] = value
+        self.n += 1
+
+    def window(self):
+        start = 0 if self.rows is None else max(self.n - self.rows, 0)
+        return [buffer[start:self.n] for buffer in self.buffers]
+
+
+class _Window(_Stream):
+    """
+    Keeps the last `rows` rows of the inputs, lookback + 1 of the primitive, and runs the batch primitive on them.
+    Without rows the whole history is kept.
+    """
+
+    def __init__(self, function, params, rows=None):
+        super().__init__(function, params)
+        self.rows = rows
+
+    def init(self, *xs):
+        return _RowBuffer(xs, self.rows)
+
+    def update(self, state, *values):
+        state.push(values)
+        return self.batch(*state.window())[-1]
+
+
+_REPLAYS = {}
+
+
+def _replay(step):
+    """numba loop running a step over every row of X (n_ts, n_inputs, n_symbols)"""
+    if step not in _REPLAYS:
+        @njit(error_model="numpy")
+        def replay(state, X, args, out):
+            for i in range(len(X)):
+                step(state, X[i], args, out)
+
+        _REPLAYS[step] = replay
+    return _REPLAYS[step]
+
+
+class _Step(_Stream):
+    """
+    The variables of a recursion in a (n_slots, n_symbols) float64 array, updated by the numba
+    step(state, x, args, out) with the inputs x (n_inputs, n_symbols) of one bar, the value is written to out.
+    Slot 0 counts the bars of every symbol from its first bar where all inputs are valid.
+    """
+
+    def __init__(self, function, params, step, n_slots, args):
+        super().__init__(function, params)
+        self.step = step
+        self.n_slots = n_slots
+        self.args = np.array(args, dtype=np.float64)
+
+    def init(self, *xs):
+        state = np.zeros((self.n_slots, xs[0].shape[1]))
+        X = np.stack([np.asarray(x, dtype=np.float64) for x in xs], axis=1)
+        _replay(self.step)(state, X, self.args, np.empty(xs[0].shape[1]))
+        return state
+
+    def update(self, state, *values):
+        out = np.empty(len(values[0]))
+        self.step(state, np.stack([np.asarray(value, dtype=np.float64) for value in values]), self.args, out)
+        return out
+
+
+@njit(error_model="numpy")
+def _nan_moments_rows(X, window, std, values, count, slot, mean, ssq, same, out):
+    for i in range(len(X)):
+        for j in range(X.shape[1]):
+            x = np.float64(X[i, j])
+            if x != x:
+                out[j] = np.nan
+            else:
+                out[j] = _nan_moments_push(x, j, window, std, values, count, slot, mean, ssq, same)
+
+
+class _NanMoments(_Stream):
+    """dynamic_ts_mean / dynamic_ts_std, the state of utils.rolling_nanmean / rolling_nanstd for every symbol"""
+
+    def __init__(self, function, params, std):
+        super().__init__(function, params)
+        self.window = int(params[0])
+        self.std = std
+
+    def _push(self, state, X):
+        out = np.empty(X.shape[1])
+        _nan_moments_rows(X, self.window, self.std, *state, out)
+        return out
+
+    def init(self, x):
+        n_symbols = x.shape[1]
+        state = (np.empty((self.window, n_symbols)), np.zeros(n_symbols, dtype=np.int64),
+                 np.zeros(n_symbols, dtype=np.int64), np.zeros(n_symbols), np.zeros(n_symbols),
+                 np.zeros(n_symbols, dtype=np.int64))
+        self._push(state, x)
+        return state
+
+    def update(self, state, value):
+        return self._push(state, value[np.newaxis])
+
+
+class _Delay(_Stream):
+    """ts_delay / ts_delta, a ring of the last t values"""
+
+    def __init__(self, function, params, delta):
+        super().__init__(function, params)
+        self.t = int(params[0])
+        self.delta = delta
+
+    def init(self, x):
+        ring = np.full((self.t,) + x.shape[1:], np.nan, dtype=x.dtype)
+        n = min(len(x), self.t)
+        # the value of row i is at i % t
+        ring[(np.arange(len(x) - n, len(x))) % self.t] = x[len(x) - n:]
+        return [ring, len(x)]
+
+    def update(self, state, value):
+        ring, n = state
+        delayed = ring[n % self.t].copy()
+        ring[n % self.t] = value
+        state[1] = n + 1
+        return value - delayed if self.delta else delayed
+
+
+# ===== numba steps, the slots of every step are listed in its docstring =====
+
+
+@njit(inline="always")
+def _waiting(state, x, j):
+    """a symbol starts at its first bar where every input is valid, until then nothing is counted"""
+    if state[0, j] > 0:
+        return False
+    for k in range(x.shape[0]):
+        if x[k, j] != x[k, j]:
+            return True
+    return False
+
+
+@njit(error_model="numpy", inline="always")
+def _ema_push(state, s, j, value, period, k):
+    """ema in slots s (count), s + 1 (sum, then the ema) seeded with the sma of the first period values"""
+    count = state[s, j] + 1
+    state[s, j] = count
+    if count < period:
+        state[s + 1, j] += value
+        return np.nan
+    if count == period:
+        state[s + 1, j] = (state[s + 1, j] + value) / period
+    else:
+        state[s + 1, j] = (value - state[s + 1, j]) * k + state[s + 1, j]
+    return state[s + 1, j]
+
+
+@njit(error_model="numpy")
+def _sma_step(state, x, args, out):
+    """0 count, 1 window sum, 2 nan values in the window, 3.. ring of the window"""
+    period = int(args[0])
+    for j in range(x.shape[1]):
+        if _waiting(state, x, j):
+            out[j] = np.nan
+            continue
+        state[0, j] += 1
+        i = int(state[0, j]) - 1
+        value = x[0, j]
+        if value == value:
+            state[1, j] += value
+        else:
+            state[2, j] += 1
+        state[3 + i % period, j] = value
+        if i < period - 1:
+            out[j] = np.nan
+            continue
+        out[j] = state[1, j] / period if state[2, j] == 0 else np.nan
+        trailing = state[3 + (i + 1) % period, j]
+        if trailing == trailing:
+            state[1, j] -= trailing
+        else:
+            state[2, j] -= 1
+
+
+@njit(error_model="numpy")
+def _ema_chain_step(state, x, args, out):
+    """
+    dema (args[1] == 2), tema (3) or trix (4): 0 count, 1-2, 3-4, 5-6 the chained emas, 7 previous ema of trix
+    """
+    period = int(args[0])
+    kind = int(args[1])
+    k = 2. / (period + 1)
+    for j in range(x.shape[1]):
+        if _waiting(state, x, j):
+            out[j] = np.nan
+            continue
+        state[0, j] += 1
+        out[j] = np.nan
+        first = _ema_push(state, 1, j, x[0, j], period, k)
+        if state[1, j] < period:
+            continue
+        second = _ema_push(state, 3, j, first, period, k)
+        if state[3, j] < period:
+            continue
+        if kind == 2:
+            out[j] = 2. * first - second
+            continue
+        third = _ema_push(state, 5, j, second, period, k)
+        if state[5, j] < period:
+            continue
+        if kind == 3:
+            out[j] = 3. * first - 3. * second + third
+            continue
+        previous = state[7, j]
+        state[7, j] = third
+        if state[5, j] > period:
+            out[j] = ((third / previous) - 1.) * 100. if previous != 0. else 0.
+
+
+@njit(error_model="numpy")
+def _oscillator_step(state, x, args, out):
+    """
+    apo (args[2] == 0), ppo (1) of the fast args[0] and slow args[1] ema, macd line (2) with args[3] the signal
+    period: 0 count, 1-2 fast ema, 3-4 slow ema
+    """
+    fast = int(args[0])
+    slow = int(args[1])
+    kind = int(args[2])
+    signal = int(args[3])
+    k_fast = 2. / (fast + 1)
+    k_slow = 2. / (slow + 1)
+    for j in range(x.shape[1]):
+        if _waiting(state, x, j):
+            out[j] = np.nan
+            continue
+        state[0, j] += 1
+        i = int(state[0, j]) - 1
+        out[j] = np.nan
+        slow_ema = _ema_push(state, 3, j, x[0, j], slow, k_slow)
+        # the fast ema of macd starts slow - fast bars later so both have their first value on the same bar
+        if kind != 2 or i >= slow - fast:
+            fast_ema = _ema_push(state, 1, j, x[0, j], fast, k_fast)
+        else:
+            fast_ema = np.nan
+        if i < slow - 1 or (kind == 2 and i < slow + signal - 2):
+            continue
+        if kind == 1:
+            out[j] = ((fast_ema - slow_ema) / slow_ema) * 100. if not _is_zero(slow_ema) else 0.
+        else:
+            out[j] = fast_ema - slow_ema
+
+
+@njit(error_model="numpy")
+def _kama_step(state, x, args, out):
+    """0 count, 1 kama, 2 sum of the absolute changes, 3 value leaving the window, 4.. ring of the last period + 1"""
+    period = int(args[0])
+    const_max = 2. / (30. + 1.)
+    const_diff = 2. / (2. + 1.) - const_max
+    size = period + 1
+    for j in range(x.shape[1]):
+        if _waiting(state, x, j):
+            out[j] = np.nan
+            continue
+        state[0, j] += 1
+        i = int(state[0, j]) - 1
+        value = x[0, j]
+        out[j] = np.nan
+        if i >= 1 and i <= period:
+            state[2, j] += abs(state[4 + (i - 1) % size, j] - value)
+        if i == period:
+            trailing_value = state[4, j]
+            state[3, j] = trailing_value
+            period_roc = value - trailing_value
+            prev = state[4 + (i - 1) % size, j]
+        elif i > period:
+            trailing_x = state[4 + (i - period) % size, j]
+            period_roc = value - trailing_x
+            state[2, j] -= abs(state[3, j] - trailing_x)
+            state[2, j] += abs(value - state[4 + (i - 1) % size, j])
+            state[3, j] = trailing_x
+            prev = state[1, j]
+        state[4 + i % size, j] = value
+        if i < period:
+            continue
+        sum_roc = state[2, j]
+        if sum_roc <= period_roc or _is_zero(sum_roc):
+            ratio = 1.
+        else:
+            ratio = abs(period_roc / sum_roc)
+        sc = ratio * const_diff + const_max
+        sc *= sc
+        state[1, j] = (value - prev) * sc + prev
+        out[j] = state[1, j]
+
+
+@njit(error_model="numpy", inline="always")
+def _wilder_gain_loss(state, j, i, value, period):
+    """wilder smoothed gain and loss of rsi / cmo in slots 1 previous value, 2 gain, 3 loss, True once defined"""
+    if i == 0:
+        state[1, j] = value
+        return False
+    diff = value - state[1, j]
+    state[1, j] = value
+    if i <= period:
+        if diff < 0:
+            state[3, j] -= diff
+        else:
+            state[2, j] += diff
+        if i < period:
+            return False
+    else:
+        state[3, j] *= period - 1
+        state[2, j] *= period - 1
+        if diff < 0:
+            state[3, j] -= diff
+        else:
+            state[2, j] += diff
+    state[3, j] /= period
+    state[2, j] /= period
+    return True
+
+
+@njit(error_model="numpy")
+def _rsi_step(state, x, args, out):
+    """rsi (args[1] == 0) or cmo (1): 0 count, 1 previous value, 2 gain, 3 loss"""
+    period = int(args[0])
+    cmo = int(args[1]) == 1
+    for j in range(x.shape[1]):
+        if _waiting(state, x, j):
+            out[j] = np.nan
+            continue
+        state[0, j] += 1
+        i = int(state[0, j]) - 1
+        if not _wilder_gain_loss(state, j, i, x[0, j], period):
+            out[j] = np.nan
+            continue
+        gain = state[2, j]
+        loss = state[3, j]
+        total = gain + loss
+        if _is_zero(total):
+            out[j] = 0.
+        elif cmo:
+            out[j] = 100. * ((gain - loss) / total)
+        else:
+            out[j] = 100. * (gain / total)
+
+
+@njit(error_model="numpy")
+def _stochrsi_step(state, x, args, out):
+    """
+    fastk / fastd of the rsi with sma fastd: 0 count, 1-3 rsi, 4 rsi values, 5 fastk values, 6 running sum of
+    fastk like TA-Lib, 7.. ring of the last fastk_period rsi, then ring of the last fastd_period fastk
+    """
+    period = int(args[0])
+    fastk_period = int(args[1])
+    fastd_period = int(args[2])
+    k_ring = 7 + fastk_period
+    for j in range(x.shape[1]):
+        if _waiting(state, x, j):
+            out[j] = np.nan
+            continue
+        state[0, j] += 1
+        i = int(state[0, j]) - 1
+        out[j] = np.nan
+        if not _wilder_gain_loss(state, j, i, x[0, j], period):
+            continue
+        total = state[2, j] + state[3, j]
+        rsi = 100. * (state[2, j] / total) if not _is_zero(total) else 0.
+        n_rsi = int(state[4, j])
+        state[7 + n_rsi % fastk_period, j] = rsi
+        state[4, j] = n_rsi + 1
+        if n_rsi + 1 < fastk_period:
+            continue
+        lowest = np.inf
+        highest = -np.inf
+        for r in range(fastk_period):
+            lowest = min(lowest, state[7 + r, j])
+            highest = max(highest, state[7 + r, j])
+        # rounded like TA-Lib
+        diff = (highest - lowest) / 100.
+        fastk = (rsi - lowest) / diff if diff != 0. else 0.
+        n_k = int(state[5, j])
+        state[k_ring + n_k % fastd_period, j] = fastk
+        state[5, j] = n_k + 1
+        state[6, j] += fastk
+        if n_k + 1 < fastd_period:
+            continue
+        fastd = state[6, j] / fastd_period
+        state[6, j] -= state[k_ring + (n_k + 1) % fastd_period, j]
+        # every fastk of the window is 0, 0 like the batch primitive
+        out[j] = fastk / fastd if fastd != 0. else 0.
+
+
+@njit(error_model="numpy")
+def _atr_step(state, x, args, out):
+    """atr (args[1] == 0) or natr (1) of high, low, close: 0 count, 1 previous close, 2 sum, then atr"""
+    period = int(args[0])
+    normalized = int(args[1]) == 1
+    for j in range(x.shape[1]):
+        if _waiting(state, x, j):
+            out[j] = np.nan
+            continue
+        state[0, j] += 1
+        i = int(state[0, j]) - 1
+        close = x[2, j]
+        out[j] = np.nan
+        if i > 0:
+            true_range = _true_range(x[0, j], x[1, j], state[1, j])
+            if i < period:
+                state[2, j] += true_range
+            elif i == period:
+                state[2, j] = (state[2, j] + true_range) / period
+            else:
+                state[2, j] *= period - 1
+                state[2, j] += true_range
+                state[2, j] /= period
+        state[1, j] = close
+        if i < period:
+            continue
+        if normalized:
+            out[j] = (state[2, j] / close) * 100. if not _is_zero(close) else 0.
+        else:
+            out[j] = state[2, j]
+
+
+_PLUS_DM, _MINUS_DM, _PLUS_DI, _MINUS_DI, _DX, _ADX, _ADXR = range(7)
+
+
+@njit(error_model="numpy")
+def _directional_step(state, x, args, out):
+    """
+    plus / minus dm (of high, low), plus / minus di, dx, adx, adxr (of high, low, close) by args[1]:
+    0 count, 1 previous high, 2 previous low, 3 previous close, 4 +DM, 5 -DM, 6 true range, 7 dx, 8 sum of dx,
+    then adx, 9.. ring of the last period adx of adxr
+    """
+    period = int(args[0])
+    kind = int(args[1])
+    for j in range(x.shape[1]):
+        if _waiting(state, x, j):
+            out[j] = np.nan
+            continue
+        state[0, j] += 1
+        i = int(state[0, j]) - 1
+        high = x[0, j]
+        low = x[1, j]
+        out[j] = np.nan
+        if i == 0:
+            state[1, j] = high
+            state[2, j] = low
+            if kind >= _PLUS_DI:
+                state[3, j] = x[2, j]
+            continue
+        diff_p = high - state[1, j]
+        state[1, j] = high
+        diff_m = state[2, j] - low
+        state[2, j] = low
+        if i >= period:
+            state[5, j] -= state[5, j] / period
+            state[4, j] -= state[4, j] / period
+        if diff_m > 0 and diff_p < diff_m:
+            state[5, j] += diff_m
+        elif diff_p > 0 and diff_p > diff_m:
+            state[4, j] += diff_p
+        if kind <= _MINUS_DM:
+            if i >= period - 1:
+                out[j] = state[4, j] if kind == _PLUS_DM else state[5, j]
+            continue
+
+        true_range = _true_range(high, low, state[3, j])
+        state[3, j] = x[2, j]
+        if i < period:
+            state[6, j] += true_range
+            continue
+        state[6, j] = state[6, j] - state[6, j] / period + true_range
+        tr = state[6, j]
+        if kind <= _MINUS_DI:
+            dm = state[4, j] if kind == _PLUS_DI else state[5, j]
+            out[j] = 100. * (dm / tr) if not _is_zero(tr) else 0.
+            continue
+
+        # dx keeps its last value while the true range or the sum of the di is zero
+        updated = False
+        if not _is_zero(tr):
+            minus_di = 100. * (state[5, j] / tr)
+            plus_di = 100. * (state[4, j] / tr)
+            total = minus_di + plus_di
+            if not _is_zero(total):
+                state[7, j] = 100. * (abs(minus_di - plus_di) / total)
+                updated = True
+        if kind == _DX:
+            out[j] = state[7, j]
+            continue
+        if i < 2 * period - 1:
+            if updated:
+                state[8, j] += state[7, j]
+            continue
+        if i == 2 * period - 1:
+            if updated:
+                state[8, j] += state[7, j]
+            state[8, j] = state[8, j] / period
+        elif updated:
+            state[8, j] = (state[8, j] * (period - 1) + state[7, j]) / period
+        if kind == _ADX:
+            out[j] = state[8, j]
+            continue
+        n_adx = i - (2 * period - 1)
+        state[9 + n_adx % period, j] = state[8, j]
+        if n_adx >= period - 1:
+            out[j] = (state[8, j] + state[9 + (n_adx + 1) % period, j]) / 2.
+
+
+@njit(error_model="numpy")
+def _obv_step(state, x, args, out):
+    """close, volume: 0 count, 1 previous close, 2 obv"""
+    for j in range(x.shape[1]):
+        if _waiting(state, x, j):
+            out[j] = np.nan
+            continue
+        state[0, j] += 1
+        close = x[0, j]
+        if state[0, j] == 1:
+            state[2, j] = x[1, j]
+        elif close > state[1, j]:
+            state[2, j] += x[1, j]
+        elif close < state[1, j]:
+            state[2, j] -= x[1, j]
+        state[1, j] = close
+        out[j] = state[2, j]
+
+
+@njit(error_model="numpy", inline="always")
+def _ad_push(state, x, j):
+    high = x[0, j]
+    low = x[1, j]
+    close = x[2, j]
+    tmp = high - low
+    if tmp > 0.:
+        state[1, j] += (((close - low) - (high - close)) / tmp) * x[3, j]
+    return state[1, j]
+
+
+@njit(error_model="numpy")
+def _ad_step(state, x, args, out):
+    """high, low, close, volume: 0 count, 1 ad"""
+    for j in range(x.shape[1]):
+        if _waiting(state, x, j):
+            out[j] = np.nan
+            continue
+        state[0, j] += 1
+        out[j] = _ad_push(state, x, j)
+
+
+@njit(error_model="numpy")
+def _adosc_step(state, x, args, out):
+    """ema args[0] - ema args[1] of ad seeded with the first ad: 0 count, 1 ad, 2 fast ema, 3 slow ema"""
+    fast = int(args[0])
+    slow = int(args[1])
+    fast_k = 2. / (fast + 1)
+    slow_k = 2. / (slow + 1)
+    one_minus_fast_k = 1. - fast_k
+    one_minus_slow_k = 1. - slow_k
+    for j in range(x.shape[1]):
+        if _waiting(state, x, j):
+            out[j] = np.nan
+            continue
+        state[0, j] += 1
+        i = int(state[0, j]) - 1
+        ad = _ad_push(state, x, j)
+        if i == 0:
+            state[2, j] = ad
+            state[3, j] = ad
+        else:
+            state[2, j] = (fast_k * ad) + (one_minus_fast_k * state[2, j])
+            state[3, j] = (slow_k * ad) + (one_minus_slow_k * state[3, j])
+        out[j] = state[2, j] - state[3, j] if i >= max(fast, slow) - 1 else np.nan
+
+
+@njit(error_model="numpy")
+def _sar_step(state, x, args, out):
+    """
+    parabolic sar of high, low like TA_SAR: 0 count, 1 long, 2 acceleration factor, 3 extreme point, 4 sar,
+    5 high and 6 low of the previous bar
+    """
+    acceleration = args[0]
+    maximum = args[1]
+    if acceleration > maximum:
+        acceleration = maximum
+    for j in range(x.shape[1]):
+        if _waiting(state, x, j):
+            out[j] = np.nan
+            continue
+        state[0, j] += 1
+        i = int(state[0, j]) - 1
+        new_high = x[0, j]
+        new_low = x[1, j]
+        out[j] = np.nan
+        if i == 0:
+            state[5, j] = new_high
+            state[6, j] = new_low
+            continue
+        if i == 1:
+            # short when the first bar has a -DM
+            diff_m = state[6, j] - new_low
+            diff_p = new_high - state[5, j]
+            is_long = not (diff_m > 0 and diff_p < diff_m)
+            state[1, j] = 1. if is_long else 0.
+            state[2, j] = acceleration
+            state[3, j] = new_high if is_long else new_low
+            state[4, j] = state[6, j] if is_long else state[5, j]
+            prev_high = new_high
+            prev_low = new_low
+        else:
+            prev_high = state[5, j]
+            prev_low = state[6, j]
+        state[5, j] = new_high
+        state[6, j] = new_low
+        af = state[2, j]
+        ep = state[3, j]
+        sar = state[4, j]
+        if state[1, j] == 1.:
+            if new_low <= sar:
+                # switch to short, the sar restarts at the extreme point within the range of both bars
+                state[1, j] = 0.
+                sar = ep
+                if sar < prev_high:
+                    sar = prev_high
+                if sar < new_high:
+                    sar = new_high
+                out[j] = sar
+                af = acceleration
+                ep = new_low
+                sar = sar + af * (ep - sar)
+                if sar < prev_high:
+                    sar = prev_high
+                if sar < new_high:
+                    sar = new_high
+            else:
+                out[j] = sar
+                if new_high > ep:
+                    ep = new_high
+                    af += acceleration
+                    if af > maximum:
+                        af = maximum
+                sar = sar + af * (ep - sar)
+                if sar > prev_low:
+                    sar = prev_low
+                if sar > new_low:
+                    sar = new_low
+        else:
+            if new_high >= sar:
+                state[1, j] = 1.
+                sar = ep
+                if sar > prev_low:
+                    sar = prev_low
+                if sar > new_low:
+                    sar = new_low
+                out[j] = sar
+                af = acceleration
+                ep = new_high
+                sar = sar + af * (ep - sar)
+                if sar > prev_low:
+                    sar = prev_low
+                if sar > new_low:
+                    sar = new_low
+            else:
+                out[j] = sar
+                if new_low < ep:
+                    ep = new_low
+                    af += acceleration
+                    if af > maximum:
+                        af = maximum
+                sar = sar + af * (ep - sar)
+                if sar < prev_high:
+                    sar = prev_high
+                if sar < new_high:
+                    sar = new_high
+        state[2, j] = af
+        state[3, j] = ep
+        state[4, j] = sar
+
+
+# ===== streams of the primitives of _function_map by name =====
+
+
+def _elementwise():
+    return lambda function, params: _Elementwise(function, params)
+
+
+def _window():
+    """the window of the lookback of the function, the bars before the current one it reads"""
+    return lambda function, params: _Window(function, params, function.lookback(*params) + 1)
+
+
+def _whole_history():
+    return lambda function, params: _Window(function, params)
+
+
+def _step(step, n_slots, args):
+    """n_slots(*params) and args(*params) of the numba step"""
+    return lambda function, params: _Step(function, params, step, n_slots(*params), args(*params))
+
+
+def _stochrsi(function, params):
+    t, fastk_period, fastd_period, fastd_matype = (tuple(params) + (5, 3, 0)[len(params) - 1:])[:4]
+    if fastd_matype != 0:
+        return _Window(function, params)
+    return _Step(function, params, _stochrsi_step, 7 + fastk_period + fastd_period, (t, fastk_period, fastd_period))
+
+
+_stream_map = {
+    "common_add": _elementwise(),
+    "common_sub": _elementwise(),
+    "common_mul": _elementwise(),
+    "common_div": _elementwise(),
+    "common_sqrt": _elementwise(),
+    "common_log": _elementwise(),
+    "common_abs": _elementwise(),
+    "common_neg": _elementwise(),
+    "common_inv": _elementwise(),
+    "common_max": _elementwise(),
+    "common_min": _elementwise(),
+    "common_sin": _elementwise(),
+    "common_cos": _elementwise(),
+    "common_tan": _elementwise(),
+    "dynamic_ts_std": lambda function, params: _NanMoments(function, params, True),
+    "dynamic_ts_mean": lambda function, params: _NanMoments(function, params, False),
+    "dynamic_ts_max": _window(),
+    "ts_min": _window(),
+    "ts_argmax": _window(),
+    "ts_range": _window(),
+    "ts_rank": _window(),
+    "ts_quantile": _window(),
+    "ts_delay": lambda function, params: _Delay(function, params, False),
+    "ts_delta": lambda function, params: _Delay(function, params, True),
+    "ts_normalize_180": _window(),
+    "cs_rank": _elementwise(),
+    "cs_zscore": _elementwise(),
+    "cs_demean": _elementwise(),
+    "cs_quantile": _elementwise(),
+    "ts_bbands": _window(),
+    "ts_dema": _step(_ema_chain_step, lambda t: 7, lambda t: (t, 2)),
+    "ts_ht_trendmode": _whole_history(),
+    "ts_kama": _step(_kama_step, lambda t: 5 + t, lambda t: (t,)),
+    "ts_midpoint": _window(),
+    "ts_midprice": _window(),
+    "ts_sar": _step(_sar_step, lambda acceleration=0.02, maximum=0.2: 7,
+                    lambda acceleration=0.02, maximum=0.2: (acceleration, maximum)),
+    "ts_sma": _step(_sma_step, lambda t: 3 + t, lambda t: (t,)),
+    "ts_tema": _step(_ema_chain_step, lambda t: 7, lambda t: (t, 3)),
+    "ts_trima": _window(),
+    "ts_adx": _step(_directional_step, lambda t=14: 9, lambda t=14: (t, _ADX)),
+    "ts_adxr": _step(_directional_step, lambda t: 9 + t, lambda t: (t, _ADXR)),
+    "ts_apo": _step(_oscillator_step, lambda t: 5, lambda t: (t, 2 * (t + 1), 0, 0)),
+    "ts_stochrsi": _stochrsi,
+    "ts_aroonosc": _window(),
+    "ts_bop": _elementwise(),
+    "ts_cci": _window(),
+    "ts_cmo": _step(_rsi_step, lambda t: 4, lambda t: (t, 1)),
+    "ts_dx": _step(_directional_step, lambda t: 9, lambda t: (t, _DX)),
+    "ts_macd": _step(_oscillator_step, lambda t: 5, lambda t: (t, 2 * (t + 1), 2, t - 4)),
+    "ts_mfi": _window(),
+    "ts_minus_di": _step(_directional_step, lambda t: 9, lambda t: (t, _MINUS_DI)),
+    "ts_minus_dm": _step(_directional_step, lambda t: 9, lambda t: (t, _MINUS_DM)),
+    "ts_mom": _window(),
+    "ts_plus_di": _step(_directional_step, lambda t: 9, lambda t: (t, _PLUS_DI)),
+    "ts_plus_dm": _step(_directional_step, lambda t: 9, lambda t: (t, _PLUS_DM)),
+    "ts_ppo": _step(_oscillator_step, lambda t: 5, lambda t: (t, 2 * (t + 1), 1, 0)),
+    "ts_roc": _window(),
+    "ts_rsi": _step(_rsi_step, lambda t: 4, lambda t: (t, 0)),
+    "ts_stoch": _window(),
+    "ts_trix": _step(_ema_chain_step, lambda t: 8, lambda t: (t, 4)),
+    "ts_ultosc": _window(),
+    "ts_willr": _window(),
+    "ts_ad": _step(_ad_step, lambda: 2, lambda: ()),
+    "ts_adosc": _step(_adosc_step, lambda fastperiod=3, slowperiod=10: 4,
+                      lambda fastperiod=3, slowperiod=10: (fastperiod, slowperiod)),
+    "ts_obv": _step(_obv_step, lambda: 3, lambda: ()),
+    "ts_natr": _step(_atr_step, lambda t: 3, lambda t: (t, 1)),
+    "ts_atr": _step(_atr_step, lambda t: 3, lambda t: (t, 0)),
+    "ts_trange": _window(),
+    "ts_avgprice": _elementwise(),
+    "ts_medprice": _elementwise(),
+    "ts_typprice": _elementwise(),
+    "ts_wclprice": _elementwise(),
+    "ts_ht_dcperiod": _whole_history(),
+    "ts_ht_dcphase": _whole_history(),
+    "ts_ht_phasor": _whole_history(),
+    "ts_ht_sine": _whole_history(),
+    "ts_beta": _window(),
+    "ts_correl": _window(),
+    "ts_linearreg": _window(),
+    "ts_linearreg_angle": _window(),
+    "ts_linearreg_intercept": _window(),
+    "ts_linearreg_slope": _window(),
+    "ts_tsf": _window(),
+}
+
+
+def make_stream(function, params=()) -> _Stream:
+    """stream of a node of `function` with the int parameters `params`, a function without stream is replayed"""
+    factory = _stream_map.get(function.name)
+    if factory is None:
+        return _Window(function, params)
+    return factory(function, params)
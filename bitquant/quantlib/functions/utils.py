@@ -1,8 +1,6 @@
 from numba import jit, prange
 import numpy as np
 import pandas as pd
-import copy
-from scipy.stats import spearmanr
 
 
 def rolling_window(a, window, axis=0):
@@ -31,55 +29,521 @@ def calc_zscore_2d(series, rolling_window=180):
     return res
 
 
-def rolling_nanmean(A, window=None):
-    ret = pd.DataFrame(A)
-    factor_table = copy.deepcopy(ret)
-    for col in ret.columns:
-        current_data = copy.deepcopy(ret[col])
-        current_data.dropna(inplace=True)
-        current_factor = current_data.rolling(window).mean().values
-        number = 0
-        for index, data in enumerate(ret[col]):
+# columns per parallel block, the rows of a block are walked in memory order
+_COLUMN_BLOCK = 32
 
-            if ret[col][index] != ret[col][index]:
-                factor_table[col][index] = np.nan
+
+@jit(nopython=True, nogil=True, inline="always")
+def _nan_moments_push(x, j, window, std, values, count, slot, mean, ssq, same):
+    """
+    Add the value x of column j to the rolling moments and return the mean (or std) of its last `window` values,
+    nan while fewer values were added. values (window, n_cols) holds the last values, count, slot, mean, ssq and
+    same (n_cols,) the state of every column, the batch kernel and the streaming update share it.
+    """
+    if count[j] > 0 and values[slot[j] - 1 if slot[j] > 0 else window - 1, j] == x:
+        same[j] += 1
+    else:
+        same[j] = 1
+    if count[j] >= window:
+        old = values[slot[j], j]
+        n = window - 1
+        if n == 0:
+            mean[j] = 0.
+            ssq[j] = 0.
+        else:
+            delta = old - mean[j]
+            mean[j] -= delta / n
+            ssq[j] -= delta * (old - mean[j])
+    else:
+        n = count[j]
+    values[slot[j], j] = x
+    count[j] += 1
+    slot[j] += 1
+    if slot[j] == window:
+        slot[j] = 0
+        # resync from the window every `window` values, the rounding of the updates does not build up
+        m = 0.
+        for k in range(window):
+            m += values[k, j]
+        m /= window
+        q = 0.
+        for k in range(window):
+            q += (values[k, j] - m) ** 2
+        mean[j] = m
+        ssq[j] = q
+    else:
+        delta = x - mean[j]
+        mean[j] += delta / (n + 1)
+        ssq[j] += delta * (x - mean[j])
+
+    if count[j] < window:
+        return np.nan
+    if std:
+        if window < 2:
+            return np.nan
+        if same[j] >= window:
+            return 0.
+        return np.sqrt(max(ssq[j], 0.) / (window - 1))
+    return x if same[j] >= window else mean[j]
+
+
+@jit(nopython=True, nogil=True, parallel=True)
+def _rolling_nan_moments(A, window, std, out):
+    """
+    Rolling mean (or std with ddof 1) over the last `window` non nan values of every column, nan rows stay nan.
+    Welford's update adds the new value and removes the one leaving the window, O(1) per row, the moments are
+    recomputed from the window once every `window` values.
+    """
+    n_rows, n_cols = A.shape
+    n_blocks = (n_cols + _COLUMN_BLOCK - 1) // _COLUMN_BLOCK
+    for b in prange(n_blocks):
+        c0 = b * _COLUMN_BLOCK
+        c1 = min(c0 + _COLUMN_BLOCK, n_cols)
+        # the last `window` non nan values of every column of the block
+        values = np.empty((window, c1 - c0))
+        count = np.zeros(c1 - c0, dtype=np.int64)
+        slot = np.zeros(c1 - c0, dtype=np.int64)
+        mean = np.zeros(c1 - c0)
+        ssq = np.zeros(c1 - c0)
+        # run of equal values, a constant window is exactly its value with std 0 like pandas
+        same = np.zeros(c1 - c0, dtype=np.int64)
+        for i in range(n_rows):
+            for j in range(c1 - c0):
+                x = np.float64(A[i, c0 + j])
+                if x != x:
+                    out[i, c0 + j] = np.nan
+                else:
+                    out[i, c0 + j] = _nan_moments_push(x, j, window, std, values, count, slot, mean, ssq, same)
+    return out
+
+
+def _rolling_nan_stat(A, window, std, out):
+    A = np.asarray(A)
+    if out is None:
+        out = np.empty(A.shape, dtype=np.result_type(A, np.float32))
+    # a single series is one column
+    _rolling_nan_moments(A.reshape(len(A), -1), int(window), std, out.reshape(len(out), -1))
+    return out
+
+
+def rolling_nanmean(A, window=None, out=None):
+    """
+    Rolling mean of every column over its last `window` non nan values, rows where A is nan stay nan.
+    The result takes the dtype of A (at least float32), or is written to out.
+    """
+    return _rolling_nan_stat(A, window, False, out)
+
+
+@jit(nopython=True, nogil=True, parallel=True)
+def _rolling_extremum(A, window, min_periods, is_max, arg, out):
+    """
+    Rolling max (or min) of every column over the last `window` rows, nan values are skipped and rows with fewer
+    than min_periods values in the window are nan. With arg the position of the extremum in the window is written,
+    0 for the oldest row and window - 1 for the current one, ties go to the oldest.
+
+    A monotonic deque of row indexes per column keeps the candidates, every row is pushed and popped at most once,
+    O(1) per row whatever the window.
+    """
+    n_rows, n_cols = A.shape
+    for j in prange(n_cols):
+        # the column is copied once, the deque is walked on contiguous memory
+        x = np.empty(n_rows)
+        for i in range(n_rows):
+            x[i] = A[i, j]
+        # deque[head:tail], values are decreasing for max and increasing for min
+        deque = np.empty(n_rows, dtype=np.int64)
+        head = 0
+        tail = 0
+        # non nan values in the window
+        valid = 0
+        for i in range(n_rows):
+            if tail > head and deque[head] <= i - window:
+                head += 1
+            if i >= window and x[i - window] == x[i - window]:
+                valid -= 1
+            v = x[i]
+            if v == v:
+                valid += 1
+                # drop the candidates the new value dominates, equal older values stay ahead
+                if is_max:
+                    while tail > head and x[deque[tail - 1]] < v:
+                        tail -= 1
+                else:
+                    while tail > head and x[deque[tail - 1]] > v:
+                        tail -= 1
+                deque[tail] = i
+                tail += 1
+            if valid < min_periods or tail == head:
+                out[i, j] = np.nan
+            elif arg:
+                out[i, j] = window - 1 - (i - deque[head])
             else:
-                factor_table[col][index] = current_factor[number]
-                number += 1
-    factor = factor_table.to_numpy(dtype=np.double)
-    return factor
-
-
-def rolling_max(A, window=None):
-    ret = pd.DataFrame(A)
-    factor = ret.rolling(window).max()
-    factor = factor.to_numpy(dtype=np.double)
-    return factor
-
-
-def rolling_nanstd(A, window=None):
-    ret = pd.DataFrame(A)
-    factor_table = copy.deepcopy(ret)
-    for col in ret.columns:
-        current_data = copy.deepcopy(ret[col])
-        current_data.dropna(inplace=True)
-        current_factor = current_data.rolling(window).std().values
-        number = 0
-        for index, data in enumerate(ret[col]):
-
-            if ret[col][index] != ret[col][index]:
-                factor_table[col][index] = np.nan
+                out[i, j] = x[deque[head]]
+    return out
+
+
+def _rolling_extremum_stat(A, window, min_periods, is_max, arg, out):
+    A = np.asarray(A)
+    if out is None:
+        out = np.empty(A.shape, dtype=np.result_type(A, np.float32))
+    window = int(window)
+    min_periods = window if min_periods is None else min(max(int(min_periods), 1), window)
+    _rolling_extremum(A.reshape(len(A), -1), window, min_periods, is_max, arg, out.reshape(len(out), -1))
+    return out
+
+
+def rolling_max(A, window=None, min_periods=None, out=None):
+    """
+    Rolling max of every column over the last `window` rows, nan values are skipped, rows with fewer than
+    min_periods (default window) values in the window are nan like pandas.
+    """
+    return _rolling_extremum_stat(A, window, min_periods, True, False, out)
+
+
+def rolling_min(A, window=None, min_periods=None, out=None):
+    """rolling min of every column, see rolling_max"""
+    return _rolling_extremum_stat(A, window, min_periods, False, False, out)
+
+
+def rolling_argmax(A, window=None, min_periods=None, out=None):
+    """
+    Position of the rolling max in its window, 0 for the oldest row and window - 1 for the current one,
+    ties go to the oldest row. See rolling_max for the nan handling.
+    """
+    return _rolling_extremum_stat(A, window, min_periods, True, True, out)
+
+
+def rolling_argmin(A, window=None, min_periods=None, out=None):
+    """position of the rolling min in its window, see rolling_argmax"""
+    return _rolling_extremum_stat(A, window, min_periods, False, True, out)
+
+
+def rolling_nanstd(A, window=None, out=None):
+    """
+    Rolling std (ddof 1) of every column over its last `window` non nan values, rows where A is nan stay nan.
+    The result takes the dtype of A (at least float32), or is written to out.
+    """
+    return _rolling_nan_stat(A, window, True, out)
+
+
+@jit(nopython=True, nogil=True, inline="always")
+def _bisect(a, n, v):
+    """first index of a[:n] (increasing) with a value not below v"""
+    lo = 0
+    hi = n
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if a[mid] < v:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+@jit(nopython=True, nogil=True, parallel=True)
+def _rolling_order_stat(A, window, min_periods, rank, q, out):
+    """
+    Rolling percentile rank of the current value (or q quantile) of every column over the last `window` rows, nan
+    values are skipped and rows with fewer than min_periods values in the window are nan, the rank of a nan is nan.
+    The rank is the average rank of its ties divided by the values in the window, in (0, 1] like pandas
+    rolling rank(pct=True), the quantile interpolates linearly like pandas rolling quantile.
+
+    The values of the window are kept sorted, the row leaving the window is found by bisection and the new value
+    takes its slot, O(log window) comparisons per row plus a shift of the sorted values between the two.
+    """
+    n_rows, n_cols = A.shape
+    for j in prange(n_cols):
+        # the column is copied once, the window is bisected on contiguous memory
+        x = np.empty(n_rows)
+        for i in range(n_rows):
+            x[i] = A[i, j]
+        # the non nan values of the window, sorted[:n] is increasing
+        sorted_ = np.empty(window)
+        n = 0
+        # position of the current value in sorted_
+        k = 0
+        for i in range(n_rows):
+            old = x[i - window] if i >= window else np.nan
+            v = x[i]
+            if old == old and v == v:
+                # the new value takes the slot of the old one and moves to its place, only the values between
+                # the two are shifted
+                k = _bisect(sorted_, n, old)
+                if v > old:
+                    while k + 1 < n and sorted_[k + 1] < v:
+                        sorted_[k] = sorted_[k + 1]
+                        k += 1
+                else:
+                    while k > 0 and sorted_[k - 1] > v:
+                        sorted_[k] = sorted_[k - 1]
+                        k -= 1
+                sorted_[k] = v
+            elif old == old:
+                k = _bisect(sorted_, n, old)
+                for m in range(k, n - 1):
+                    sorted_[m] = sorted_[m + 1]
+                n -= 1
+            elif v == v:
+                k = _bisect(sorted_, n, v)
+                for m in range(n, k, -1):
+                    sorted_[m] = sorted_[m - 1]
+                sorted_[k] = v
+                n += 1
+            if n < min_periods or n == 0:
+                out[i, j] = np.nan
+            elif rank:
+                if v != v:
+                    out[i, j] = np.nan
+                else:
+                    # v is at k, its ties around it, it takes ranks lo + 1 to hi
+                    lo = k
+                    while lo > 0 and sorted_[lo - 1] == v:
+                        lo -= 1
+                    hi = k + 1
+                    while hi < n and sorted_[hi] == v:
+                        hi += 1
+                    out[i, j] = (lo + hi + 1) / 2 / n
             else:
-                factor_table[col][index] = current_factor[number]
-                number += 1
-    factor = factor_table.to_numpy(dtype=np.double)
-    return factor
+                position = q * (n - 1)
+                lo = int(np.floor(position))
+                if lo + 1 < n:
+                    out[i, j] = sorted_[lo] + (sorted_[lo + 1] - sorted_[lo]) * (position - lo)
+                else:
+                    out[i, j] = sorted_[lo]
+    return out
+
+
+def _rolling_order_stat_2d(A, window, min_periods, rank, q, out):
+    A = np.asarray(A)
+    if out is None:
+        out = np.empty(A.shape, dtype=np.result_type(A, np.float32))
+    window = int(window)
+    min_periods = window if min_periods is None else min(max(int(min_periods), 1), window)
+    _rolling_order_stat(A.reshape(len(A), -1), window, min_periods, rank, float(q), out.reshape(len(out), -1))
+    return out
+
+
+def rolling_rank(A, window=None, min_periods=None, out=None):
+    """
+    Percentile rank of every value among the last `window` values of its column, in (0, 1] with ties at their
+    average rank. Nan values are skipped, rows with fewer than min_periods (default window) values in the window
+    and nan values are nan like pandas rolling rank(pct=True).
+    """
+    return _rolling_order_stat_2d(A, window, min_periods, True, 0., out)
+
+
+def rolling_quantile(A, window=None, q=0.5, min_periods=None, out=None):
+    """
+    Rolling q quantile of every column over the last `window` rows with linear interpolation, nan values are
+    skipped, rows with fewer than min_periods (default window) values in the window are nan like pandas.
+    """
+    return _rolling_order_stat_2d(A, window, min_periods, False, q, out)
+
+
+@jit(nopython=True, nogil=True, inline="always")
+def _valid_order(row):
+    """indexes of the non nan values of row, sorted by value with equal values in row order"""
+    n = 0
+    idx = np.empty(len(row), dtype=np.int64)
+    for j in range(len(row)):
+        if row[j] == row[j]:
+            idx[n] = j
+            n += 1
+    idx = idx[:n]
+    values = np.empty(n)
+    for k in range(n):
+        values[k] = row[idx[k]]
+    return idx[np.argsort(values, kind='mergesort')]
+
+
+@jit(nopython=True, nogil=True, parallel=True)
+def _cs_rank(A, n_buckets, out):
+    """
+    Percentile rank of every non nan value in its row, ties take their average rank, in (0, 1] like pandas
+    rank(pct=True). With n_buckets > 0 the quantile bucket of the value is written instead, 0 for the lowest
+    n / n_buckets values and n_buckets - 1 for the highest, ties share a bucket. Nan values stay nan.
+    """
+    n_rows, n_cols = A.shape
+    for i in prange(n_rows):
+        order = _valid_order(A[i])
+        n = len(order)
+        for j in range(n_cols):
+            if A[i, j] != A[i, j]:
+                out[i, j] = np.nan
+        k = 0
+        while k < n:
+            # order[k:e] is a run of equal values, ranks k + 1 to e
+            e = k + 1
+            while e < n and A[i, order[e]] == A[i, order[k]]:
+                e += 1
+            rank = (k + e + 1) / 2
+            if n_buckets > 0:
+                value = np.floor((rank - 1) * n_buckets / n)
+            else:
+                value = rank / n
+            for m in range(k, e):
+                out[i, order[m]] = value
+            k = e
+    return out
+
+
+@jit(nopython=True, nogil=True, parallel=True)
+def _cs_moments(A, scale, out):
+    """
+    Every value of a row minus the mean of its non nan values, divided by their std (ddof 0, at least 1e-8) with
+    scale. Nan values and all nan rows stay nan.
+    """
+    n_rows, n_cols = A.shape
+    for i in prange(n_rows):
+        n = 0
+        s = 0.
+        for j in range(n_cols):
+            x = np.float64(A[i, j])
+            if x == x:
+                s += x
+                n += 1
+        mean = s / n if n > 0 else np.nan
+        std = 1.
+        if scale and n > 0:
+            q = 0.
+            for j in range(n_cols):
+                x = np.float64(A[i, j])
+                if x == x:
+                    q += (x - mean) ** 2
+            std = max(np.sqrt(q / n), 10e-9)
+        for j in range(n_cols):
+            out[i, j] = (A[i, j] - mean) / std
+    return out
+
+
+@jit(nopython=True, nogil=True, parallel=True)
+def _cs_nanquantile(A, q, out):
+    """q quantile of the non nan values of every row, linear interpolation like np.nanquantile"""
+    n_rows = A.shape[0]
+    for i in prange(n_rows):
+        order = _valid_order(A[i])
+        n = len(order)
+        if n == 0:
+            out[i] = np.nan
+            continue
+        position = q * (n - 1)
+        lo = int(np.floor(position))
+        hi = min(lo + 1, n - 1)
+        frac = position - lo
+        a = np.float64(A[i, order[lo]])
+        b = np.float64(A[i, order[hi]])
+        # the two sided lerp of numpy, exact at both ends
+        if frac >= 0.5:
+            out[i] = b - (b - a) * (1 - frac)
+        else:
+            out[i] = a + (b - a) * frac
+    return out
+
+
+@jit(nopython=True, nogil=True, parallel=True)
+def _cs_corr(X, Y, out):
+    """pearson correlation of every row of X with the same row of Y, nan for rows with a nan or a constant side"""
+    n_rows, n_cols = X.shape
+    for i in prange(n_rows):
+        sx = 0.
+        sy = 0.
+        valid = True
+        # a constant side is found on the values, its deviations from the mean may not round to 0
+        x_const = True
+        y_const = True
+        for j in range(n_cols):
+            x = np.float64(X[i, j])
+            y = np.float64(Y[i, j])
+            if x != x or y != y:
+                valid = False
+                break
+            x_const = x_const and x == X[i, 0]
+            y_const = y_const and y == Y[i, 0]
+            sx += x
+            sy += y
+        if not valid or n_cols < 2 or x_const or y_const:
+            out[i] = np.nan
+            continue
+        mx = sx / n_cols
+        my = sy / n_cols
+        sxy = 0.
+        sxx = 0.
+        syy = 0.
+        for j in range(n_cols):
+            dx = X[i, j] - mx
+            dy = Y[i, j] - my
+            sxy += dx * dy
+            sxx += dx * dx
+            syy += dy * dy
+        out[i] = sxy / np.sqrt(sxx * syy)
+    return out
+
+
+def _cross_sections(A, out):
+    """A as (n_ts, n_symbols), a single series is one cross section, and out of its shape and dtype"""
+    A = np.asarray(A)
+    if out is None:
+        out = np.empty(A.shape, dtype=np.result_type(A, np.float32))
+    return A.reshape(-1, A.shape[-1]), out
+
+
+def cs_rank(A, out=None):
+    """
+    Percentile rank of every value among the non nan values of its row (the symbols of one bar), in (0, 1],
+    ties take their average rank. Nan values stay nan, the result takes the dtype of A (at least float32).
+    """
+    rows, out = _cross_sections(A, out)
+    _cs_rank(rows, 0, out.reshape(rows.shape))
+    return out
+
+
+def cs_quantile(A, n_buckets, out=None):
+    """
+    Quantile bucket of every value in its row, 0 to n_buckets - 1 from the lowest to the highest values with about
+    n / n_buckets values per bucket, equal values share a bucket. Nan values stay nan.
+    """
+    rows, out = _cross_sections(A, out)
+    _cs_rank(rows, max(int(n_buckets), 1), out.reshape(rows.shape))
+    return out
+
+
+def cs_zscore(A, out=None):
+    """
+    Every value minus the mean of the non nan values of its row, divided by their std (ddof 0, floored at 1e-8)
+    like calc_zscore_cross_section. Nan values stay nan.
+    """
+    rows, out = _cross_sections(A, out)
+    _cs_moments(rows, True, out.reshape(rows.shape))
+    return out
+
+
+def cs_demean(A, out=None):
+    """every value minus the mean of the non nan values of its row, nan values stay nan"""
+    rows, out = _cross_sections(A, out)
+    _cs_moments(rows, False, out.reshape(rows.shape))
+    return out
+
+
+def cs_nanquantile(A, q):
+    """q quantile of the non nan values of every row of A, (n_ts,) like np.nanquantile(A, q, axis=1)"""
+    rows = np.asarray(A).reshape(-1, np.shape(A)[-1])
+    return _cs_nanquantile(rows, float(q), np.empty(len(rows)))
+
+
+def cs_corr(X, Y):
+    """
+    Pearson correlation of every row of X with the same row of Y, (n_ts,). Rows with a nan in X or Y, or a
+    constant X or Y, are nan like np.corrcoef, cs_corr(cs_rank(X), cs_rank(Y)) is the spearman correlation.
+    """
+    X = np.asarray(X)
+    Y = np.asarray(Y)
+    X = X.reshape(-1, X.shape[-1])
+    return _cs_corr(X, Y.reshape(X.shape), np.empty(len(X)))
+
 
 def cal_rolling_ic(y_pred, y, rolling_window):
     with np.errstate(divide='ignore', invalid='ignore'):
-        no_future_beta = []
-        for i in range(len(y_pred)):
-            no_future_beta.append(spearmanr(y_pred[i], y[i])[0])
+        no_future_beta = cs_corr(cs_rank(y_pred, out=np.empty(np.shape(y_pred))), cs_rank(y, out=np.empty(np.shape(y))))
         no_future_beta = pd.Series(no_future_beta).shift(1).fillna(0)
         no_future_beta_rolling = no_future_beta.rolling(rolling_window).mean()
         weighted_factor_table = y_pred * no_future_beta_rolling
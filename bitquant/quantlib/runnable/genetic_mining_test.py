@@ -4,12 +4,15 @@ from pathlib import Path
 from datetime import datetime
 from bitquant.data.exchange import BinanceExchange
 from bitquant.data.data_client import DataClient
+from bitquant.data.market_panel import MarketPanel
 from bitquant.quantlib.factor_mining.genetic_programming.genetic import SymbolicTransformer
 from bitquant.quantlib.functions.functions import *
-from bitquant.quantlib.functions.functions import _function_map
+from bitquant.quantlib.functions.functions import _native_function_map
 from bitquant.quantlib.factor_mining.genetic_programming.utils import make_XY
 
 def preprocess_data(bar, st="2023-06-01", et="2025-01-01"):
+    if isinstance(bar, MarketPanel):
+        return preprocess_panel(bar, st, et)
     bar = bar.loc[(bar.index.get_level_values(0) > pd.to_datetime(st, utc=True)) & (bar.index.get_level_values(0) <= pd.to_datetime(et, utc=True))]
     bar['return_1'] = (bar['close'].unstack().diff(1).shift(-1) / bar['close'].unstack()).stack()
     bar = bar.unstack().iloc[:-1].stack()
@@ -23,6 +26,16 @@ def preprocess_data(bar, st="2023-06-01", et="2025-01-01"):
     bar = bar.loc[(slice(None), symbol_lis), :]
     return bar
 
+def preprocess_panel(panel, st="2023-06-01", et="2025-01-01"):
+    """same as preprocess_data, the complete symbols are looked up in the validity of the panel"""
+    panel = panel.slice_time(pd.to_datetime(st, utc=True) + pd.Timedelta(milliseconds=1), pd.to_datetime(et, utc=True))
+    # return_1 of a row needs the close of the next one, every row of the slice has to hold a bar
+    symbol_lis = panel.complete_symbols()
+    missing_symbol = [symbol for symbol in panel.symbols if symbol not in symbol_lis]
+    if len(missing_symbol) != 0:
+        print('There are uncompleted data in these symbols: ', missing_symbol)
+    return panel.select_symbols(symbol_lis).iloc_time(slice(0, max(len(panel) - 1, 0)))
+
 if __name__ == "__main__":
 
 
@@ -31,15 +44,20 @@ if __name__ == "__main__":
     st = "2024-01-01 00:00:00"
     et = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
     data_client = DataClient(BinanceExchange)
-    symbol_info, data = data_client.run(symbol_lis, interval, st, et)
+    symbol_info, data = data_client.run(symbol_lis, interval, st, et, as_panel=True)
+    data = preprocess_data(data, st, et)
+    # every joblib worker of fit_3D maps this file instead of receiving its own copy of X
+    data.save("~/.bitquant/panels/genetic_mining_test.bin")
+    data = MarketPanel.open("~/.bitquant/panels/genetic_mining_test.bin")
 
     different_axis = ['ts', 'symbol', 'return_1']
     X, Y, feature_names = make_XY(data, *different_axis)
-    sample_weight = [1] * X.shape[0]
-    sample_weight = np.array(sample_weight)
+    # rows without a cross section of at least two symbols are masked out of the fitness
+    sample_weight = data.validity.rows_with_bars(min_symbols=2).astype(np.int64)
     max_samples = X.shape[0]
     init_function_set = []
-    function_set = list(_function_map.values())
+    # same primitives and names as _function_map, the indicators of indicators.py run in numba instead of talib
+    function_set = list(_native_function_map.values())
 
     gp_transformer = SymbolicTransformer(generations=10,
                                         population_size=2000,
@@ -1,8 +1,10 @@
 from datetime import datetime
+import numpy as np
 import pandas as pd
 
 from bitquant.data.data_client import DataClient
-from bitquant.data.exchange import BinanceExchange
+from bitquant.data.exchange import BinanceExchange, BybitExchange
+from bitquant.data.kline_store import KlineStore
 from bitquant.quantlib.functions.functions import *
 from bitquant.quantlib.strategy_engine import StrategyEngine
 from bitquant.quantlib.signal_generation.factor_calculator import FactorCalculator, function_map
@@ -19,13 +21,18 @@ filterwarnings("ignore")
 
 def miner():
     portfolio_record_lis = []
+    # the store keeps the history on disk, every later cycle only requests the new bars
+    kline_store = KlineStore("~/.bitquant/klines")
+    symbols = ["ETHUSDT", "BTCUSDT", "BNBUSDT", "SOLUSDT"]
+    interval = "1h"
+    st = "2024-03-01 00:00:00"
+    et = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    # the latest bars are hedged on Bybit, a slow Binance near the bar close does not delay the submission
+    data_client = DataClient(BinanceExchange, store=kline_store, secondaries=[BybitExchange], hedge_after=2.0)
+    symbol_info, data = data_client.run(symbols, interval, st, et, as_panel=True)
     for _ in range(3):
-        symbols = ["ETHUSDT", "BTCUSDT", "BNBUSDT", "SOLUSDT"]
-        interval = "1h"
-        st = "2024-03-01 00:00:00"
-        et = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        data_client = DataClient(BinanceExchange)
-        symbol_info, data = data_client.run(symbols, interval, st, et)
+        # only the bars that closed since the last cycle are requested and appended in place
+        data_client.update(data)
 
         factor_lis = ["ts_midpoint(ts_natr(high,low,close,7),14)", "ts_delta(dynamic_ts_max(ts_bbands(close,20),28),7)",
                       "ts_midpoint(ts_ht_trendmode(close),21)"]
@@ -51,35 +58,29 @@ def miner():
 def validator(portfolio_record_lis):
     interval = "1m"
 
-    flg = len(portfolio_record_lis) - 1
-    portfolio_weight_container = []
-    ts_ms_container = []
-    for portfolio_record in portfolio_record_lis:
-        # construct portfolio weight history
-        portfolio_weight_container.append(portfolio_record.portfolio)
-        # fake timestamp for test
-        ts_ms_container.append(
-            TimeUtils.now_in_ms() - flg * TimeUtils.interval_str_to_ms("30m") - 2 * TimeUtils.interval_str_to_ms(
-                interval))
-        flg -= 1
+    # construct portfolio weight history
+    portfolio_weight_container = [portfolio_record.portfolio for portfolio_record in portfolio_record_lis]
+    # fake timestamps for test, one portfolio every 30m up to 2 bars ago
+    flg = np.arange(len(portfolio_record_lis))[::-1]
+    ts_ms_container = TimeUtils.now_in_ms() - flg * TimeUtils.interval_str_to_ms("30m") - 2 * TimeUtils.interval_str_to_ms(interval)
 
     # retrive the 1 minute kline data for validation
-    ts_lis = [pd.to_datetime(ts_ms, unit="ms", utc=True).ceil("1min") for ts_ms in ts_ms_container]
+    ts_ms_container = TimeUtils.ceil_ms(ts_ms_container, "1m")
+    ts_lis = pd.to_datetime(ts_ms_container, unit="ms", utc=True)
     portfolio_weight_df = pd.DataFrame(portfolio_weight_container, index=ts_lis)
     symbols = portfolio_weight_df.columns.tolist()
 
     st = TimeUtils.timestamp_to_dt_str(ts_lis[0], "%Y-%m-%d %H:%M:%S")
     et = TimeUtils.timestamp_to_dt_str(ts_lis[-1] + TimeUtils.str_to_timedelta(interval), "%Y-%m-%d %H:%M:%S")
 
-    data_client = DataClient(BinanceExchange)
-    symbol_info, data = data_client.run(symbols=symbols, interval=interval, st=st, et=et)
+    # the prices are evaluated themselves, every validator has to get the same profit ratio
+    with DataClient(BinanceExchange, dtype=np.float64) as data_client:
+        symbol_info, data = data_client.run(symbols=symbols, interval=interval, st=st, et=et, as_panel=True)
 
     # prepare data for evaluation
     portfolio_weight_matrix = portfolio_weight_df.to_numpy()
-    price_matrix = data.loc[
-        ([ts + TimeUtils.str_to_timedelta(interval) for ts in ts_lis], symbols), ["open", "low", "high", "close",
-                                                                       "vwap"]].values.reshape(len(ts_lis),
-                                                                                               len(symbols), 5)
+    positions = data.time_positions(ts_ms_container + TimeUtils.interval_str_to_ms(interval))
+    price_matrix = data.select_symbols(symbols).iloc_time(positions)
 
     volume_precision = symbol_info.set_index("symbol").loc[symbols, "volume_precision"].values
     min_notional = symbol_info.set_index("symbol").loc[symbols, "notional"].values
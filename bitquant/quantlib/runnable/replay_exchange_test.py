@@ -0,0 +1,23 @@
+import time
+from bitquant.data.data_client import DataClient
+from bitquant.data.replay_exchange import ReplayExchange, ReplayServer, SyntheticKlines
+
+
+if __name__ == "__main__":
+    # offline fetcher benchmark, 50 synthetic symbols served with 50ms latency and the exchange's rate limit
+    symbol_lis = [f"SYM{i}USDT" for i in range(50)]
+    interval = "1h"
+    st = "2023-01-01 00:00:00"
+    et = "2024-01-01 00:00:00"
+    server = ReplayServer(source=SyntheticKlines(seed=0), symbols=symbol_lis, latency=0.05,
+                          limit_per_second=int(20000 / 60 / 5), error_rate=0.01)
+    exchange = ReplayExchange.using(server, over_http=True)
+    data_client = DataClient(exchange)
+
+    start = time.time()
+    symbol_info, panel = data_client.run(symbol_lis, interval, st, et, as_panel=True)
+    time_cost = time.time() - start
+
+    print(panel)
+    print(f"{server.stats} in {round(time_cost, 2)} seconds, {round(server.stats['requests'] / time_cost, 1)} requests per second")
+    server.stop_http()
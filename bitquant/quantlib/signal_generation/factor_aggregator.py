@@ -1,7 +1,8 @@
-from scipy.stats import spearmanr
 from numpy.linalg import inv, det
 import numpy as np
+from typing import Optional
 import pandas as pd
+from bitquant.quantlib.functions.utils import cs_rank, cs_corr
 
 
 class FactorAggregatorIC:
@@ -18,6 +19,16 @@ class FactorAggregatorIC:
         """IC Aggregator doesn't need any pretrain"""
         pass
 
+    def lookback(self, lookback: int = 0) -> Optional[int]:
+        """
+        bars before the first score of scaled factors with `lookback` bars before their first value, a score weights
+        the ic of the training_window rows before it. None for rolling_type 'ewm', the ewm of the ic depends on every
+        row before the score, the score needs the whole history.
+        """
+        if self.rolling_type == 'ewm':
+            return None
+        return lookback + self.training_window
+
     def predict(self, scaled_factor_df, target):
         factor_ic_df = self.average_IC_combination(scaled_factor_df=scaled_factor_df, target=target, ic_type=self.ic_type)
         score_df = self.calculate_score(scaled_factor_df=scaled_factor_df, factor_ic_df=factor_ic_df,
@@ -34,20 +45,21 @@ class FactorAggregatorIC:
         m = len(symbol_lis)
         k = len(factor_lis)
 
-        self.factor_ic_df = pd.DataFrame(index=time_idx_lis, columns=factor_lis)
         X_array = np.asarray(scaled_factor_df).reshape(n, m, k).astype(np.float32)
         y_array = np.asarray(target).reshape(n, m).astype(np.float32)
 
-        for i in range(n):
-            X = X_array[i]
-            y = y_array[i]
-            ic_lis = []
+        # the ic of every bar at once, a bar with a nan factor or target value has a nan ic
+        ic = np.full((n, k), np.nan)
+        if ic_type == 'spearmanr':
+            # float64 ranks, float32 percentiles of the ranks would round the ic
+            y_rank = cs_rank(y_array, out=np.empty((n, m)))
+            x_rank = np.empty((n, m))
+            for j in range(k):
+                ic[:, j] = cs_corr(cs_rank(X_array[:, :, j], out=x_rank), y_rank)
+        elif ic_type == 'pearson':
             for j in range(k):
-                if ic_type == 'spearmanr':
-                    ic_lis.append(spearmanr(X[:, j], y)[0])
-                elif ic_type == 'pearson':
-                    ic_lis.append(np.corrcoef(X[:, j], y)[0][1])
-            self.factor_ic_df.iloc[i] = ic_lis
+                ic[:, j] = cs_corr(X_array[:, :, j], y_array)
+        self.factor_ic_df = pd.DataFrame(ic, index=time_idx_lis, columns=factor_lis)
         return self.factor_ic_df
 
     def _simplecov_weight(self, x):
@@ -1,40 +1,197 @@
 from bitquant.quantlib.functions.functions import _function_map as function_map
 from bitquant.quantlib.functions.functions import *
+from bitquant.quantlib.functions.functions import BufferPool
+from bitquant.quantlib.functions.streaming import make_stream
 from bitquant.quantlib.factor_mining.genetic_programming.utils import make_XY
+from bitquant.data.market_panel import MarketPanel
+import functools
+import numpy as np
 import pandas as pd
 import re
 
 # TODO: what is wrong with this?
 # global function_map
 
+class _FeatureNode:
+
+    def __init__(self, name):
+        self.name = name
+        self.lookback = 0
+
+    def init(self, X, feature_names):
+        self.index = list(feature_names).index(self.name)
+        return X[:, self.index, :]
+
+    def update(self, x):
+        return x[self.index]
+
+
+class _ConstantNode:
+
+    def __init__(self, value):
+        self.value = value
+        self.lookback = 0
+
+    def init(self, X, feature_names):
+        self.dtype = X.dtype
+        return np.full((X.shape[0], X.shape[2]), self.value, dtype=X.dtype)
+
+    def update(self, x):
+        return np.full(x.shape[1], self.value, dtype=self.dtype)
+
+
+class _FunctionNode:
+    """a function of its child nodes, the int arguments are the parameters of its stream"""
+
+    def __init__(self, function, args):
+        self.children = [_ConstantNode(arg) if isinstance(arg, float) else arg for arg in args
+                         if not isinstance(arg, int)]
+        params = [arg for arg in args if isinstance(arg, int)]
+        # the default parameter of _Function.__call__
+        if function.isRandom and function.baseConst > 0 and not (len(args) > 1 and isinstance(args[-1], int)):
+            params.append(function.baseConst)
+        self.stream = make_stream(function, params)
+        # bars before the first valid value along the longest path to a feature
+        self.lookback = function.lookback(*params) + max([child.lookback for child in self.children], default=0)
+
+    def init(self, X, feature_names):
+        values = [child.init(X, feature_names) for child in self.children]
+        value = self.stream.batch(*values)
+        self.dtype = value.dtype
+        self.state = self.stream.init(*values)
+        return value
+
+    def update(self, x):
+        value = self.stream.update(self.state, *[child.update(x) for child in self.children])
+        return np.asarray(value, dtype=self.dtype)
+
+
+class _FormulationNames(dict):
+    """names of a formulation for eval, the functions of the function map, any other name is a feature"""
+
+    def __missing__(self, name):
+        return _FeatureNode(name)
+
+
+class FactorStream:
+    """
+    A factor formulation evaluated bar by bar, every node keeps the stream of its function (see
+    functions/streaming.py), so the factor of a new bar costs O(n_symbols x formulation size) whatever the history.
+    lookback is the number of bars before its first valid value, the sum of the _Function.lookback of the nodes
+    along the longest path.
+
+    usage:
+        stream = FactorStream("ts_midpoint(ts_natr(high,low,close,7),14)", function_map)
+        stream.lookback             # 20, natr(7) is valid from the 8th bar and midpoint(14) needs 13 bars before
+        values = stream.init(X, feature_names)  # X (n_ts, n_feature, n_symbols), same as evaluate_formulation
+        value = stream.update(x)    # x (n_feature, n_symbols) of the next bar, the value (n_symbols,) of that bar
+    """
+
+    def __init__(self, formulation, function_map):
+        self.formulation = formulation
+        names = _FormulationNames({name: lambda *args, function=function: _FunctionNode(function, args)
+                                   for name, function in function_map.items()})
+        self.root = eval(formulation, {"__builtins__": {}}, names)
+        self.lookback = self.root.lookback
+
+    def init(self, X, feature_names):
+        return self.root.init(X, feature_names)
+
+    def update(self, x):
+        return self.root.update(x)
+
+
 class FactorCalculator:
 
-    def __init__(self, function_map: dict, different_axis: list = ['ts', 'symbol', 'return_1']):
+    def __init__(self, function_map: dict, different_axis: list = ['ts', 'symbol', 'return_1'],
+                 incremental: bool = False):
+        """
+        incremental: keep a FactorStream per factor between calls on the same MarketPanel, e.g. a panel updated
+            by DataClient.update at every bar close, so only the new rows are computed
+        """
 
         self.function_map = function_map
         self.different_axis = different_axis
+        self.incremental = incremental
+        self._streams = None
+        self._factor_panel = None
+        self._key = None
 
 
+    def lookback(self, factor_lis: list) -> int:
+        """bars before the first bar where every factor of factor_lis has a value"""
+        return max([FactorStream(factor, self.function_map).lookback for factor in factor_lis], default=0)
+
     def calculate_factor(self, data, factor_lis: list):
+        if isinstance(data, MarketPanel):
+            return self.calculate_factor_panel(data, factor_lis)
         factor_df = pd.DataFrame(index=data.index, columns=factor_lis)
         for factor in factor_lis:
             factor_df[factor] = self.calculate_factor_based_on_formulation(data=data, factor=factor, different_axis=self.different_axis, function_map=self.function_map)
         return factor_df
 
 
+    def calculate_factor_panel(self, data: MarketPanel, factor_lis: list) -> MarketPanel:
+        """Factors of a MarketPanel as a MarketPanel with one field per factor, the features are read as views"""
+        X, Y, feature_names = make_XY(data, *self.different_axis)
+        if self.incremental:
+            return self._update_factor_panel(data, X, feature_names, factor_lis)
+        values = np.empty(shape=(len(data.ts_in_ms), len(data.symbols), len(factor_lis)), dtype=data.dtype)
+        for k, factor in enumerate(factor_lis):
+            values[:, :, k] = self.evaluate_formulation(X, feature_names, factor, self.function_map)
+        return MarketPanel(values, data.ts_in_ms, data.symbols, factor_lis)
+
+    def _update_factor_panel(self, data: MarketPanel, X, feature_names, factor_lis: list) -> MarketPanel:
+        """
+        Factors of the rows appended to data since the last call from the streams of the factors.
+        The rows already computed have to be unchanged, they are compared from the oldest last bar of the symbols
+        on (the bars that may still be replaced, e.g. a forming bar). Another panel, other factors or a changed row
+        start the streams again from all rows.
+        """
+        factors = self._factor_panel
+        key = (list(factor_lis), list(data.symbols), list(feature_names), data.dtype)
+        n_done = 0 if factors is None else len(factors)
+        if (factors is None or self._key != key or n_done == 0 or len(data) < n_done
+                or data.ts_in_ms[0] != factors.ts_in_ms[0] or data.ts_in_ms[n_done - 1] != factors.ts_in_ms[-1]
+                or not np.array_equal(X[self._stable_row:n_done], self._stable_X, equal_nan=True)):
+            self._streams = [FactorStream(factor, self.function_map) for factor in factor_lis]
+            values = np.empty(shape=(len(data.ts_in_ms), len(data.symbols), len(factor_lis)), dtype=data.dtype)
+            for k, stream in enumerate(self._streams):
+                values[:, :, k] = stream.init(X, feature_names)
+            factors = MarketPanel(values, data.ts_in_ms.copy(), data.symbols, factor_lis)
+        else:
+            factors.append_time(data.ts_in_ms[n_done:])
+            for i in range(n_done, len(data)):
+                for k, stream in enumerate(self._streams):
+                    factors.values[i, :, k] = stream.update(X[i])
+        self._factor_panel, self._key = factors, key
+        self._stable_row = max(int(data.validity.last_valid.min(initial=len(data))), 0)
+        self._stable_X = X[self._stable_row:].copy()
+        return factors
+
     def calculate_factor_based_on_formulation(self, data, factor, different_axis, function_map):
 
         X, Y, feature_names = make_XY(data, *different_axis)
-        formulation = factor
+
+        ts_lis = pd.unique(data.index.get_level_values(0)).tolist()
+        symbol_lis = pd.unique(data.index.get_level_values(1)).tolist()
+
+        factor_df = pd.DataFrame(self.evaluate_formulation(X, feature_names, factor, function_map),
+                                 index=ts_lis, columns=symbol_lis).stack()
+
+        return factor_df
+
+    @staticmethod
+    def evaluate_formulation(X, feature_names, formulation, function_map):
+        """Evaluate a factor formulation on X of shape (n_ts, n_feature, n_symbols), return (n_ts, n_symbols)"""
 
         feature_dictionary = {}
         for index, feature in enumerate(feature_names):
             feature_dictionary[feature] = "X[:,{},:]".format(index)
 
-        ts_lis = pd.unique(data.index.get_level_values(0)).tolist()
-        symbol_lis = pd.unique(data.index.get_level_values(1)).tolist()
-
-        all_cal_dictionary = dict(list(function_map.items()))
+        # the intermediate results of the formulation are recycled through one pool
+        pool = BufferPool()
+        all_cal_dictionary = {name: functools.partial(pool.call, function) for name, function in function_map.items()}
 
         # Use regular expressions to find the number in the string
         if len(re.findall(r'-?\d+\.\d+', formulation)) > 0:
@@ -45,7 +202,7 @@ class FactorCalculator:
             new_string = formulation
             for number in numbers:
                 new_string = new_string.replace(number,
-                                                "np.tile({}, (X.shape[0], X.shape[2]))".format(
+                                                "np.broadcast_to(X.dtype.type({}), (X.shape[0], X.shape[2]))".format(
                                                     number))
             formulation = new_string
         for feature, feature_input in feature_dictionary.items():
@@ -56,6 +213,4 @@ class FactorCalculator:
                                  "all_cal_dictionary['{}']".format(function_name),
                                  formulation)
 
-        factor_df = pd.DataFrame(eval(formulation), index=ts_lis, columns=symbol_lis).stack()
-
-        return factor_df
\ No newline at end of file
+        return eval(formulation)
\ No newline at end of file
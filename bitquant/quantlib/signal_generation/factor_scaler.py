@@ -1,7 +1,9 @@
 import numpy as np
 import pandas as pd
 from copy import deepcopy
-from bitquant.quantlib.signal_generation.utlis import calc_zscore_2d, calc_zscore_cross_section
+from bitquant.quantlib.signal_generation.utlis import calc_zscore_2d
+from bitquant.quantlib.functions.utils import cs_zscore
+from bitquant.data.market_panel import MarketPanel, ffill
 
 class FactorScaler:
 
@@ -19,7 +21,19 @@ class FactorScaler:
         self.ts_normalize = ts_normalize
         self.cross_section_normalize = cross_section_normalize
 
+    def lookback(self, lookback: int = 0) -> int:
+        """
+        bars before the first scaled row of factors with `lookback` bars before their first value, the time series
+        normalization needs scaling_window valid rows and passes the first scaling_window rows through unscaled
+        """
+        if not self.ts_normalize:
+            return lookback
+        return max(lookback + self.scaling_window - 1, self.scaling_window)
+
     def scale_data(self, factor_df, factor_lis):
+        if isinstance(factor_df, MarketPanel):
+            self.scaled_factor_df = self.scale_panel(factor_df, factor_lis)
+            return self.scaled_factor_df
         self.scaled_factor_df = deepcopy(factor_df)
         if self.ts_normalize:
             self.scaled_factor_df = self.process_ts_normalize(data=self.scaled_factor_df,
@@ -34,6 +48,35 @@ class FactorScaler:
                                               orthogonal_method=self.orthogonal_method)
         return self.scaled_factor_df
 
+    def scale_panel(self, factor_panel: MarketPanel, factor_lis):
+        """Same steps as on the DataFrame, on one copy of the factor panel that is scaled in place"""
+        values = factor_panel.values.copy()
+        factor_idx = [factor_panel.fields.index(factor) for factor in factor_lis]
+        if self.ts_normalize:
+            for k in factor_idx:
+                values[:, :, k] = calc_zscore_2d(values[:, :, k], self.scaling_window)
+            values = values[self.scaling_window - 1:]
+            # the validity of the factor panel is sliced with its rows instead of rescanned
+            factor_panel = factor_panel.iloc_time(slice(self.scaling_window - 1, None))
+            self.fill_exposure(values, factor_idx)
+        if self.cross_section_normalize:
+            for k in factor_idx:
+                values[:, :, k] = cs_zscore(values[:, :, k])
+            self.fill_exposure(values, factor_idx)
+        if self.orthogonalize:
+            for i in range(len(values)):
+                factors_df = pd.DataFrame(values[i][:, factor_idx], index=factor_panel.symbols, columns=factor_lis)
+                values[i][:, factor_idx] = Orthogonal.orthogonalize(factors_df, self.orthogonal_method).values
+        return factor_panel.with_values(values)
+
+    @staticmethod
+    def fill_exposure(values, factor_idx):
+        """ffill the exposure along time and fill the rest with 0, except for the rows where every factor is nan"""
+        exposure = ffill(values[:, :, factor_idx])
+        has_value = ~np.isnan(exposure).all(axis=(1, 2))
+        exposure[has_value] = np.nan_to_num(exposure[has_value], nan=0)
+        values[:, :, factor_idx] = exposure
+
     @classmethod
     def process_ts_normalize(cls, data, selected_factor_lis, rolling_window):
         cls.normalized_data = deepcopy(data)
@@ -55,7 +98,7 @@ class FactorScaler:
 
         for factor in selected_factor_lis:
             cls.normalized_data[factor] = pd.DataFrame(
-                calc_zscore_cross_section(cls.normalized_data[factor].unstack().values),
+                cs_zscore(cls.normalized_data[factor].unstack().values),
                 index=cls.normalized_data[factor].unstack().index,
                 columns=cls.normalized_data[factor].unstack().columns).stack()
         tmp_factor_exposure = cls.normalized_data.loc[:, selected_factor_lis].unstack().ffill(axis=0).dropna(
@@ -5,6 +5,7 @@ import pandas as pd
 from bitquant.utils.timeutils import TimeUtils
 from bitquant.data.data_client import DataClient
 from bitquant.data.exchange import BinanceExchange
+from bitquant.data.market_panel import MarketPanel, ffill
 from bitquant.quantlib.backtest.simulator import Simulator
 
 class StrategyEngine:
@@ -30,25 +31,53 @@ class StrategyEngine:
     def check_portfolio_output(self, portfolio_weight):
         pass
 
-    def get_score(self, data):
+    def lookback(self) -> int:
+        """
+        bars before the first score: the longest factor formulation, then the time series normalization of the
+        scaler and the training window of the aggregator. A score needs lookback() + 1 bars of history.
+        Raise ValueError for an aggregator whose score depends on the whole history, e.g. rolling_type 'ewm'.
+        """
+        factor_lookback = self.factor_calculator.lookback(self.init_factor_lis)
+        lookback = self.factor_aggregator.lookback(self.factor_scaler.lookback(factor_lookback))
+        if lookback is None:
+            raise ValueError(f"the scores of {type(self.factor_aggregator).__name__}"
+                             f"(rolling_type={self.factor_aggregator.rolling_type!r}) depend on every past bar, "
+                             f"they have no lookback, get a fixed range of bars instead")
+        return lookback
+
+    def get_score(self, data, n_rows: int = None):
+        """
+        data: (ts, symbol) MultiIndex DataFrame or MarketPanel
+        n_rows: only the last n_rows rows of the factors of a MarketPanel are scaled and aggregated, the selector
+            then also filters the correlated factors on these rows only, not on the whole history
+        """
 
         factor_df = self.factor_calculator.calculate_factor(data, self.init_factor_lis)
+        if n_rows is not None and isinstance(factor_df, MarketPanel):
+            factor_df = factor_df.iloc_time(slice(max(len(factor_df) - n_rows, 0), None))
         scaled_factor_df = self.factor_scaler.scale_data(factor_df, self.init_factor_lis)
+        if isinstance(scaled_factor_df, MarketPanel):
+            # the selector and the aggregator work on the (ts, symbol) frame of the scaled factors only
+            target = data.select_fields(['return_1']).slice_time(scaled_factor_df.ts_in_ms[0]).to_frame()['return_1']
+            scaled_factor_df = scaled_factor_df.to_frame()
+        else:
+            target = None
         filtered_factor_lis = self.factor_selector.filter_out_high_corr_factor(factor_df=scaled_factor_df, threshold=0.6,
                                                                           greater_is_better=False)
         scaled_factor_df = scaled_factor_df.loc[:, filtered_factor_lis]
-        target = data.loc[scaled_factor_df.index, 'return_1']
+        if target is None:
+            target = data.loc[scaled_factor_df.index, 'return_1']
         self.factor_aggregator.train()
         scores = self.factor_aggregator.predict(scaled_factor_df=scaled_factor_df, target=target)
         return scores
 
     def run_backtest(self, symbols, interval, st, et, init_cash, order_size, taker_fee, display=True, plot=True) -> pd.DataFrame:
-        # generate backtest data
-        data_client = DataClient(BinanceExchange)
-        symbol_info, data = data_client.run(symbols, interval, st, et)
+        # generate backtest data, float64 since the simulator evaluates the prices themselves
+        with DataClient(BinanceExchange, dtype=np.float64) as data_client:
+            symbol_info, panel = data_client.run(symbols, interval, st, et, as_panel=True)
 
         # calculate symbols score based on model
-        scores = self.get_score(data)
+        scores = self.get_score(panel)
         score_df = self.factor_aggregator.score_df.loc[:, symbols]
 
         # generate the portfolio history
@@ -69,26 +98,36 @@ class StrategyEngine:
         # generate the price history
         ts_lis = score_df.index.tolist()
 
-        price_matrix = data.unstack().shift(
-            -1).ffill().stack().loc[(ts_lis, symbols), ["open", "low", "high", "close", "vwap"]].values.reshape(
-            len(ts_lis), len(symbols), 5)
+        # the orders are filled at the next bar, prices and equity are simulated in float64
+        price_panel = panel.select_symbols(symbols).select_fields(["open", "low", "high", "close", "vwap"])
+        next_price = np.full_like(price_panel.values, np.nan, dtype=np.float64)
+        next_price[:-1] = price_panel.values[1:]
+        next_price = ffill(next_price)
 
-        price_matrix[-1, :, :] = data.loc[(ts_lis[-1], symbols), ["close", "close", "close", "close", "close"]].values
+        positions = panel.time_positions(ts_lis)
+        price_matrix = next_price[positions]
+        price_matrix[-1, :, :] = price_panel.field("close")[positions[-1]][:, None]
+        price_panel = MarketPanel(price_matrix, panel.ts_in_ms[positions], symbols, price_panel.fields, interval)
 
         # generate the volume precision and notional filter
         volume_precision = symbol_info.set_index("symbol").loc[symbols, "volume_precision"].values
         min_notional = symbol_info.set_index("symbol").loc[symbols, "notional"].values
 
         # backtest
-        simulator = Simulator(portfolio_weight_matrix, price_matrix, ts_lis, symbols, init_cash, order_size, taker_fee,
+        simulator = Simulator(portfolio_weight_matrix, price_panel, ts_lis, symbols, init_cash, order_size, taker_fee,
                  volume_precision, min_notional, display=display, plot=plot)
         simulator.start_loop()
         simulator.result_analysis()
 
 
     def run(self, data) -> Dict:
-        # Get scores series
-        scores = self.get_score(data)
+        # Get scores series, of a MarketPanel only the factor rows the last score needs are scaled and aggregated,
+        # so the factor selection also sees these rows only. An aggregator without lookback (ewm) gets every row.
+        n_rows = None
+        if isinstance(data, MarketPanel):
+            lookback = self.factor_aggregator.lookback(self.factor_scaler.lookback())
+            n_rows = None if lookback is None else lookback + 1
+        scores = self.get_score(data, n_rows=n_rows)
         # Construct hedge portfolio based on the scores we get from our multi-factor model
 
         # The most simple way is normalizing scores to have a sum of 0
@@ -1,4 +1,22 @@
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Sequence, Union
+import numpy as np
+import pandas as pd
+
+_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
+
+
+@lru_cache(maxsize=None)
+def _parse_interval(interval_str: str) -> timedelta:
+    """intervals are parsed once, they are converted for every request and every bar aggregation"""
+    value = int(interval_str[:-1])
+    unit = interval_str[-1]
+    if unit in _UNITS:
+        return timedelta(**{_UNITS[unit]: value})
+    else:
+        raise ValueError(f"Unknown time unit: {unit}")
+
 
 class TimeUtils:
 
@@ -25,33 +43,68 @@ class TimeUtils:
 
     @staticmethod
     def str_to_timedelta(interval_str: str) -> timedelta:
-        units = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
-        value = int(interval_str[:-1])
-        unit = interval_str[-1]
-        if unit in units:
-            return timedelta(**{units[unit]: value})
-        else:
-            raise ValueError(f"Unknown time unit: {unit}")
+        return _parse_interval(interval_str)
     @staticmethod
     def timedelta_to_ms(delta: timedelta) -> int:
         return int(delta.total_seconds() * 1000)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def interval_str_to_ms(interval_str: str) -> int:
         """
         args:
             4h, 10s, 5d
         """
-        units = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
-        value = int(interval_str[:-1])
-        unit = interval_str[-1]
-        if unit in units:
-            delta = timedelta(**{units[unit]: value})
-        else:
-            raise ValueError(f"Unknown time unit: {unit}")
-
-        return int(delta.total_seconds() * 1000)
+        return int(_parse_interval(interval_str).total_seconds() * 1000)
 
     @staticmethod
     def ms_to_timedelta(ms: int) -> timedelta:
         return timedelta(milliseconds=ms)
+
+    # ===== arrays of epoch ms =====
+
+    @staticmethod
+    def ms_to_datetime64(ms: Union[int, Sequence[int], np.ndarray]) -> np.ndarray:
+        """epoch ms to datetime64[ms] (utc, without timezone)"""
+        return np.asarray(ms, dtype=np.int64).astype("datetime64[ms]")
+
+    @staticmethod
+    def to_ms_array(ts: Union[Sequence, np.ndarray, pd.DatetimeIndex]) -> np.ndarray:
+        """timestamps (datetime, pd.Timestamp, datetime64 of any unit or ms) to int64 epoch ms, tz aware ones in utc"""
+        ts = pd.DatetimeIndex(ts) if not np.issubdtype(np.asarray(ts).dtype, np.integer) else np.asarray(ts)
+        if isinstance(ts, pd.DatetimeIndex):
+            if ts.tz is not None:
+                ts = ts.tz_convert("UTC").tz_localize(None)
+            return ts.to_numpy().astype("datetime64[ms]").astype(np.int64)
+        return ts.astype(np.int64)
+
+    @staticmethod
+    def dt_strs_to_ms(dt_strs: Sequence[str], format: str) -> np.ndarray:
+        """dt_str_to_ms of many strings in one call"""
+        return TimeUtils.to_ms_array(pd.to_datetime(pd.Index(dt_strs), format=format, utc=True))
+
+    @staticmethod
+    def floor_ms(ms: Union[int, np.ndarray], interval: Union[str, int]):
+        """
+        open time of the bar of interval the epoch ms fall in, bars are aligned to the epoch like the exchange's
+        args:
+            interval: "4h" or ms
+        """
+        interval_in_ms = TimeUtils.interval_str_to_ms(interval) if isinstance(interval, str) else int(interval)
+        if np.ndim(ms) == 0:
+            return int(ms) // interval_in_ms * interval_in_ms
+        return np.asarray(ms, dtype=np.int64) // interval_in_ms * interval_in_ms
+
+    @staticmethod
+    def ceil_ms(ms: Union[int, np.ndarray], interval: Union[str, int]):
+        """the smallest multiple of interval at or after the epoch ms, see floor_ms"""
+        interval_in_ms = TimeUtils.interval_str_to_ms(interval) if isinstance(interval, str) else int(interval)
+        if np.ndim(ms) == 0:
+            return -(-int(ms) // interval_in_ms) * interval_in_ms
+        return -(-np.asarray(ms, dtype=np.int64) // interval_in_ms) * interval_in_ms
+
+    @staticmethod
+    def interval_grid(st_in_ms: int, et_in_ms: int, interval: Union[str, int]) -> np.ndarray:
+        """int64 epoch ms of every multiple of interval in [st_in_ms, et_in_ms]"""
+        interval_in_ms = TimeUtils.interval_str_to_ms(interval) if isinstance(interval, str) else int(interval)
+        return np.arange(TimeUtils.ceil_ms(st_in_ms, interval_in_ms), et_in_ms + 1, interval_in_ms, dtype=np.int64)
@@ -25,12 +25,14 @@ import bittensor as bt
 import bitquant
 
 # bitquant module:
-# from bitquant.data.data_client import DataClient
-# from bitquant.quantlib.strategy_engine import StrategyEngine
-# from bitquant.quantlib.signal_generation.factor_calculator import FactorCalculator, function_map
-# from bitquant.quantlib.signal_generation.factor_selector import FactorSelector
-# from bitquant.quantlib.signal_generation.factor_scaler import FactorScaler
-# from bitquant.quantlib.signal_generation.factor_aggregator import FactorAggregatorIC
+from bitquant.data.bar_scheduler import BarScheduler
+from bitquant.data.data_client import DataClient
+from bitquant.data.exchange import BinanceExchange, BybitExchange
+from bitquant.quantlib.strategy_engine import StrategyEngine
+from bitquant.quantlib.signal_generation.factor_calculator import FactorCalculator, function_map
+from bitquant.quantlib.signal_generation.factor_selector import FactorSelector
+from bitquant.quantlib.signal_generation.factor_scaler import FactorScaler
+from bitquant.quantlib.signal_generation.factor_aggregator import FactorAggregatorIC
 
 # import miner class which takes care of most of the boilerplate
 from bitquant.base.protocol import PortfolioRecord, SymbolValueDict
@@ -38,13 +40,35 @@ from bitquant.base.miner import QuantMiner
 from bitquant.utils.timeutils import TimeUtils
 
 def run_miner():
+    symbols = ["ETHUSDT", "BTCUSDT", "BNBUSDT", "SOLUSDT"]
+    interval = "1h"
+    factor_lis = ["ts_midpoint(ts_natr(high,low,close,7),14)", "ts_delta(dynamic_ts_max(ts_bbands(close,20),28),7)",
+                  "ts_midpoint(ts_ht_trendmode(close),21)"]
+
+    # the factors of every new bar are updated from their streams instead of the whole history
+    factor_calculator = FactorCalculator(function_map, different_axis=['ts', 'symbol', 'return_1'], incremental=True)
+    factor_scaler = FactorScaler(scaling_window=180, orthogonalize=False, orthogonal_method='symmetry',
+                                 ts_normalize=True, cross_section_normalize=False)
+    factor_selector = FactorSelector()
+    factor_aggregator = FactorAggregatorIC(training_window=90, rolling_type="avg", ic_type='pearson')
+    strategy_engine = StrategyEngine(init_factor_lis=factor_lis, factor_calculator=factor_calculator,
+                                     factor_scaler=factor_scaler, factor_selector=factor_selector,
+                                     factor_aggregator=factor_aggregator)
+
+    # just the history a score needs (factor formulations, scaler and aggregator windows), the scheduler appends
+    # every bar as soon as it closes
+    data_client = DataClient(BinanceExchange, secondaries=[BybitExchange])
+    panel = data_client.get_recent_market_panel(symbols, interval, strategy_engine.lookback() + 1)
+
     with QuantMiner() as miner:
         bt.logging.info("Miner running...", time.time())
-        while True:
-            svdict = SymbolValueDict({"BTCUSDT": 4})
-            record = PortfolioRecord(portfolio=svdict)
+
+        def submit(portfolio_weight):
+            record = PortfolioRecord(portfolio=SymbolValueDict(portfolio_weight))
             miner.portfolio.append(record)
-            time.sleep(10)
+
+        # the portfolio is computed and submitted right at every bar close
+        BarScheduler(data_client, panel, strategy_engine.run, submit=submit).run()
 
 
 
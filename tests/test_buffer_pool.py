@@ -0,0 +1,99 @@
+import unittest
+
+import numpy as np
+
+from tests.test_streaming import _FEATURE_NAMES, _features
+
+try:
+    # the primitives of functions.py are talib wrappers
+    import talib as ta
+    from bitquant.quantlib.functions.functions import _function_map, _native_function_map
+    from bitquant.quantlib.signal_generation.factor_calculator import FactorCalculator
+except ImportError:
+    ta = None
+
+
+def _random_tree(rng, function_map, depth, function=None):
+    """(function, children, param) nodes with feature names and float constants as leaves, function at the root"""
+    if function is None:
+        if depth == 0 or rng.random() < 0.2:
+            if rng.random() < 0.15:
+                return float(np.round(rng.uniform(-1, 1), 2))
+            return str(rng.choice(_FEATURE_NAMES))
+        function = function_map[rng.choice(sorted(function_map))]
+    param = int(rng.choice(function.RandRange)) if function.isRandom else None
+    if function.need_param:
+        return function, list(function.need_param), param
+    children = [_random_tree(rng, function_map, depth - 1) for _ in range(function.arity)]
+    # a primitive of constants only is a constant, its children are features instead
+    if all(isinstance(child, float) for child in children):
+        children[0] = "close"
+    return function, children, param
+
+
+def _program(rng, function_map, function):
+    """
+    a random tree with function at its root, as the first argument of a random binary primitive whose second
+    argument is evaluated through the pool while the result of function is held
+    """
+    parent = function_map[rng.choice(sorted(name for name, f in function_map.items() if f.arity == 2))]
+    children = [_random_tree(rng, function_map, 2, function), _random_tree(rng, function_map, 2)]
+    if isinstance(children[1], (str, float)):
+        children[1] = _random_tree(rng, function_map, 2, function_map["ts_sma"])
+    return parent, children, int(rng.choice(parent.RandRange)) if parent.isRandom else None
+
+
+def _formulation(tree):
+    if not isinstance(tree, tuple):
+        return str(tree)
+    function, children, param = tree
+    args = [_formulation(child) for child in children] + ([] if param is None else [str(param)])
+    return f"{function.name}({','.join(args)})"
+
+
+def _evaluate(tree, X, with_out):
+    """the tree without a pool, every primitive allocates its result or writes into a new out array"""
+    if isinstance(tree, str):
+        return X[:, _FEATURE_NAMES.index(tree), :]
+    if isinstance(tree, float):
+        return np.broadcast_to(X.dtype.type(tree), (X.shape[0], X.shape[2]))
+    function, children, param = tree
+    args = [_evaluate(child, X, with_out) for child in children] + ([] if param is None else [param])
+    if with_out and function.has_out:
+        return function(*args, out=np.empty((X.shape[0], X.shape[2]), dtype=X.dtype))
+    return function(*args)
+
+
+@unittest.skipIf(ta is None, "talib is not installed")
+class BufferPoolTestCase(unittest.TestCase):
+    """
+    random programs evaluated through a BufferPool equal the same programs evaluated without it, bitwise, with
+    every primitive in a subtree whose result is held while the pool serves the rest of the program
+    """
+
+    def _check(self, function_map, seed):
+        rng = np.random.default_rng(seed)
+        X = _features()
+        for dtype in (np.float64, np.float32):
+            X_dtype = X.astype(dtype)
+            X_before = X_dtype.copy()
+            for name in sorted(function_map):
+                tree = _program(rng, function_map, function_map[name])
+                formulation = _formulation(tree)
+                with self.subTest(formulation=formulation, dtype=dtype.__name__), \
+                        np.errstate(all='ignore'):
+                    pooled = FactorCalculator.evaluate_formulation(X_dtype, _FEATURE_NAMES, formulation, function_map)
+                    for with_out in (False, True):
+                        np.testing.assert_array_equal(pooled, _evaluate(tree, X_dtype, with_out))
+                    # the features of the caller are never written
+                    np.testing.assert_array_equal(X_dtype, X_before)
+
+    def test_function_map(self):
+        self._check(_function_map, 0)
+
+    def test_native_function_map(self):
+        self._check(_native_function_map, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
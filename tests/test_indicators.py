@@ -0,0 +1,90 @@
+import unittest
+
+import numpy as np
+
+from bitquant.quantlib.functions import indicators
+
+try:
+    import talib as ta
+except ImportError:
+    ta = None
+
+
+def _prices(n_rows=400, leading_nans=(0, 1, 7, 50), seed=0):
+    """high, low, close of a random walk per symbol, the columns start after their number of leading nans"""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (n_rows, len(leading_nans))), axis=0))
+    spread = np.abs(rng.normal(0, 0.005, close.shape)) * close
+    high = close + spread
+    low = close - spread
+    for j, n in enumerate(leading_nans):
+        high[:n, j] = low[:n, j] = close[:n, j] = np.nan
+    return high, low, close
+
+
+# indicator of indicators.py -> (talib function, number of price inputs, kwargs)
+_CASES = {
+    "sma": (lambda: ta.SMA, 1, {"timeperiod": 14}),
+    "ema": (lambda: ta.EMA, 1, {"timeperiod": 14}),
+    "dema": (lambda: ta.DEMA, 1, {"timeperiod": 14}),
+    "tema": (lambda: ta.TEMA, 1, {"timeperiod": 14}),
+    "kama": (lambda: ta.KAMA, 1, {"timeperiod": 14}),
+    "rsi": (lambda: ta.RSI, 1, {"timeperiod": 14}),
+    "linearreg": (lambda: ta.LINEARREG, 1, {"timeperiod": 14}),
+    "linearreg_slope": (lambda: ta.LINEARREG_SLOPE, 1, {"timeperiod": 14}),
+    "linearreg_intercept": (lambda: ta.LINEARREG_INTERCEPT, 1, {"timeperiod": 14}),
+    "linearreg_angle": (lambda: ta.LINEARREG_ANGLE, 1, {"timeperiod": 14}),
+    "tsf": (lambda: ta.TSF, 1, {"timeperiod": 14}),
+    "atr": (lambda: ta.ATR, 3, {"timeperiod": 14}),
+    "natr": (lambda: ta.NATR, 3, {"timeperiod": 14}),
+    "dx": (lambda: ta.DX, 3, {"timeperiod": 14}),
+    "adx": (lambda: ta.ADX, 3, {"timeperiod": 14}),
+    "correl": (lambda: ta.CORREL, 2, {"timeperiod": 30}),
+    "beta": (lambda: ta.BETA, 2, {"timeperiod": 5}),
+}
+
+
+@unittest.skipIf(ta is None, "talib is not installed")
+class IndicatorsMatchTalibTestCase(unittest.TestCase):
+    """every numba indicator equals ta.XXX of each column, on float64 and float32 columns with leading nans"""
+
+    def _inputs(self, n_inputs, dtype):
+        high, low, close = (x.astype(dtype) for x in _prices())
+        return {1: [close], 2: [high, low], 3: [high, low, close]}[n_inputs]
+
+    def _expected(self, talib_function, xs, kwargs, output):
+        expected = np.empty(xs[0].shape)
+        for j in range(xs[0].shape[1]):
+            outputs = talib_function(*(x[:, j].astype(np.float64) for x in xs), **kwargs)
+            expected[:, j] = outputs if output is None else outputs[output]
+        return expected
+
+    def _check(self, name, indicator, talib_function, n_inputs, kwargs, output=None):
+        for dtype, rtol in ((np.float64, 1e-9), (np.float32, 1e-5)):
+            with self.subTest(indicator=name, output=output, dtype=dtype.__name__):
+                xs = self._inputs(n_inputs, dtype)
+                result = indicator(*xs, **kwargs)
+                if output is not None:
+                    result = result[output]
+                self.assertEqual(result.dtype, dtype)
+                expected = self._expected(talib_function, xs, kwargs, output)
+                np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+                scale = np.nanmax(np.abs(expected))
+                np.testing.assert_allclose(result, expected, rtol=rtol, atol=rtol * scale)
+
+    def test_indicators(self):
+        for name, (talib_function, n_inputs, kwargs) in _CASES.items():
+            self._check(name, getattr(indicators, name), talib_function(), n_inputs, kwargs)
+
+    def test_bbands(self):
+        for output in range(3):
+            self._check("bbands", indicators.bbands, ta.BBANDS, 1, {"timeperiod": 20}, output)
+
+    def test_macd(self):
+        for output in range(3):
+            self._check("macd", indicators.macd, ta.MACD, 1,
+                        {"fastperiod": 12, "slowperiod": 26, "signalperiod": 9}, output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+
+from tests.test_indicators import _prices
+
+try:
+    # the primitives of functions.py are talib wrappers
+    import talib as ta
+    from bitquant.quantlib.functions.functions import _function_map, _native_function_map
+    from bitquant.quantlib.functions.streaming import _stream_map
+    from bitquant.quantlib.signal_generation.factor_calculator import FactorStream
+except ImportError:
+    ta = None
+
+_FEATURE_NAMES = ["open", "high", "low", "close", "volume"]
+
+
+def _features():
+    """X (n_ts, n_feature, n_symbols) of the prices of test_indicators, open is the close before and volume random"""
+    high, low, close = _prices()
+    open_ = np.concatenate([close[:1], close[:-1]])
+    first_bar = np.isnan(open_) & ~np.isnan(close)
+    open_[first_bar] = close[first_bar]
+    volume = np.abs(np.random.default_rng(1).normal(1000, 300, close.shape))
+    volume[np.isnan(close)] = np.nan
+    return np.stack([open_, high, low, close, volume], axis=1)
+
+
+def _formulation(function):
+    """a node of function on the features, with the middle int parameter of its random range"""
+    args = list(function.need_param) if function.need_param else ["close", "open"][:function.arity]
+    if function.isRandom:
+        args.append(str(function.RandRange[len(function.RandRange) // 2]))
+    return f"{function.name}({','.join(args)})"
+
+
+@unittest.skipIf(ta is None, "talib is not installed")
+class StreamMatchesBatchTestCase(unittest.TestCase):
+    """init on the first rows then update bar by bar equals init on all rows, for every primitive of _stream_map"""
+
+    n_init = 300
+
+    def _check(self, function_map):
+        X = _features()
+        for dtype, rtol in ((np.float64, 1e-9), (np.float32, 1e-5)):
+            X_dtype = X.astype(dtype)
+            for name in _stream_map:
+                formulation = _formulation(function_map[name])
+                with self.subTest(formulation=formulation, dtype=dtype.__name__):
+                    expected = FactorStream(formulation, function_map).init(X_dtype, _FEATURE_NAMES)[self.n_init:]
+                    stream = FactorStream(formulation, function_map)
+                    stream.init(X_dtype[:self.n_init], _FEATURE_NAMES)
+                    result = np.array([stream.update(x) for x in X_dtype[self.n_init:]])
+                    self.assertEqual(result.dtype, expected.dtype)
+                    np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+                    finite = np.isfinite(expected)
+                    scale = np.abs(expected[finite]).max(initial=1.)
+                    np.testing.assert_allclose(result, expected, rtol=rtol, atol=rtol * scale)
+
+    def test_function_map(self):
+        self._check(_function_map)
+
+    def test_native_function_map(self):
+        self._check(_native_function_map)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import unittest
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from bitquant.quantlib.functions import utils
+
+
+def _columns(n_rows=400, seed=0):
+    """
+    Columns with the cases of the rolling and cross sectional kernels: a plain random walk, a late start,
+    scattered nan gaps, ties (values rounded to 0.5) and runs of one constant value.
+    """
+    rng = np.random.default_rng(seed)
+    A = np.cumsum(rng.normal(0, 1, (n_rows, 6)), axis=0)
+    A[:50, 1] = np.nan
+    A[rng.random(n_rows) < 0.15, 2] = np.nan
+    A[:, 3] = np.round(A[:, 3] * 2) / 2
+    A[100:160, 4] = 3.
+    A[300:, 4] = -1.
+    A[:, 5] = np.round(A[:, 5])
+    A[rng.random(n_rows) < 0.1, 5] = np.nan
+    return A
+
+
+class _ReferenceTestCase(unittest.TestCase):
+    """the kernels on float64 and float32 input against the pandas reference computed on the float64 values"""
+
+    def _check(self, kernel, reference, A=None):
+        A = _columns() if A is None else A
+        for dtype, rtol in ((np.float64, 1e-9), (np.float32, 1e-5)):
+            with self.subTest(dtype=dtype.__name__):
+                A_dtype = A.astype(dtype)
+                result = kernel(A_dtype)
+                self.assertEqual(result.dtype, dtype)
+                expected = np.asarray(reference(A_dtype.astype(np.float64)), dtype=np.float64)
+                np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+                scale = np.abs(expected[np.isfinite(expected)]).max(initial=1.)
+                np.testing.assert_allclose(result, expected, rtol=rtol, atol=rtol * scale)
+                # out= gets the same values
+                out = np.empty(A.shape, dtype=dtype)
+                self.assertIs(kernel(A_dtype, out=out), out)
+                np.testing.assert_array_equal(out, result)
+
+
+def _nan_dropped(A, statistic):
+    """statistic of the rolling window of the non nan values of every column, nan rows stay nan"""
+    return pd.DataFrame({j: statistic(pd.Series(A[:, j]).dropna()) for j in range(A.shape[1])},
+                        index=range(len(A))).to_numpy()
+
+
+class RollingMomentsTestCase(_ReferenceTestCase):
+
+    def test_rolling_nanmean(self):
+        for window in (1, 5, 28):
+            with self.subTest(window=window):
+                self._check(lambda A, out=None: utils.rolling_nanmean(A, window, out=out),
+                            lambda A: _nan_dropped(A, lambda s: s.rolling(window).mean()))
+
+    def test_rolling_nanstd(self):
+        for window in (2, 5, 28):
+            with self.subTest(window=window):
+                self._check(lambda A, out=None: utils.rolling_nanstd(A, window, out=out),
+                            lambda A: _nan_dropped(A, lambda s: s.rolling(window).std()))
+
+    def test_constant_window(self):
+        # a constant window is its exact value with std 0, not a rounding residual
+        A = _columns()
+        np.testing.assert_array_equal(utils.rolling_nanmean(A, 20)[120:160, 4], 3.)
+        np.testing.assert_array_equal(utils.rolling_nanstd(A, 20)[120:160, 4], 0.)
+
+
+def _rolling_arg(A, window, min_periods, arg):
+    """position of np.nanargmax / nanargmin in the window, 0 for the oldest row, first occurrence for ties"""
+
+    def position(w):
+        return window - len(w) + arg(w)
+
+    return pd.DataFrame(A).rolling(window, min_periods=min_periods).apply(position, raw=True).to_numpy()
+
+
+class RollingExtremumTestCase(_ReferenceTestCase):
+
+    def test_rolling_extremum(self):
+        for window, min_periods in ((1, None), (7, None), (28, None), (28, 3)):
+            for name, arg in (("max", None), ("min", None), ("argmax", np.nanargmax), ("argmin", np.nanargmin)):
+                kernel = getattr(utils, "rolling_" + name)
+                if arg is None:
+                    def reference(A, name=name):
+                        return getattr(pd.DataFrame(A).rolling(window, min_periods=min_periods), name)()
+                else:
+                    def reference(A, arg=arg):
+                        return _rolling_arg(A, window, min_periods, arg)
+                with self.subTest(name=name, window=window, min_periods=min_periods):
+                    self._check(lambda A, out=None: kernel(A, window, min_periods=min_periods, out=out), reference)
+
+
+def _cross_sections(seed=0):
+    """the rows of _columns as the cross sections, with a row of ties, a constant row and an all nan row"""
+    A = _columns(seed=seed)
+    A[10] = [1., 1., 2., 2., np.nan, 3.]
+    A[11] = 4.
+    A[12] = np.nan
+    return A
+
+
+class CrossSectionTestCase(_ReferenceTestCase):
+
+    def test_cs_rank(self):
+        self._check(utils.cs_rank, lambda A: pd.DataFrame(A).rank(axis=1, pct=True), _cross_sections())
+
+    def test_cs_quantile(self):
+        for n_buckets in (1, 3, 5, 10):
+            def reference(A):
+                df = pd.DataFrame(A)
+                return np.floor((df.rank(axis=1) - 1).to_numpy() * n_buckets / df.count(axis=1).to_numpy()[:, None])
+
+            with self.subTest(n_buckets=n_buckets):
+                self._check(lambda A, out=None: utils.cs_quantile(A, n_buckets, out=out), reference, _cross_sections())
+
+    def test_cs_zscore(self):
+        def reference(A):
+            df = pd.DataFrame(A)
+            return df.sub(df.mean(axis=1), axis=0).div(df.std(axis=1, ddof=0).clip(lower=1e-8), axis=0)
+
+        self._check(utils.cs_zscore, reference, _cross_sections())
+
+    def test_cs_demean(self):
+        def reference(A):
+            df = pd.DataFrame(A)
+            return df.sub(df.mean(axis=1), axis=0)
+
+        self._check(utils.cs_demean, reference, _cross_sections())
+
+    def test_cs_nanquantile(self):
+        A = _cross_sections()
+        for dtype in (np.float64, np.float32):
+            for q in (0., 0.2, 0.5, 0.8, 1.):
+                with self.subTest(dtype=dtype.__name__, q=q):
+                    A_dtype = A.astype(dtype)
+                    # np.nanquantile warns on the all nan row
+                    with warnings.catch_warnings():
+                        warnings.simplefilter("ignore", RuntimeWarning)
+                        expected = np.nanquantile(A_dtype.astype(np.float64), q, axis=1)
+                    np.testing.assert_allclose(utils.cs_nanquantile(A_dtype, q), expected, rtol=1e-12)
+
+    def test_cs_corr(self):
+        X, Y = _cross_sections(seed=0), _cross_sections(seed=1)
+        # a constant side on one row only
+        Y[20] = 2.
+        for dtype, rtol in ((np.float64, 1e-9), (np.float32, 1e-5)):
+            with self.subTest(dtype=dtype.__name__):
+                X_dtype, Y_dtype = X.astype(dtype), Y.astype(dtype)
+                x, y = X_dtype.astype(np.float64), Y_dtype.astype(np.float64)
+                expected = np.full(len(x), np.nan)
+                for i in range(len(x)):
+                    if not np.isnan(x[i]).any() and not np.isnan(y[i]).any() and np.ptp(x[i]) and np.ptp(y[i]):
+                        expected[i] = np.corrcoef(x[i], y[i])[0, 1]
+                np.testing.assert_allclose(utils.cs_corr(X_dtype, Y_dtype), expected, rtol=rtol, atol=rtol)
+                # on the ranks it is the spearman correlation of the rows
+                spearman = np.array([pd.Series(x[i]).corr(pd.Series(y[i]), method="spearman")
+                                     if not np.isnan(expected[i]) else np.nan for i in range(len(x))])
+                np.testing.assert_allclose(utils.cs_corr(utils.cs_rank(X_dtype, out=np.empty(x.shape)),
+                                                         utils.cs_rank(Y_dtype, out=np.empty(y.shape))),
+                                           spearman, rtol=1e-9, atol=1e-9)
+
+
+class RollingOrderStatTestCase(_ReferenceTestCase):
+
+    def test_rolling_rank(self):
+        for window, min_periods in ((1, None), (7, None), (28, None), (28, 3)):
+            with self.subTest(window=window, min_periods=min_periods):
+                self._check(lambda A, out=None: utils.rolling_rank(A, window, min_periods=min_periods, out=out),
+                            lambda A: pd.DataFrame(A).rolling(window, min_periods=min_periods).rank(pct=True))
+
+    def test_rolling_quantile(self):
+        for window, min_periods in ((1, None), (7, None), (28, None), (28, 3)):
+            for q in (0., 0.25, 0.5, 0.9, 1.):
+                with self.subTest(window=window, min_periods=min_periods, q=q):
+                    self._check(lambda A, out=None: utils.rolling_quantile(A, window, q, min_periods, out=out),
+                                lambda A: pd.DataFrame(A).rolling(window, min_periods=min_periods).quantile(q))
+
+
+if __name__ == "__main__":
+    unittest.main()